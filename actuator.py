@@ -0,0 +1,137 @@
+import heapq
+import threading
+
+# --- Actuator ---
+# One thread owns the relays. Everyone else submits {relay: bool} commands and
+# gets a ticket back at once; a slow break-before-make sequence (dead time,
+# see relays.py) runs on this thread, never on a request handler or the
+# control loop. Waiting commands form a priority queue (safety trip > manual
+# override > auto policy, first come first served within a level), and each
+# one is applied whole, as a single RelayBank transaction, so its breaks
+# always come before its makes. A command should therefore carry the whole
+# source vector it wants, not just the relay it turns on.
+#
+# Coalescing: a new command takes its relays out of every older command
+# still waiting. One left with nothing to do is dropped, and the new command
+# inherits its priority and answers its ticket, so a policy vector that
+# supersedes a queued safety trip still goes first.
+
+SAFETY, MANUAL, AUTO = 0, 1, 2
+PRIORITY_NAMES = ("safety", "manual", "auto")
+
+
+class _Command:
+    __slots__ = ("priority", "ticket", "changes", "tickets")
+
+    def __init__(self, priority, ticket, changes):
+        self.priority = priority
+        self.ticket = ticket
+        self.changes = changes
+        self.tickets = [ticket]  # this one and those it superseded
+
+    def __lt__(self, other):
+        return (self.priority, self.ticket) < (other.priority, other.ticket)
+
+
+class Actuator:
+    """Applies submitted relay commands to a relays.RelayBank on its own thread.
+
+    Until start() (and after stop()), submit() applies in the calling thread,
+    so ControlLoop.run_for() on a VirtualClock stays synchronous.
+    """
+
+    def __init__(self, relays, on_applied=None, name="actuator"):
+        self.relays = relays
+        # Called on this thread with the names written, before the command's
+        # waiters are released (e.g. to publish the new relay status)
+        self.on_applied = on_applied
+        self.name = name
+        self.commands = [0] * len(PRIORITY_NAMES)  # submitted, per priority
+        self.coalesced = 0  # commands dropped because newer ones superseded them
+        self.errors = 0
+        self.submitted = 0  # ticket of the latest command
+        self._queue = []  # heap of _Command; superseded ones stay, empty, until popped
+        self._unfinished = set()  # tickets not applied yet
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def depth(self):
+        """Commands waiting to be applied."""
+        return sum(1 for command in self._queue if command.changes)
+
+    def submit(self, changes, priority=AUTO):
+        """Queue {relay: bool}; returns a ticket for wait() without waiting."""
+        with self._cond:
+            self.submitted += 1
+            command = _Command(priority, self.submitted, {name: bool(value)
+                                                          for name, value in changes.items()})
+            for queued in self._queue:
+                if not queued.changes:
+                    continue
+                for name in command.changes:
+                    queued.changes.pop(name, None)
+                if not queued.changes:  # wholly superseded
+                    self.coalesced += 1
+                    command.tickets += queued.tickets
+                    queued.tickets = []
+                    command.priority = min(command.priority, queued.priority)
+            heapq.heappush(self._queue, command)
+            self._unfinished.add(command.ticket)
+            self.commands[priority] += 1
+            running = self._running
+            self._cond.notify_all()
+        if not running:
+            self._drain()
+        return command.ticket
+
+    def wait(self, ticket, timeout=None):
+        """Block until the command numbered `ticket` (or one superseding it) is applied."""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket not in self._unfinished, timeout)
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self._thread
+            self._running = True
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Apply what is queued, then stop the thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._running and not self._queue:
+                    return
+            self._drain()
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return
+                command = heapq.heappop(self._queue)
+            written = []
+            if command.changes:
+                try:
+                    written = self.relays.apply(command.changes)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Actuator error ({PRIORITY_NAMES[command.priority]}): {e}")
+            if written and self.on_applied is not None:
+                self.on_applied(written)
+            with self._cond:
+                self._unfinished.difference_update(command.tickets)
+                self._cond.notify_all()
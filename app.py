@@ -1,186 +1,266 @@
-from flask import Flask, render_template, jsonify, request
-from gpiozero import OutputDevice
+from flask import Flask, Response, render_template, jsonify, request
+import shutil
+import sys
 import threading
 import time
 import os
 import tempfile
+import assets
+import metrics
+from engine import StateStore
+from policy import PolicyFile
+from relays import DEAD_TIME, RELAY_LOCK, RelayBank, claim_relays, load_dead_time, open_relays
+from stream import SSE_HEADERS, event_stream, parse_last_event_id
 
-# Create a secure temporary directory
-temp_dir = tempfile.mkdtemp()
-os.environ['TMPDIR'] = temp_dir
-
-app = Flask(__name__)
-
-# GPIO Setup (BCM numbering)
-try:
-    RELAY_SOLAR = OutputDevice(14, active_high=False)  # IN1
-    RELAY_GRID = OutputDevice(18, active_high=False)   # IN2
-    RELAY_BATT = OutputDevice(27, active_high=False)   # IN3
-    RELAY_LOAD = OutputDevice(2, active_high=False)   # IN4
-except Exception as e:
-    print(f"GPIO initialization error: {e}. Using dummy devices.")
-    # Create dummy devices for testing
-    class DummyDevice:
-        def __init__(self): self.value = False
-        def on(self): self.value = True
-        def off(self): self.value = False
-    RELAY_SOLAR = DummyDevice()
-    RELAY_GRID = DummyDevice()
-    RELAY_BATT = DummyDevice()
-    RELAY_LOAD = DummyDevice()
-
-# System state
-system_state = {
+# --- Configuration ---
+# create_app(config) reads these keys (those in ENV_KEYS may also come from
+# the environment). Importing this module touches no hardware and
+# starts no thread; see EnergySystem.start().
+DEFAULT_CONFIG = {
+    "EMS_PINS": {"solar": 14, "grid": 18, "battery": 27, "load": 2},  # BCM, IN1-IN4
+    "EMS_POLICY": None,
+    "EMS_RELAY_LOCK": RELAY_LOCK,  # only one process drives the relays ("" disables)
+    "EMS_DEAD_TIME": DEAD_TIME,  # release time before a make: seconds, or {relay: seconds}
+    "EMS_LAZY_START": True,  # claim the relays and start the simulation on the first request
+    "EMS_DUMMY_RELAYS": True,  # no GPIO (not a Pi): run on in-memory relays; 0 refuses instead
+}
+ENV_KEYS = ("EMS_POLICY", "EMS_RELAY_LOCK", "EMS_DEAD_TIME", "EMS_DUMMY_RELAYS")
+
+# Source priority and load shedding as a compiled table (see policy.py);
+# EMS_POLICY may name a JSON file that overrides these and is hot-reloaded
+DEFAULT_POLICY = {
+    "priority": ["solar", "grid", "battery"],
+    "shed_below": 25,
+    "restore_above": None,
+    "shed_on": ["solar", "grid", "battery"],
     "mode": "auto",
-    "power_source": "battery",
-    "battery_level": 85,
-    "solar_available": False,
-    "grid_available": True,
-    "critical_load": True,
-    "non_critical_load": True,
-    "relay_status": {
-        "solar": RELAY_SOLAR.value,
-        "grid": RELAY_GRID.value,
-        "battery": RELAY_BATT.value,
-        "load": RELAY_LOAD.value
-    }
 }
 
-# Simulated battery drain/charge thread
-def simulate_system():
-    while True:
-        try:
-            # Update relay status
-            system_state["relay_status"] = {
-                "solar": RELAY_SOLAR.value,
-                "grid": RELAY_GRID.value,
-                "battery": RELAY_BATT.value,
-                "load": RELAY_LOAD.value
-            }
-            
-            # Simulate battery changes
-            if system_state["power_source"] == "solar" and system_state["solar_available"]:
-                system_state["battery_level"] = min(100, system_state["battery_level"] + 1)
-            elif system_state["power_source"] == "grid" and system_state["grid_available"]:
-                system_state["battery_level"] = min(100, system_state["battery_level"] + 0.5)
-            else:
-                system_state["battery_level"] = max(0, system_state["battery_level"] - 0.3)
-            
-            # Auto mode logic
-            if system_state["mode"] == "auto":
-                # Power source priority: Solar > Grid > Battery
-                if system_state["solar_available"]:
-                    switch_to_solar()
-                elif system_state["grid_available"]:
-                    switch_to_grid()
-                else:
-                    switch_to_battery()
-                
-                # Load shedding when battery low
-                if system_state["battery_level"] < 25:
-                    RELAY_LOAD.off()
-                    system_state["non_critical_load"] = False
-                else:
-                    RELAY_LOAD.on()
-                    system_state["non_critical_load"] = True
-            
-            time.sleep(1)
-        except Exception as e:
-            print(f"Simulation error: {e}")
-            time.sleep(5)
+# Create dummy devices for testing
+class DummyDevice:
+    def __init__(self): self.value = False
+    def on(self): self.value = True
+    def off(self): self.value = False
 
-# Power switching functions
-def switch_to_solar():
-    try:
-        RELAY_SOLAR.on()
-        RELAY_GRID.off()
-        RELAY_BATT.off()
-        system_state["power_source"] = "solar"
-    except Exception as e:
-        print(f"Solar switch error: {e}")
 
-def switch_to_grid():
-    try:
-        RELAY_SOLAR.off()
-        RELAY_GRID.on()
-        RELAY_BATT.off()
-        system_state["power_source"] = "grid"
-    except Exception as e:
-        print(f"Grid switch error: {e}")
+class EnergySystem:
+    """State, relays and simulation thread; hardware is claimed by start()."""
 
-def switch_to_battery():
-    try:
-        RELAY_SOLAR.off()
-        RELAY_GRID.off()
-        RELAY_BATT.on()
-        system_state["power_source"] = "battery"
-    except Exception as e:
-        print(f"Battery switch error: {e}")
+    def __init__(self, config):
+        self.config = config
+        self.policies = PolicyFile(config["EMS_POLICY"], DEFAULT_POLICY)
 
-# Start simulation thread
-sim_thread = threading.Thread(target=simulate_system, daemon=True)
-sim_thread.start()
+        # System state
+        self.state = {
+            "mode": self.policies.policy.mode,
+            "power_source": "battery",
+            "battery_level": 85,
+            "solar_available": False,
+            "grid_available": True,
+            "critical_load": True,
+            "non_critical_load": True,
+            "relay_status": {name: False for name in config["EMS_PINS"]}
+        }
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+        # Published state snapshots for /stream
+        self.state_store = StateStore()
 
-@app.route('/status')
-def get_status():
-    return jsonify(system_state)
+        # Prometheus metrics at /metrics (tick timings, relay switches, state
+        # gauges, per-route latency)
+        self.registry = metrics.Registry()
+        self.loop_metrics = metrics.LoopMetrics(self.registry)
+        metrics.register_state(self.registry, self.state_store)
+
+        self.relays = None
+        self.sim_thread = None
+        self.started = False
+        self._relay_lock = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Claim the relays and start the simulation thread (once)."""
+        with self._start_lock:
+            if self.started:
+                return self
+            # Another process driving the relays is never papered over: a
+            # dashboard that controls nothing is worse than no dashboard
+            self._relay_lock = claim_relays(self.config["EMS_RELAY_LOCK"])
+
+            # GPIO Setup (BCM numbering)
+            try:
+                devices = open_relays(self.config["EMS_PINS"], active_high=False)
+            except Exception as e:
+                if self.config["EMS_DUMMY_RELAYS"] in (False, None, "", "0", "false"):
+                    if self._relay_lock is not None:
+                        self._relay_lock.close()  # a retry (or another process) may claim them
+                        self._relay_lock = None
+                    raise RuntimeError(f"GPIO initialization error: {e} "
+                                       "(EMS_DUMMY_RELAYS is off)") from e
+                print(f"GPIO initialization error: {e}. Using dummy devices.")
+                devices = {name: DummyDevice() for name in self.config["EMS_PINS"]}
+
+            # All relay writes go through the bank: only changed bits hit the GPIO,
+            # and a make waits out the release time of the relays just broken
+            self.relays = RelayBank(devices,
+                                    dead_time=load_dead_time(self.config["EMS_DEAD_TIME"]))
+            metrics.register_relays(self.registry, self.relays)
+            self.state["relay_status"] = self.relays.status()
+            self.state_store.publish(self.state)
+
+            # Start simulation thread
+            self.sim_thread = threading.Thread(target=self.simulate_system, daemon=True)
+            self.sim_thread.start()
+            self.started = True
+        return self
+
+    # Simulated battery drain/charge thread
+    def simulate_system(self):
+        system_state, relays = self.state, self.relays
+        expected = time.perf_counter()
+        while True:
+            began = time.perf_counter()
+            try:
+                # Update relay status
+                system_state["relay_status"] = relays.status()
+
+                # Simulate battery changes
+                if system_state["power_source"] == "solar" and system_state["solar_available"]:
+                    system_state["battery_level"] = min(100, system_state["battery_level"] + 1)
+                elif system_state["power_source"] == "grid" and system_state["grid_available"]:
+                    system_state["battery_level"] = min(100, system_state["battery_level"] + 0.5)
+                else:
+                    system_state["battery_level"] = max(0, system_state["battery_level"] - 0.3)
+
+                # Source and load relay from the policy table (None in manual mode)
+                decision = self.policies.current().decide(
+                    system_state["solar_available"], system_state["grid_available"], True,
+                    system_state["battery_level"], relays.is_on("load"), system_state["mode"])
+                if decision is not None:
+                    source, load_on = decision
+                    self.switch_to(source)
+                    relays.set("load", load_on)
+                    system_state["non_critical_load"] = load_on
+
+                self.state_store.publish(system_state)
+                self.loop_metrics.observe_tick(time.perf_counter() - began, began - expected)
+                expected = time.perf_counter() + 1
+                time.sleep(1)
+            except Exception as e:
+                print(f"Simulation error: {e}")
+                expected = time.perf_counter() + 5
+                time.sleep(5)
+
+    # Power switching (None disconnects every source)
+    def switch_to(self, source):
+        try:
+            self.relays.select(source)
+            self.state["power_source"] = source or "none"
+        except Exception as e:
+            print(f"{(source or 'none').capitalize()} switch error: {e}")
+
+    def apply_control(self, data):
+        """Apply a /control payload and publish the result."""
+        system_state, relays = self.state, self.relays
 
-@app.route('/control', methods=['POST'])
-def control():
-    try:
-        data = request.json
-        
         # Mode toggle
         if "mode" in data:
             system_state["mode"] = data["mode"]
-        
+
         # Manual relay control
         if "relay" in data and "state" in data:
             relay_name = data["relay"]
             state = data["state"]
-            
-            if relay_name == "solar":
-                RELAY_SOLAR.value = state
-                if state:
-                    system_state["power_source"] = "solar"
-            elif relay_name == "grid":
-                RELAY_GRID.value = state
-                if state:
-                    system_state["power_source"] = "grid"
-            elif relay_name == "battery":
-                RELAY_BATT.value = state
+
+            if relay_name in ("solar", "grid", "battery"):
+                relays.set(relay_name, state)
                 if state:
-                    system_state["power_source"] = "battery"
+                    system_state["power_source"] = relay_name
             elif relay_name == "load":
-                RELAY_LOAD.value = state
+                relays.set("load", state)
                 system_state["non_critical_load"] = state
-        
+
         # Source availability toggles
         if "solar_available" in data:
             system_state["solar_available"] = data["solar_available"]
-        
+
         if "grid_available" in data:
             system_state["grid_available"] = data["grid_available"]
-        
-        return jsonify(success=True)
-    except Exception as e:
-        print(f"Control error: {e}")
-        return jsonify(success=False, error=str(e)), 500
 
-def cleanup_temp_dir():
+        self.state_store.publish(system_state)
+
+
+def create_app(config=None):
+    """The Flask app; its EnergySystem is app.extensions["ems"].
+
+    The relays are claimed and the simulation started with the first request
+    (or an explicit start()), not when the app is created.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update({key: os.environ[key] for key in ENV_KEYS if key in os.environ})
+    app.config.update(config or {})
+    system = app.extensions["ems"] = EnergySystem(app.config)
+    metrics.init_app(app, system.registry)
+    assets.serve_static(app)
+
+    if app.config["EMS_LAZY_START"]:
+        @app.before_request
+        def start_system():
+            if not system.started:
+                system.start()
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    @app.route('/status')
+    def get_status():
+        # JSON encoded once per state version; If-None-Match gets a 304
+        return assets.status_response(system.state_store)
+
+    @app.route('/stream')
+    def stream():
+        last_id = parse_last_event_id(request.headers.get('Last-Event-ID', request.args.get('since')))
+        return Response(event_stream(system.state_store, last_id),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    @app.route('/control', methods=['POST'])
+    def control():
+        try:
+            system.apply_control(request.json)
+            return jsonify(success=True)
+        except Exception as e:
+            print(f"Control error: {e}")
+            return jsonify(success=False, error=str(e)), 500
+
+    return app
+
+def cleanup_temp_dir(temp_dir):
     try:
-        import shutil
         shutil.rmtree(temp_dir)
         print(f"Cleaned up temp directory: {temp_dir}")
     except Exception as e:
         print(f"Cleanup error: {e}")
 
 if __name__ == '__main__':
+    # debug=True runs this file twice: the reloader's watcher, which never
+    # serves, and the server it restarts on changes (WERKZEUG_RUN_MAIN is set
+    # there). The watcher creates the private temp dir, which the server
+    # inherits through TMPDIR; only the server claims the relays.
+    serving = os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    temp_dir = None
+    if not serving:
+        # Create a secure temporary directory
+        temp_dir = tempfile.mkdtemp()
+        os.environ['TMPDIR'] = temp_dir
+    app = create_app()
+    if serving:
+        try:
+            app.extensions["ems"].start()
+        except RuntimeError as e:
+            sys.exit(f"Not starting: {e}")
     try:
         app.run(host='0.0.0.0', port=5000, debug=True)
     finally:
-        cleanup_temp_dir()
+        if temp_dir is not None:
+            cleanup_temp_dir(temp_dir)
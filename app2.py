@@ -1,205 +1,376 @@
-from flask import Flask, render_template, jsonify, request
-from gpiozero import OutputDevice, Device
-from gpiozero.pins.mock import MockFactory
+from flask import Flask, Response, render_template, jsonify, request
+import argparse
 import threading
-import time
 import os
-import shutil
-import tempfile
-
-# Use a mock factory for testing if not on a Pi
-# This is a cleaner way to handle dummy devices
-#try:
-    #import RPi.GPIO
-    # To run on a Pi, comment out the next line:
-    # Device.pin_factory = MockFactory() 
-#except (ImportError, RuntimeError):
-   # print("Not on a Raspberry Pi. Using mock GPIO pins.")
-    #Device.pin_factory = MockFactory()
-
-
-app = Flask(__name__)
-
-# --- GPIO Setup (BCM numbering) ---
-# active_high=False means a LOW signal on the GPIO pin will ACTIVATE the relay.
-RELAY_SOLAR = OutputDevice(17, active_high=False, initial_value=False)  # IN1
-RELAY_GRID = OutputDevice(14, active_high=False, initial_value=False)   # IN2
-RELAY_BATT = OutputDevice(27, active_high=False, initial_value=False)   # IN3
-RELAY_LOAD = OutputDevice(2, active_high=False, initial_value=False)   # IN4
-
-
-# --- System State ---
-# This dictionary is our "single source of truth"
-system_state = {
-    "mode": "auto",  # "auto" or "manual"
-    "power_source": "none", # "solar", "grid", "battery", or "none"
-    "battery_level": 85.0,
-    "solar_available": False,
-    "grid_available": True,
-    "load_on": False,
-    "relay_status": {} # This will be updated periodically
+from collections import deque
+import assets
+import metrics
+from actuator import AUTO, MANUAL, PRIORITY_NAMES, SAFETY, Actuator
+from commands import parse_commands
+from conditioning import Conditioner
+from engine import ControlLoop, StateStore, make_clock
+from policy import PolicyFile
+from relays import (DEAD_TIME, RELAY_LOCK, SOURCES, RelayBank, claim_relays, load_dead_time,
+                    open_relays)
+from sense import DEFAULT_BOUNCE, SenseInputs, load_pins
+from sensors import SensorPipeline, load_spec
+from stream import SSE_HEADERS, event_stream, parse_last_event_id
+
+# --- Configuration ---
+# create_app(config) reads these keys; EMS_* environment variables of the same
+# name override the defaults. Nothing touches the GPIO until start().
+DEFAULT_CONFIG = {
+    "EMS_PINS": {"solar": 17, "grid": 14, "battery": 27, "load": 2},  # BCM, IN1-IN4
+    "EMS_TIME_SCALE": None,  # speed-up factor, or "virtual"
+    "EMS_POLICY": None,  # JSON policy file, reloaded when it changes
+    "EMS_RELAY_LOCK": RELAY_LOCK,  # only one process drives the relays ("" disables)
+    "EMS_DEAD_TIME": DEAD_TIME,  # release time before a make: seconds, or {relay: seconds}
+    "EMS_LAZY_START": True,  # claim the relays and start the loop on the first request
+    "EMS_CONDITIONING": None,  # None: raw inputs; {} or overrides: debounce/dwell/rate on
+    "EMS_SENSORS": None,  # None: simulated battery; "fake", a spec or JSON file (see sensors.py)
+    "EMS_SENSE_PINS": None,  # edge-triggered availability inputs, {input: BCM pin} (see sense.py)
+    "EMS_SENSE_BOUNCE": DEFAULT_BOUNCE,  # seconds
 }
+ENV_KEYS = ("EMS_TIME_SCALE", "EMS_POLICY", "EMS_RELAY_LOCK", "EMS_SENSORS",
+            "EMS_SENSE_PINS", "EMS_DEAD_TIME", "EMS_CONDITIONING")
 
-# Use a lock to prevent race conditions when accessing system_state from multiple threads
-state_lock = threading.Lock()
-
-# --- Power Switching Functions (Ensures Break-Before-Make) ---
-def switch_to_solar():
-    with state_lock:
-        RELAY_GRID.off()
-        RELAY_BATT.off()
-        time.sleep(0.2) # Small delay to ensure relays have switched off
-        RELAY_SOLAR.on()
-        system_state["power_source"] = "solar"
-    print("Switched to SOLAR")
-
-def switch_to_grid():
-    with state_lock:
-        RELAY_SOLAR.off()
-        RELAY_BATT.off()
-        time.sleep(0.2)
-        RELAY_GRID.on()
-        system_state["power_source"] = "grid"
-    print("Switched to GRID")
-
-def switch_to_battery():
-    with state_lock:
-        RELAY_SOLAR.off()
-        RELAY_GRID.off()
-        time.sleep(0.2)
-        RELAY_BATT.on()
-        system_state["power_source"] = "battery"
-    print("Switched to BATTERY")
-
-def all_sources_off():
-    with state_lock:
-        RELAY_SOLAR.off()
-        RELAY_GRID.off()
-        RELAY_BATT.off()
-        system_state["power_source"] = "none"
-    print("All sources OFF")
-
-# --- Background System Management Thread ---
-def system_manager():
-    while True:
-        try:
-            with state_lock:
-                # --- Part 1: Simulation (can be replaced with real sensor data) ---
-                if system_state["power_source"] == "solar" and system_state["solar_available"]:
-                    system_state["battery_level"] = min(100, system_state["battery_level"] + 0.5) # Slower charge
-                elif system_state["power_source"] == "grid" and system_state["grid_available"]:
-                     # Grid only maintains, doesn't charge in this logic
-                     pass
-                elif system_state["power_source"] == "battery":
-                    # Drain battery only if load is on
-                    if system_state["load_on"]:
-                        system_state["battery_level"] = max(0, system_state["battery_level"] - 1.0) # Faster drain
-                
-                # --- Part 2: Automatic Control Logic ---
-                if system_state["mode"] == "auto":
-                    # Priority: Solar > Grid > Battery
-                    if system_state["solar_available"]:
-                        if system_state["power_source"] != "solar":
-                            switch_to_solar()
-                    elif system_state["grid_available"]:
-                        if system_state["power_source"] != "grid":
-                            switch_to_grid()
-                    else:
-                        if system_state["power_source"] != "battery":
-                            switch_to_battery()
-                    
-                    # Automatic Load Shedding
-                    if system_state["battery_level"] < 25 and system_state["power_source"] == "battery":
-                        RELAY_LOAD.off()
-                        system_state["load_on"] = False
-                        print("AUTO: Load shedding enabled (Battery < 25%)")
-                    elif system_state["battery_level"] > 30: # Hysteresis
-                        RELAY_LOAD.on()
-                        system_state["load_on"] = True
-
-                # --- Part 3: Update Status for Frontend ---
-                system_state["relay_status"] = {
-                    "solar": RELAY_SOLAR.is_active,
-                    "grid": RELAY_GRID.is_active,
-                    "battery": RELAY_BATT.is_active,
-                    "load": RELAY_LOAD.is_active
-                }
-                # Update load status from relay's actual state
-                system_state["load_on"] = RELAY_LOAD.is_active
-
-            time.sleep(2) # Run loop every 2 seconds
-        except Exception as e:
-            print(f"System manager thread error: {e}")
-            time.sleep(5)
-
-# --- Flask Web Routes ---
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/status')
-def get_status():
-    with state_lock:
-        # Return a copy to avoid modification issues
-        return jsonify(system_state.copy())
-
-@app.route('/control', methods=['POST'])
-def control():
-    data = request.json
-    with state_lock:
+# --- Source Policy ---
+# Compiled into a lookup table (see policy.py); EMS_POLICY may point at a JSON
+# file overriding these keys, which is reloaded whenever it changes.
+DEFAULT_POLICY = {
+    "priority": ["solar", "grid", "battery"],
+    "shed_below": 25,
+    "restore_above": 30, # Hysteresis
+    "shed_on": ["battery"],
+    "mode": "auto",
+}
+
+
+class EnergySystem:
+    """Relays, published state and control loop; hardware is claimed by open()."""
+
+    def __init__(self, config):
+        self.config = config
+        # Real time unless EMS_TIME_SCALE (or --time-scale) asks for faster/virtual time
+        self.clock = make_clock(config["EMS_TIME_SCALE"])
+        self.policies = PolicyFile(config["EMS_POLICY"], DEFAULT_POLICY)
+        # Debounced availability and rate-limited transfers (clouds, brownouts)
+        self.conditioner = Conditioner(config["EMS_CONDITIONING"])
+
+        # --- System State ---
+        # Published as immutable, versioned snapshots (see engine.StateStore).
+        # /status and /stream read the current snapshot without taking a lock. The
+        # control loop thread builds each new version off to the side; the actuator
+        # thread only publishes relay_status, once a transition has landed. A slow
+        # relay transition never blocks a reader.
+        self.state_store = StateStore({
+            "mode": self.policies.policy.mode,  # "auto" or "manual"
+            "power_source": "none", # "solar", "grid", "battery", or "none"
+            "battery_level": 85.0,
+            "solar_available": False,
+            "grid_available": True,
+            "load_on": False,
+            "relay_status": {} # This will be updated periodically
+        })
+
+        # /control requests waiting for the control loop to apply them
+        self.pending_commands = deque()
+
+        # --- Metrics (Prometheus text format at /metrics) ---
+        # Loop timings; control_latency is how long a /control command waits in
+        # pending_commands before the loop applies it (this replaced the state lock)
+        self.registry = metrics.Registry()
+        self.loop_metrics = metrics.LoopMetrics(self.registry)
+        metrics.register_state(self.registry, self.state_store)
+        metrics.register_conditioning(self.registry, self.conditioner)
+
+        # Wakes immediately on /control; the 2 s tick only drives the battery simulation
+        self.control_loop = ControlLoop(self.integrate_battery, self.apply_policy,
+                                        interval=2.0, clock=self.clock,
+                                        metrics=self.loop_metrics)
+
+        self.relays = None
+        self.actuator = None  # the one thread writing the relays (see actuator.py)
+        self.requested = None  # relay vector last handed to the actuator
+        self.last_ticket = 0
+        self.sensors = None  # sensors.SensorPipeline when EMS_SENSORS is set
+        self.sense_inputs = None  # sense.SenseInputs when EMS_SENSE_PINS is set
+        self.started = False
+        self._relay_lock = None
+        self._open_lock = threading.Lock()
+
+    def open(self):
+        """Claim the relays and switch everything off (once; no thread)."""
+        with self._open_lock:
+            if self.relays is not None:
+                return
+            self._relay_lock = claim_relays(self.config["EMS_RELAY_LOCK"])
+
+            # --- GPIO Setup (BCM numbering) ---
+            # active_high=False means a LOW signal on the GPIO pin will ACTIVATE the relay.
+            # All relay writes go through the bank: only changed bits hit the GPIO, and a
+            # source change breaks the old relays, waits out their release time
+            # (EMS_DEAD_TIME), then makes the new one.
+            self.relays = RelayBank(open_relays(self.config["EMS_PINS"], active_high=False,
+                                                initial_value=False),
+                                    dead_time=load_dead_time(self.config["EMS_DEAD_TIME"]))
+            metrics.register_relays(self.registry, self.relays)
+            # Relay transitions run on the actuator thread, which publishes the new
+            # relay_status before anyone waiting on the command is released
+            self.actuator = Actuator(self.relays, on_applied=self.publish_relays)
+            metrics.register_actuator(self.registry, self.actuator, PRIORITY_NAMES)
+
+            # Measured battery and availability inputs, sampled on their own thread
+            sensor_spec = load_spec(self.config["EMS_SENSORS"])
+            sense_pins = load_pins(self.config["EMS_SENSE_PINS"])
+            if sensor_spec is not None:
+                # Inputs with a sense pin come from its edges, not the tick average
+                self.sensors = SensorPipeline(sensor_spec, skip=sense_pins or ())
+                metrics.register_sensors(self.registry, self.sensors)
+
+            # Availability sense lines: each edge is applied at once (see sense())
+            if sense_pins is not None:
+                self.sense_inputs = SenseInputs(sense_pins, self.sense,
+                                                self.config["EMS_SENSE_BOUNCE"])
+
+            # Initialize all relays to OFF at the start
+            self.all_sources_off()
+            self.relays.set("load", False)
+            self.requested = self.relays.status()
+            sensed = self.sense_inputs.values() if self.sense_inputs is not None else {}
+            self.state_store.update(relay_status=self.relays.status(), **sensed)
+
+    def start(self):
+        """open(), then start the control loop thread. Safe to call repeatedly."""
+        self.open()
+        with self._open_lock:
+            if not self.started:
+                self.started = True
+                if self.sensors is not None:
+                    self.sensors.start()
+                self.actuator.start()
+                self.control_loop.start()
+        return self
+
+    def use_clock(self, clock):
+        """Switch the control loop to another clock (relay dead time stays real time)."""
+        self.clock = self.control_loop.clock = clock
+
+    # --- Power Switching (Ensures Break-Before-Make) ---
+    # The control loop moves source and load in one RelayBank transaction (see
+    # apply_policy); this is only used to start from a known state.
+    def all_sources_off(self):
+        self.relays.select(None)
+        print("All sources OFF")
+
+    # --- Control Loop (event-driven, see engine.ControlLoop) ---
+    def integrate_battery(self):
+        """Periodic tick: measured inputs (EMS_SENSORS), or the simulation."""
+        if self.sensors is not None:
+            # The sensor samples since the last tick, averaged
+            self.state_store.update(**self.sensors.poll())
+            return
+        _, state = self.state_store.get()
+        battery_level = state["battery_level"]
+        if state["power_source"] == "solar" and state["solar_available"]:
+            battery_level = min(100, battery_level + 0.5) # Slower charge
+        elif state["power_source"] == "grid" and state["grid_available"]:
+             # Grid only maintains, doesn't charge in this logic
+             pass
+        elif state["power_source"] == "battery":
+            # Drain battery only if load is on
+            if state["load_on"]:
+                battery_level = max(0, battery_level - 1.0) # Faster drain
+        self.state_store.update(battery_level=battery_level)
+
+    def apply_command(self, state, data):
+        """Apply one checked command to the working copy of the state.
+
+        Only the state changes here; apply_policy() moves the relays once per
+        step, after every queued command has been applied.
+        """
         # --- Mode Control ---
         if "mode" in data:
             new_mode = data["mode"]
-            if new_mode in ["auto", "manual"]:
-                system_state["mode"] = new_mode
-                print(f"System mode set to: {new_mode}")
-                # If switching to auto, don't do anything else, let the manager thread take over
-                if new_mode == "auto":
-                    return jsonify(success=True, message="Mode set to auto.")
+            state["mode"] = new_mode
+            print(f"System mode set to: {new_mode}")
+            # If switching to auto, don't do anything else, let the policy take over
+            if new_mode == "auto":
+                return
 
         # --- Manual Relay Control (Only works if not switching to auto) ---
-        if "relay" in data and "state" in data:
+        if "relay" in data:
             relay_name = data["relay"]
-            state = data["state"] # True for ON, False for OFF
+            relay_on = data["state"] # True for ON, False for OFF
 
             # A manual action forces the system into manual mode
-            system_state["mode"] = "manual"
+            state["mode"] = "manual"
             print("Manual override detected. Switching to MANUAL mode.")
 
-            if relay_name == "solar":
-                if state: switch_to_solar()
-                else: all_sources_off()
-            elif relay_name == "grid":
-                if state: switch_to_grid()
-                else: all_sources_off()
-            elif relay_name == "battery":
-                if state: switch_to_battery()
-                else: all_sources_off()
+            if relay_name in SOURCES:
+                state["power_source"] = relay_name if relay_on else "none"
             elif relay_name == "load":
-                if state:
-                    RELAY_LOAD.on()
-                else:
-                    RELAY_LOAD.off()
-                system_state["load_on"] = state
+                state["load_on"] = relay_on
 
         # --- Source Availability Toggles (for simulation) ---
         if "solar_available" in data:
-            system_state["solar_available"] = data["solar_available"]
+            state["solar_available"] = data["solar_available"]
         if "grid_available" in data:
-            system_state["grid_available"] = data["grid_available"]
-            
-    return jsonify(success=True)
+            state["grid_available"] = data["grid_available"]
+
+    def apply_policy(self):
+        """Runs on every tick and immediately after each /control request."""
+        _, current = self.state_store.get()
+        state = dict(current) # working copy; the published snapshot is never mutated
+
+        # Each entry is a checked batch; all of them land in this one version
+        while self.pending_commands:
+            for command in self.pending_commands.popleft():
+                self.apply_command(state, command)
+
+        # --- Automatic Control Logic (one table lookup; None in manual mode) ---
+        # Made on debounced inputs, and a transfer may be held back (see
+        # conditioning.py). In manual mode the relays follow the commands.
+        target = None if state["power_source"] == "none" else state["power_source"]
+        load_on = state["load_on"]
+        decision = self.conditioner.decide(self.policies.current(), state, load_on,
+                                           self.clock.monotonic())
+        if decision is not None:
+            target, auto_load = decision
+            # Automatic Load Shedding
+            if not auto_load and load_on:
+                print(f"AUTO: Load shedding enabled (Battery < {self.policies.policy.shed_below}%)")
+            load_on = auto_load
+
+        # --- One relay transition for source and load, run by the actuator ---
+        # Queued only when the wanted vector changes; the break-before-make
+        # sequence runs on the actuator thread, so this step never waits on it.
+        changes = {name: name == target for name in SOURCES}
+        changes["load"] = load_on
+        if changes != self.requested:
+            self.last_ticket = self.actuator.submit(changes, self.transfer_priority(state, changes))
+            self.requested = changes
+            if (target or "none") != current["power_source"]:
+                print(f"Switched to {target.upper()}" if target else "All sources OFF")
+        state["power_source"] = target or "none"
+        state["load_on"] = load_on
+
+        # Publish the next version (version only moves on real changes). relay_status
+        # is left out: the actuator publishes it (see publish_relays), and this
+        # working copy may already be older than its latest.
+        del state["relay_status"]
+        self.state_store.update(**state)
+
+    def publish_relays(self, written):
+        """Actuator thread, after a transition: publish the relays as they now are."""
+        self.state_store.update(relay_status=self.relays.status())
+
+    def transfer_priority(self, state, changes):
+        """SAFETY to drop a source that has gone away, MANUAL in manual mode, else AUTO."""
+        for name in SOURCES:
+            if (self.requested[name] and not changes[name]
+                    and not state.get(f"{name}_available", True)):
+                return SAFETY
+        return MANUAL if state["mode"] == "manual" else AUTO
+
+    def apply_control(self, data):
+        """Queue a /control payload (one command or a batch) for the control loop.
+
+        The whole batch is checked here, so a bad command changes nothing.
+        Returns the loop sequence number.
+        """
+        self.pending_commands.append(parse_commands(data, self.config["EMS_PINS"]))
+        return self.control_loop.notify()
+
+    def sense(self, name, value):
+        """Edge on a sense input (gpiozero's thread): queue it and wake the loop."""
+        self.pending_commands.append([{name: value}])
+        self.control_loop.notify()
+
+    def execute_control(self, data, wait=False):
+        """Queue a command (or batch); with `wait`, return once the relays reflect it.
+
+        With `wait`, raises TimeoutError if the loop or the actuator hasn't
+        applied it within a second: the current version wouldn't include it.
+        """
+        seq = self.apply_control(data)
+        if not wait:
+            return {"queued": seq}
+        if not (self.control_loop.wait_applied(seq, timeout=1.0)
+                and self.actuator.wait(self.last_ticket, timeout=1.0)):
+            raise TimeoutError(f"Control change {seq} is queued but was not applied within 1 s")
+        return {"version": self.state_store.version}
+
+
+def create_app(config=None):
+    """The Flask app; its EnergySystem is app.extensions["ems"].
+
+    The relays are claimed and the loop started with the first request (or an
+    explicit start()), not when the module is imported or the app created.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update({key: os.environ[key] for key in ENV_KEYS if key in os.environ})
+    app.config.update(config or {})
+    system = app.extensions["ems"] = EnergySystem(app.config)
+    metrics.init_app(app, system.registry)
+    assets.serve_static(app)
+
+    if app.config["EMS_LAZY_START"]:
+        @app.before_request
+        def start_system():
+            if not system.started:
+                system.start()
+
+    # --- Flask Web Routes ---
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    @app.route('/status')
+    def get_status():
+        # Lock-free: the snapshot is immutable once published, and its JSON is
+        # encoded once per version; If-None-Match gets a 304
+        return assets.status_response(system.state_store)
+
+    @app.route('/stream')
+    def stream():
+        # Push a state event only when the published state changes
+        last_id = parse_last_event_id(request.headers.get('Last-Event-ID', request.args.get('since')))
+        return Response(event_stream(system.state_store, last_id),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    @app.route('/control', methods=['POST'])
+    def control():
+        # One command or a batch (see commands.py), validated before anything
+        # is applied. Answers once it is queued; with ?wait=1, once the relays
+        # reflect it, with the state version that includes it.
+        data = request.json
+        try:
+            result = system.execute_control(data, wait=request.args.get("wait") in ("1", "true"))
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        except RuntimeError as e:  # the control step failed: nothing reached the relays
+            return jsonify(success=False, error=str(e)), 500
+        except TimeoutError as e:  # queued, but not applied in time
+            return jsonify(success=False, error=str(e)), 504
+        if isinstance(data, dict) and data.get("mode") == "auto":
+            return jsonify(success=True, message="Mode set to auto.", **result)
+        return jsonify(success=True, **result)
+
+    return app
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    # Initialize all relays to OFF at the start
-    all_sources_off()
-    RELAY_LOAD.off()
-    
-    # Start the background thread
-    manager_thread = threading.Thread(target=system_manager, daemon=True)
-    manager_thread.start()
+    parser = argparse.ArgumentParser(description="EMS controller (app2)")
+    parser.add_argument("--time-scale", default=os.environ.get("EMS_TIME_SCALE"),
+                        help="speed-up factor, or 'virtual' to tick as fast as possible")
+    args = parser.parse_args()
+    app = create_app({"EMS_TIME_SCALE": args.time_scale})
+
+    # Claim the relays (all OFF) and start the control loop thread
+    app.extensions["ems"].start()
 
     # Run the Flask app
     app.run(host='0.0.0.0', port=5000, debug=False) # Debug mode can cause threads to run twice
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import assets
+import ems
+import metrics
+from engine import make_clock
+import telemetry
+from stream import (KEEPALIVE_FRAME, KEEPALIVE_SECONDS, RETRY_FRAME, SSE_HEADERS,
+                    format_event, parse_last_event_id)
+
+# --- ASGI front end for ems.py ---
+# Same routes as the Flask app (/, /static, /status, /metrics, /history,
+# /control, /stream), but every client is a coroutine on one event loop
+# instead of a thread, so an idle dashboard stream costs a few KB rather than
+# a thread stack. The control loop keeps running in its own thread (started
+# at lifespan startup, or by the first request); stream clients are woken
+# through StateStore.subscribe().
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+#   python asgi.py --port 5000
+
+MAX_STREAMS = 1000  # beyond this /stream answers 503 and clients fall back to polling
+
+
+class StateFeed:
+    """Wakes asyncio waiters whenever the control loop publishes a new version."""
+
+    def __init__(self, store, loop):
+        self.store = store
+        self._loop = loop
+        self._changed = asyncio.Event()
+        store.subscribe(self._on_publish)
+
+    def _on_publish(self, version):
+        # Runs on the control loop thread
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, since, timeout, disconnected):
+        """Wait for a version other than `since`, a timeout, or a disconnect."""
+        changed = self._changed
+        if self.store.version != since:
+            return
+        waiter = asyncio.ensure_future(changed.wait())
+        try:
+            await asyncio.wait({waiter, disconnected}, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+
+
+async def respond(send, status, headers, body=b""):
+    raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+    raw_headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def respond_json(send, status, payload):
+    await respond(send, status, {"Content-Type": "application/json"},
+                  json.dumps(payload).encode())
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+class EMSApp:
+    def __init__(self, flask_app, max_streams=MAX_STREAMS):
+        # The state, page and assets of an ems.create_app() app
+        self.system = flask_app.extensions["ems"]
+        self.dashboard_page = flask_app.extensions["dashboard"]
+        self.static_assets = flask_app.extensions["assets"]
+        self.max_streams = max_streams
+        self.streams = 0
+        self.feed = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if self.feed is None:
+            # Servers that skip the lifespan protocol
+            self.system.start()
+            self.feed = StateFeed(self.system.state_store, asyncio.get_running_loop())
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        method, path = scope["method"], scope["path"]
+
+        if path == "/" and method in ("GET", "HEAD"):
+            await respond(send, *self.dashboard_page.render(headers.get("accept-encoding", ""),
+                                                            headers.get("if-none-match", "")))
+        elif path.startswith("/static/") and method in ("GET", "HEAD"):
+            await self.static(path[len("/static/"):], query, headers, send)
+        elif path == "/status" and method in ("GET", "HEAD"):
+            await respond(send, *assets.render_status(self.system.state_store,
+                                                      headers.get("if-none-match", "")))
+        elif path == "/metrics" and method == "GET":
+            await respond(send, 200, {"Content-Type": metrics.CONTENT_TYPE},
+                          self.system.registry.render().encode())
+        elif path == "/history" and method == "GET":
+            await self.history(query, send)
+        elif path == "/control" and method == "POST":
+            await self.control(receive, send)
+        elif path == "/stream" and method == "GET":
+            await self.stream(headers, query, receive, send)
+        else:
+            await respond(send, 404, {"Content-Type": "text/plain"}, b"Not Found")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Claiming the relays opens files and GPIO; keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.system.start)
+                self.feed = StateFeed(self.system.state_store, asyncio.get_running_loop())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def static(self, filename, query, headers, send):
+        asset = self.static_assets.get(filename)
+        if asset is None:
+            await respond(send, 404, {"Content-Type": "text/plain"}, b"Not Found")
+            return
+        versioned = query.get("v", [None])[0] == asset.digest
+        await respond(send, *asset.render(headers.get("accept-encoding", ""),
+                                          headers.get("if-none-match", ""),
+                                          assets.ONE_YEAR if versioned else None))
+
+    async def history(self, query, send):
+        try:
+            start, end, points, method = telemetry.parse_query(
+                {k: v[0] for k, v in query.items()}, self.system.clock.time())
+        except ValueError as e:
+            await respond_json(send, 400, {"success": False, "error": str(e)})
+            return
+        # Downsampling a week takes tens of ms; keep it off the event loop
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, telemetry.history, self.system.telemetry, start, end, points, method)
+        await respond_json(send, 200, result)
+
+    async def control(self, receive, send):
+        # Same contract as the Flask route: one command or a batch, answered
+        # with the state version that includes it
+        try:
+            data = json.loads(await read_body(receive))
+            # Waiting for the control loop blocks; keep it off the event loop
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self.system.execute_control, data)
+        except ValueError as e:
+            await respond_json(send, 400, {"success": False, "error": str(e)})
+            return
+        except RuntimeError as e:
+            await respond_json(send, 500, {"success": False, "error": str(e)})
+            return
+        except TimeoutError as e:
+            await respond_json(send, 504, {"success": False, "error": str(e)})
+            return
+        await respond_json(send, 200, dict(success=True, **result))
+
+    async def stream(self, headers, query, receive, send):
+        if self.streams >= self.max_streams:
+            await respond(send, 503, {"Content-Type": "text/plain", "Retry-After": "5"},
+                          b"Too many streams")
+            return
+
+        last_id = parse_last_event_id(headers.get("last-event-id", query.get("since", [None])[0]))
+        seen = last_id if last_id is not None else -1
+        store = self.system.state_store
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        disconnected = asyncio.ensure_future(wait_disconnect())
+        self.streams += 1
+        try:
+            stream_headers = dict(SSE_HEADERS, **{"Content-Type": "text/event-stream"})
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(k.lower().encode(), v.encode()) for k, v in stream_headers.items()]})
+            await send({"type": "http.response.body", "body": RETRY_FRAME, "more_body": True})
+            while not disconnected.done():
+                await self.feed.wait(seen, KEEPALIVE_SECONDS, disconnected)
+                if disconnected.done():
+                    break
+                version, snapshot = store.get()
+                if version == seen or snapshot is None:
+                    seen = version
+                    frame = KEEPALIVE_FRAME
+                else:
+                    seen, body = store.encoded()
+                    frame = format_event(seen, body)
+                await send({"type": "http.response.body", "body": frame, "more_body": True})
+        finally:
+            self.streams -= 1
+            disconnected.cancel()
+
+
+app = EMSApp(ems.create_app())
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="EMS dashboard on an ASGI server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--max-streams", type=int, default=MAX_STREAMS)
+    parser.add_argument("--time-scale", default=None,
+                        help="speed-up factor, or 'virtual' to tick as fast as possible")
+    args = parser.parse_args()
+
+    app.max_streams = args.max_streams
+    if args.time_scale is not None:
+        app.system.use_clock(make_clock(args.time_scale))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
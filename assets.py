@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, request
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.security import safe_join
+from werkzeug.utils import get_content_type
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional; gzip covers every browser we care about
+    brotli = None
+
+# --- Precompiled pages and versioned static assets ---
+# Pages and static files are read/rendered once, kept in memory as bytes with
+# an ETag and precompressed gzip (and brotli, if installed) variants. Static
+# URLs carry a content hash (?v=...) so they can be cached for a year; the
+# dashboard page itself is revalidated and answered with 304 when unchanged.
+
+# Vendored third-party assets (Bootstrap) live in the repository-root static/
+SHARED_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class CompiledAsset:
+    """Response body held as bytes with its ETag and compressed variants."""
+
+    def __init__(self, body, mimetype):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.mimetype = mimetype
+        self.digest = hashlib.sha1(body).hexdigest()[:16]
+        self.variants = {"identity": body, "gzip": gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body)
+
+    def render(self, accept_encoding="", if_none_match="", max_age=None):
+        """Return (status, headers, body) for the best variant.
+
+        Framework-neutral so the ASGI front end can share it.
+        """
+        accepted = parse_accept_header(accept_encoding)
+        encoding = next((e for e in ("br", "gzip") if e in self.variants and accepted[e]),
+                        "identity")
+        etag = f"{self.digest}-{encoding}"
+        headers = {
+            "ETag": quote_etag(etag),
+            "Vary": "Accept-Encoding",
+            "Cache-Control": (f"public, max-age={max_age}, immutable" if max_age
+                              else "no-cache"),
+        }
+        if parse_etags(if_none_match).contains_weak(etag):
+            return 304, headers, b""
+        headers["Content-Type"] = get_content_type(self.mimetype, "utf-8")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, headers, self.variants[encoding]
+
+    def response(self, max_age=None):
+        """Serve the best variant for the current request (or a 304)."""
+        status, headers, body = self.render(request.headers.get("Accept-Encoding", ""),
+                                            request.headers.get("If-None-Match", ""),
+                                            max_age)
+        return Response(body, status=status, headers=headers)
+
+
+class LazyAsset:
+    """A CompiledAsset built by `build()` on first use, not at startup.
+
+    Rendering and compressing a page is the slowest part of app creation, and
+    a process that never serves it (a script importing the app) skips it.
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._asset = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._asset is None:
+            with self._lock:
+                if self._asset is None:
+                    self._asset = self._build()
+        return self._asset
+
+    def render(self, accept_encoding="", if_none_match="", max_age=None):
+        return self.get().render(accept_encoding, if_none_match, max_age)
+
+    def response(self, max_age=None):
+        return self.get().response(max_age)
+
+
+class AssetBundle:
+    """Serves files from static folders out of memory, with versioned URLs."""
+
+    def __init__(self, folders):
+        self.folders = [f for i, f in enumerate(folders) if f and f not in folders[:i]]
+        self._assets = {}
+
+    def get(self, filename):
+        asset = self._assets.get(filename)
+        if asset is None:
+            for folder in self.folders:
+                path = safe_join(folder, filename)
+                if path and os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        body = f.read()
+                    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                    asset = self._assets[filename] = CompiledAsset(body, mimetype)
+                    break
+        return asset
+
+    def url(self, filename):
+        """Static URL with a content hash, safe to cache for a year."""
+        asset = self.get(filename)
+        version = f"?v={asset.digest}" if asset else ""
+        return f"/static/{filename}{version}"
+
+    def send(self, filename):
+        asset = self.get(filename)
+        if asset is None:
+            abort(404)
+        versioned = request.args.get("v") == asset.digest
+        return asset.response(max_age=ONE_YEAR if versioned else None)
+
+
+def serve_static(app):
+    """Serve app.static_folder, plus the vendored Bootstrap in SHARED_STATIC, from memory.
+
+    Replaces Flask's /static view and adds `asset_url()` to templates, which
+    gives the versioned URLs. Returns the AssetBundle (also app.extensions["assets"]).
+    """
+    bundle = AssetBundle([app.static_folder, SHARED_STATIC])
+    app.view_functions["static"] = bundle.send
+    app.jinja_env.globals["asset_url"] = bundle.url
+    app.extensions["assets"] = bundle
+    return bundle
+
+
+def render_status(store, if_none_match=""):
+    """Return (status, headers, body) for /status from the store's pre-encoded JSON."""
+    version, body = store.encoded()
+    etag = store.etag(version)
+    headers = {"ETag": quote_etag(etag), "Cache-Control": "no-cache"}
+    if parse_etags(if_none_match).contains_weak(etag):
+        return 304, headers, b""
+    headers["Content-Type"] = "application/json"
+    return 200, headers, body
+
+
+def status_response(store):
+    """/status with an ETag per state version; If-None-Match gets a 304."""
+    status, headers, body = render_status(store, request.headers.get("If-None-Match", ""))
+    return Response(body, status=status, headers=headers)
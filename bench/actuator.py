@@ -0,0 +1,89 @@
+"""/control latency in app2.py against relay dead time, with the actuator thread.
+
+Posts --requests back-to-back availability toggles that each force a source
+transfer (grid <-> battery, solar off) through the Flask test client, on mock
+GPIO, for each dead time. By default /control answers once the command is
+queued, so its latency should not move with the dead time; ?wait=1 answers
+once the relays reflect it, and pays the transfer. Also reports how many
+relay commands the actuator coalesced and how many relay writes were made.
+
+    python bench/actuator.py [--requests 200] [--dead-times 0 0.02 0.2]
+                             [--json results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conditioning import PASS_THROUGH
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def run(client, system, requests, wait):
+    url = "/control?wait=1" if wait else "/control"
+    actuator, relays = system.actuator, system.relays
+    coalesced, writes = actuator.coalesced, relays.total_writes
+    latencies = []
+    grid = True
+    started = time.perf_counter()
+    for _ in range(requests):
+        grid = not grid
+        sent = time.perf_counter()
+        client.post(url, json={"grid_available": grid})
+        latencies.append(time.perf_counter() - sent)
+    # Let the last transfer land before counting
+    system.control_loop.wait_applied(system.control_loop.notify(), timeout=5)
+    actuator.wait(system.last_ticket, timeout=5)
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "coalesced": actuator.coalesced - coalesced,
+        "relay_writes": relays.total_writes - writes,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--dead-times", type=float, nargs="+", default=[0.0, 0.02, 0.2])
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    quiet = io.StringIO()  # app2 prints on every switch
+    with contextlib.redirect_stdout(quiet):
+        import app2
+        app = app2.create_app({"EMS_RELAY_LOCK": "", "EMS_CONDITIONING": PASS_THROUGH})
+        system = app.extensions["ems"].start()
+        client = app.test_client()
+        client.post("/control?wait=1", json={"solar_available": False})
+
+    results = []
+    for dead_time in args.dead_times:
+        system.relays.set_dead_time(dead_time)
+        for wait in (False, True):
+            with contextlib.redirect_stdout(quiet):
+                r = run(client, system, args.requests, wait)
+            r.update(dead_time=dead_time, wait=wait)
+            results.append(r)
+            print(f"dead time {dead_time * 1e3:5.0f} ms {'wait  ' if wait else 'queued'} | "
+                  f"/control p50 {r['p50_ms']:7.2f} ms p99 {r['p99_ms']:7.2f} ms | "
+                  f"coalesced {r['coalesced']:4d} relay writes {r['relay_writes']:4d} "
+                  f"in {r['seconds']:.2f} s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
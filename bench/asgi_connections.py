@@ -0,0 +1,130 @@
+"""How many concurrent /stream clients the ASGI front end sustains.
+
+Starts `asgi.py` on mock GPIO, opens N Server-Sent Events connections, then
+toggles grid availability and measures how long the state event takes to
+reach every client. Server RSS is sampled before and after connecting.
+
+    python bench/asgi_connections.py --clients 100 200 500 [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+def wait_ready(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def open_stream(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stream HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+    await writer.drain()
+    await read_event(reader)  # the current state
+    return reader, writer
+
+
+async def read_event(reader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("stream closed")
+        if line.startswith(b"event: state"):
+            await reader.readline()  # data line
+            return
+
+
+async def post_toggle(port):
+    body = json.dumps({"toggle": "grid_available"}).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"POST /control HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def run_level(port, pid, clients):
+    rss_before = rss_kb(pid)
+    streams = []
+    started = time.perf_counter()
+    for i in range(0, clients, 50):
+        streams += await asyncio.gather(*(open_stream(port) for _ in range(min(50, clients - i))))
+    connect_s = time.perf_counter() - started
+    await asyncio.sleep(0.5)
+    rss_after = rss_kb(pid)
+
+    async def timed(reader, t0):
+        await read_event(reader)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    waits = [asyncio.ensure_future(timed(reader, t0)) for reader, _ in streams]
+    await post_toggle(port)
+    latencies = sorted(await asyncio.gather(*waits))
+
+    for _, writer in streams:
+        writer.close()
+    await asyncio.sleep(0.5)
+    return {
+        "clients": clients,
+        "connect_seconds": round(connect_s, 3),
+        "rss_before_kb": rss_before,
+        "rss_after_kb": rss_after,
+        "rss_per_client_kb": round((rss_after - rss_before) / clients, 1),
+        "fanout_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "fanout_max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 250, 500])
+    parser.add_argument("--port", type=int, default=5081)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, GPIOZERO_PIN_FACTORY="mock")
+    server = subprocess.Popen([sys.executable, "asgi.py", "--host", "127.0.0.1",
+                               "--port", str(args.port),
+                               "--max-streams", str(max(args.clients) + 10)],
+                              cwd=ROOT, env=env)
+    try:
+        wait_ready(args.port)
+        results = []
+        for clients in args.clients:
+            result = asyncio.run(run_level(args.port, server.pid, clients))
+            print(" ".join(f"{k}={v}" for k, v in result.items()))
+            results.append(result)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Cold start: process launch to the first /status response, per app.
+
+Each run is a fresh interpreter on gpiozero's MockFactory, timed in phases:
+
+  interpreter  process launch until the worker's first line runs
+  import       `import <app>` (must not claim GPIO or start threads)
+  create_app   building the Flask app
+  first_status the first GET /status, which claims the relays, opens the
+               telemetry stores and starts the control loop
+
+The budget (default 200 ms, meant for a Pi) applies to the total.
+
+    python bench/cold_start.py [--apps ems app app2] [--runs 5]
+                               [--budget-ms 200] [--json results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ("ems", "app", "app2")
+
+
+def run_worker(name, launched, out):
+    began = time.time()
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    module = __import__(name)
+    imported = time.perf_counter()
+    threads_after_import = threading.active_count()
+    app = module.create_app()
+    created = time.perf_counter()
+    response = app.test_client().get("/status")
+    served = time.perf_counter()
+    if response.status_code != 200 or response.get_json() is None:
+        raise RuntimeError(f"/status returned {response.status_code}")
+    result = {
+        "interpreter_ms": (began - launched) * 1e3,
+        "import_ms": (imported - started) * 1e3,
+        "create_app_ms": (created - imported) * 1e3,
+        "first_status_ms": (served - created) * 1e3,
+        "total_ms": (began - launched) * 1e3 + (served - started) * 1e3,
+        "threads_after_import": threads_after_import,
+    }
+    with open(out, "w") as f:
+        json.dump(result, f)
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=list(APPS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=200.0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--worker", choices=APPS, help=argparse.SUPPRESS)
+    parser.add_argument("--launched", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.launched, args.out)
+        return
+
+    results = {"budget_ms": args.budget_ms, "apps": {}}
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, GPIOZERO_PIN_FACTORY="mock", EMS_TELEMETRY_DB=":memory:",
+                   EMS_RELAY_LOCK=os.path.join(scratch, "relays.lock"))
+        for name in args.apps:
+            runs = []
+            out = os.path.join(scratch, "result.json")
+            for _ in range(args.runs):
+                launched = time.time()
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name,
+                                       "--launched", repr(launched), "--out", out],
+                                      cwd=scratch, env=env, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    sys.exit(f"{name} failed:\n{proc.stderr}")
+                with open(out) as f:
+                    runs.append(json.load(f))
+            summary = {key: median([run[key] for run in runs]) for key in runs[0]}
+            results["apps"][name] = summary
+            verdict = "ok" if summary["total_ms"] <= args.budget_ms else "OVER BUDGET"
+            print(f"{name:5s} total {summary['total_ms']:6.0f} ms ({verdict}) | interpreter "
+                  f"{summary['interpreter_ms']:4.0f} import {summary['import_ms']:4.0f} "
+                  f"create_app {summary['create_app_ms']:4.0f} first /status "
+                  f"{summary['first_status_ms']:4.0f} ms | threads after import "
+                  f"{summary['threads_after_import']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Relay operations on a flapping availability trace, with and without conditioning.
+
+Replays one seeded day (1 s ticks) of solar behind passing clouds and a grid
+with short brownouts through the policy table and a RelayBank of counting
+relays: once on the raw inputs (conditioning.PASS_THROUGH), once through
+conditioning.Conditioner. Reports relay operations, source transfers,
+suppressed flaps/transfers, and the seconds spent connected to a source whose
+raw input said unavailable (what the debounce costs).
+
+    python bench/conditioning.py [--hours 24] [--seed 1] [--policy app2|ems]
+                                 [--rise 5] [--fall 0] [--min-dwell 30]
+                                 [--max-transfers 6] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conditioning import DEFAULTS, PASS_THROUGH, Conditioner
+from policy import Policy
+from relays import SOURCES, RelayBank
+
+POLICIES = {
+    "ems": {"priority": ["solar", "grid", "battery"], "shed_below": 25,
+            "restore_above": None, "shed_on": ["solar", "grid", "battery"]},
+    "app2": {"priority": ["solar", "grid", "battery"], "shed_below": 25,
+             "restore_above": 30, "shed_on": ["battery"]},
+}
+
+
+class CountingRelay:
+    def __init__(self):
+        self.value = False
+
+    def on(self):
+        self.value = True
+
+    def off(self):
+        self.value = False
+
+
+def availability_trace(seconds, seed):
+    """(solar, grid) per second: cloudy spells over the day, grid brownouts."""
+    rng = random.Random(seed)
+    solar = grid = True
+    cloudy = False
+    brownout = 0
+    for t in range(seconds):
+        hour = (t // 3600) % 24
+        if rng.random() < 1 / 1800:
+            cloudy = not cloudy  # cloudy spells of ~30 min
+        daylight = 7 <= hour < 18
+        if not daylight:
+            solar = False
+        elif cloudy:
+            # Broken cloud: solar flickers every few seconds
+            if rng.random() < 0.15:
+                solar = not solar
+        else:
+            solar = True
+        if brownout:
+            brownout -= 1
+        elif rng.random() < 1 / 600:
+            brownout = rng.randint(1, 4)  # dips of 1-4 s, ~6 an hour
+        grid = not brownout
+        yield solar, grid
+
+
+def replay(trace, policy, settings):
+    bank = RelayBank({name: CountingRelay() for name in SOURCES + ("load",)})
+    conditioner = Conditioner(settings)
+    state = {"mode": "auto", "power_source": "none", "battery_level": 60.0}
+    on_dead_source = 0
+    started = time.perf_counter()
+    for now, (solar, grid) in enumerate(trace):
+        state["solar_available"], state["grid_available"] = solar, grid
+        source, load_on = conditioner.decide(policy, state, bank.is_on("load"), float(now))
+        changes = {name: name == source for name in SOURCES}
+        changes["load"] = load_on
+        bank.apply(changes)
+        state["power_source"] = source or "none"
+        on_dead_source += (source == "solar" and not solar) or (source == "grid" and not grid)
+    elapsed = time.perf_counter() - started
+    return {
+        "relay_ops": bank.total_writes,
+        "relay_ops_by_relay": dict(bank.writes),
+        "counts": conditioner.counts(),
+        "seconds_on_unavailable_source": on_dead_source,
+        "us_per_tick": elapsed / len(trace) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="app2")
+    parser.add_argument("--rise", type=float, default=DEFAULTS["rise"])
+    parser.add_argument("--fall", type=float, default=DEFAULTS["fall"])
+    parser.add_argument("--min-dwell", type=float, default=DEFAULTS["min_dwell"])
+    parser.add_argument("--max-transfers", type=int, default=DEFAULTS["max_transfers"])
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    trace = list(availability_trace(int(args.hours * 3600), args.seed))
+    flips = sum(a != b for a, b in zip(trace, trace[1:]))
+    policy = Policy(POLICIES[args.policy])
+    settings = {"rise": args.rise, "fall": args.fall, "min_dwell": args.min_dwell,
+                "max_transfers": args.max_transfers}
+    results = {"ticks": len(trace), "input_changes": flips, "settings": settings,
+               "raw": replay(trace, policy, PASS_THROUGH),
+               "conditioned": replay(trace, policy, settings)}
+
+    print(f"{len(trace)} ticks, {flips} raw input changes")
+    for label in ("raw", "conditioned"):
+        r = results[label]
+        counts = r["counts"]
+        print(f"{label:11s} relay ops {r['relay_ops']:6d} transfers {counts['transferred']:5d} "
+              f"suppressed flaps {counts['inputs']} held {counts['transfers']} | "
+              f"{r['seconds_on_unavailable_source']} s on an unavailable source | "
+              f"{r['us_per_tick']:.1f} us/tick")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
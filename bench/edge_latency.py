@@ -0,0 +1,140 @@
+"""Sense-pin edge to relay transfer latency, on gpiozero's MockFactory.
+
+Starts ems.py or app2.py with EMS_SENSE_PINS on mock pins and the real
+control loop thread, then repeatedly drops and restores the grid-sense line
+while the system runs on grid (solar unavailable) and timestamps the relay
+writes. Reports, per direction:
+
+  break  edge -> the old source relay released
+  make   edge -> the new source relay closed (includes the app's dead time)
+
+Input conditioning is passed through (the apps' default) so the edge path
+itself is measured: with EMS_CONDITIONING on, losing a source still transfers
+at once, but the return is held on purpose (rise debounce, minimum dwell,
+rate limit). For comparison, a polled input is noticed on average half a
+tick after it changes.
+
+    python bench/edge_latency.py [--app ems|app2] [--edges 50] [--json results.json]
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+os.environ.setdefault("EMS_TELEMETRY_DB", ":memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conditioning import PASS_THROUGH
+
+SENSE_PINS = {"grid_available": 5, "solar_available": 6}  # clear of both apps' relay pins
+
+
+class TimedRelay:
+    """Wraps a relay device and records when each write happens."""
+
+    def __init__(self, name, device, log, changed):
+        self.name = name
+        self.device = device
+        self.log = log
+        self.changed = changed
+
+    @property
+    def value(self):
+        return self.device.value
+
+    def on(self):
+        self.device.on()
+        self.log.append((self.name, True, time.perf_counter()))
+        self.changed.set()
+
+    def off(self):
+        self.device.off()
+        self.log.append((self.name, False, time.perf_counter()))
+        self.changed.set()
+
+
+def wait_for(log, changed, name, value, since, timeout=5.0):
+    """perf_counter time at which relay `name` was written to `value` after `since`."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        for relay, state, at in log:
+            if relay == name and state == value and at >= since:
+                return at
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise RuntimeError(f"{name} never went {'on' if value else 'off'}")
+        changed.wait(remaining)
+        changed.clear()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=("ems", "app2"), default="ems")
+    parser.add_argument("--edges", type=int, default=50, help="drop/restore cycles")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    config = {"EMS_SENSE_PINS": SENSE_PINS, "EMS_RELAY_LOCK": "", "EMS_CONDITIONING": PASS_THROUGH}
+    quiet = io.StringIO()  # app2 prints on every switch
+    with contextlib.redirect_stdout(quiet):
+        module = importlib.import_module(args.app)
+        system = module.create_app(config).extensions["ems"]
+        system.open()
+        from gpiozero import Device  # the mock factory exists once open() made a device
+        grid_pin = Device.pin_factory.pin(SENSE_PINS["grid_available"])
+        solar_pin = Device.pin_factory.pin(SENSE_PINS["solar_available"])
+        grid_pin.drive_high()
+        solar_pin.drive_low()
+        log, changed = [], threading.Event()
+        bank = system.relays
+        bank.relays = {name: TimedRelay(name, device, log, changed)
+                       for name, device in bank.relays.items()}
+        system.start()
+        time.sleep(0.5)
+        if not bank.is_on("grid"):
+            raise RuntimeError(f"expected to run on grid, relays are {bank.status()}")
+
+        results = {"app": args.app, "edges": args.edges,
+                   "tick_s": system.control_loop.interval}
+        lost = {"break": [], "make": []}
+        back = {"break": [], "make": []}
+        for _ in range(args.edges):
+            edge = time.perf_counter()
+            grid_pin.drive_low()  # grid lost: grid -> battery
+            lost["break"].append(wait_for(log, changed, "grid", False, edge) - edge)
+            lost["make"].append(wait_for(log, changed, "battery", True, edge) - edge)
+            time.sleep(0.05)
+            edge = time.perf_counter()
+            grid_pin.drive_high()  # grid back: battery -> grid
+            back["break"].append(wait_for(log, changed, "battery", False, edge) - edge)
+            back["make"].append(wait_for(log, changed, "grid", True, edge) - edge)
+            time.sleep(0.05)
+        system.control_loop.stop()
+
+    for label, samples in (("grid lost", lost), ("grid back", back)):
+        row = results[label.replace(" ", "_")] = {}
+        for phase, values in samples.items():
+            row[f"{phase}_p50_ms"] = percentile(values, 50) * 1e3
+            row[f"{phase}_p99_ms"] = percentile(values, 99) * 1e3
+        print(f"{args.app} {label:9s} | break p50 {row['break_p50_ms']:7.2f} ms "
+              f"p99 {row['break_p99_ms']:7.2f} ms | make p50 {row['make_p50_ms']:7.2f} ms "
+              f"p99 {row['make_p99_ms']:7.2f} ms")
+    print(f"{args.app} polled    | noticed after ~{results['tick_s'] / 2 * 1e3:.0f} ms on average "
+          f"(half a {results['tick_s']:.0f} s tick), before any transfer")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""fleet.py against locally spawned fake nodes.
+
+Starts N fake nodes (`fleet.py --serve-fake N`) in a child process and runs
+the aggregator in this one for --seconds at --interval, then reports polls
+per second, how late polls started relative to their slots, the share of
+304s, the aggregator's CPU use and the cost of index queries. --dead adds
+nodes on ports nobody listens on (they should back off and not disturb the
+rest); --no-keepalive opens a new connection for every poll, for comparison.
+
+    python bench/fleet.py [--nodes 500] [--interval 2] [--seconds 20]
+                          [--dead 0] [--no-keepalive] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import fleet
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else None
+
+
+class ClosingClient(fleet.NodeClient):
+    """A connection per request (what a plain urllib poller would do)."""
+
+    async def get(self, path, headers=None):
+        try:
+            return await super().get(path, dict(headers or {}, Connection="close"))
+        finally:
+            self.close()
+
+
+def time_queries(aggregator, repeat=200):
+    queries = [{"source": "battery"}, {"source": "battery", "shed": "1"},
+               {"soc_below": "30", "online": "1"}]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for params in queries:
+            aggregator.query(params)
+    return (time.perf_counter() - started) / (repeat * len(queries)) * 1e6
+
+
+async def run(args):
+    nodes = [fleet.Node(n["name"], n["url"])
+             for n in fleet.fake_node_urls(args.nodes, args.fake_port)]
+    # Dead nodes: ports past the fake range, where nothing listens
+    nodes += [fleet.Node(f"dead-{i}", f"http://127.0.0.1:{args.fake_port + args.nodes + 100 + i}")
+              for i in range(args.dead)]
+    if args.no_keepalive:
+        for node in nodes:
+            node.client = ClosingClient(node.client.host, node.client.port)
+    aggregator = fleet.Fleet(nodes, interval=args.interval, timeout=args.timeout)
+    fleet.raise_fd_limit(len(nodes) + 256)
+    aggregator.start()
+
+    await asyncio.sleep(args.interval * 2)  # connect and fill the index
+    aggregator.lateness.clear()
+    polls, not_modified, errors = aggregator.polls, aggregator.not_modified, aggregator.errors
+    cpu, wall = time.process_time(), time.perf_counter()
+    await asyncio.sleep(args.seconds)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    polls, not_modified, errors = (aggregator.polls - polls, aggregator.not_modified - not_modified,
+                                   aggregator.errors - errors)
+    lateness = list(aggregator.lateness)
+    query_us = time_queries(aggregator)
+    online = len(aggregator.index.query(online=True))
+    await aggregator.stop()
+    return {
+        "nodes": args.nodes,
+        "dead": args.dead,
+        "keepalive": not args.no_keepalive,
+        "interval_s": args.interval,
+        "polls_per_s": polls / wall,
+        "expected_polls_per_s": args.nodes / args.interval,
+        "not_modified_share": not_modified / polls if polls else None,
+        "errors": errors,
+        "late_p50_ms": percentile(lateness, 50) * 1e3,
+        "late_p99_ms": percentile(lateness, 99) * 1e3,
+        "late_max_ms": max(lateness) * 1e3,
+        "cpu_percent": cpu / wall * 100,
+        "query_us": query_us,
+        "online": online,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--dead", type=int, default=0)
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--fake-port", type=int, default=17000)
+    parser.add_argument("--no-keepalive", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "fleet.py"),
+                               "--serve-fake", str(args.nodes), "--fake-port", str(args.fake_port)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdout.readline()  # "N fake nodes on ..." once every port listens
+        results = asyncio.run(run(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    for key, value in results.items():
+        print(f"{key:22s} {value:.2f}" if isinstance(value, float) else f"{key:22s} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Benchmark all five entry points the same way and write the results as JSON.
+
+Each app runs in its own process on gpiozero's MockFactory (sbems gets an
+in-memory RPi.GPIO stand-in), so no real relay is ever driven. Per app:
+
+  status   requests/s and p50/p99 latency of its status page through the
+           Flask test client (/status; sbems has only /)
+  ticks    control-loop tick intervals while /status is under load: mean
+           interval and p50/p99 deviation from the nominal period
+  control  time from a /control request (sbems: /toggle_availability) that
+           changes the source to the first relay write
+  memory   RSS and peak RSS at the end of the run
+
+    python bench/harness.py [--apps ems app app2 debug sbems] [--seconds 10]
+                            [--control-samples 10] [--json results.json]
+                            [--baseline previous.json]
+
+--baseline prints the change of every metric against an earlier results file,
+so a regression between two versions stands out.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (file, status path, nominal tick seconds)
+APPS = {
+    "ems": ("ems.py", "/status", 1.0),
+    "app": ("app.py", "/status", 1.0),
+    "app2": ("app2.py", "/status", 2.0),
+    "debug": ("debug/app.py", "/status", 1.0),
+    "sbems": ("sbems/smart_energy.py", "/", 2.0),
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def rss_kb():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                fields[key] = int(value.split()[0])
+    return fields.get("VmRSS"), fields.get("VmHWM")
+
+
+# --- Worker: one app per process ---
+
+
+def fake_rpi_gpio():
+    """Minimal in-memory RPi.GPIO for sbems."""
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM, gpio.OUT, gpio.IN, gpio.HIGH, gpio.LOW = 11, 0, 1, 1, 0
+    gpio.setmode = gpio.setwarnings = gpio.cleanup = lambda *args: None
+    gpio.setup = lambda *args, **kwargs: None
+    gpio.output = lambda pin, value: None
+    package = types.ModuleType("RPi")
+    package.GPIO = gpio
+    sys.modules["RPi"] = package
+    sys.modules["RPi.GPIO"] = gpio
+
+
+class Probe:
+    """Stands in front of a relay device and timestamps every write."""
+
+    def __init__(self, device, written):
+        self.device = device
+        self.written = written
+        self.last_write = 0.0
+
+    @property
+    def value(self):
+        return self.device.value
+
+    def on(self):
+        self.device.on()
+        self._stamp()
+
+    def off(self):
+        self.device.off()
+        self._stamp()
+
+    def _stamp(self):
+        self.last_write = time.perf_counter()
+        self.written.set()
+
+
+def load_app(name):
+    filename = APPS[name][0]
+    path = os.path.join(ROOT, filename)
+    os.chdir(os.path.dirname(path))
+    sys.path.insert(0, os.path.dirname(path))
+    if name == "sbems":
+        fake_rpi_gpio()
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    if hasattr(module, "create_app"):  # ems, app, app2: hardware and threads start here
+        app = module.create_app()
+        system = app.extensions["ems"].start()
+    else:
+        app, system = module.app, module
+    return app, system, time.perf_counter() - started
+
+
+def hook_ticks(name, system, ticks):
+    """Record a timestamp on every control-loop iteration."""
+    def stamped(func):
+        def wrapper(*args, **kwargs):
+            ticks.append(time.perf_counter())
+            return func(*args, **kwargs)
+        return wrapper
+
+    if hasattr(system, "control_loop"):  # ems, app2: periodic integrate()
+        system.control_loop.integrate = stamped(system.control_loop.integrate)
+    elif name == "sbems":  # called once per pass of update_power_source()
+        system.update_output = stamped(system.update_output)
+    else:  # app, debug: publish once per pass of simulate_system()
+        system.state_store.publish = stamped(system.state_store.publish)
+
+
+def measure_status(client, path, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+    total = sum(latencies)
+    return {
+        "path": path,
+        "requests": len(latencies),
+        "rps": len(latencies) / total,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+    }
+
+
+def tick_stats(ticks, nominal):
+    intervals = [b - a for a, b in zip(ticks, ticks[1:])]
+    deviations = [abs(i - nominal) for i in intervals]
+    return {
+        "nominal_s": nominal,
+        "count": len(intervals),
+        "mean_interval_s": sum(intervals) / len(intervals) if intervals else None,
+        "jitter_p50_ms": percentile(deviations, 50) * 1e3 if deviations else None,
+        "jitter_p99_ms": percentile(deviations, 99) * 1e3 if deviations else None,
+    }
+
+
+def measure_control(name, system, client, samples, period):
+    written = threading.Event()
+    rng = random.Random(0)
+    probes = {relay: Probe(device, written) for relay, device in system.relays.relays.items()}
+    system.relays.relays.update(probes)
+    latencies = []
+    grid = True
+    for _ in range(samples):
+        # Let the previous transition (and any dead time) finish, and land at a
+        # random phase of sleep-based loops rather than always the same one
+        time.sleep(0.3 + rng.uniform(0, period))
+        written.clear()
+        started = time.perf_counter()
+        if name == "sbems":
+            client.post("/toggle_availability", data={"source": "solar"})
+        else:
+            grid = not grid
+            client.post("/control", json={"grid_available": grid})
+        if not written.wait(3 * period):
+            latencies.append(None)
+            continue
+        first = min(p.last_write for p in probes.values() if p.last_write >= started)
+        latencies.append(first - started)
+    measured = [latency for latency in latencies if latency is not None]
+    return {
+        "samples": len(latencies),
+        "timeouts": len(latencies) - len(measured),
+        "p50_ms": percentile(measured, 50) * 1e3 if measured else None,
+        "p99_ms": percentile(measured, 99) * 1e3 if measured else None,
+        "max_ms": max(measured) * 1e3 if measured else None,
+    }
+
+
+def run_worker(name, seconds, control_samples, out):
+    app, system, import_s = load_app(name)
+    client = app.test_client()
+    _, status_path, nominal = APPS[name]
+    time.sleep(0.5)  # let the first state be published
+
+    ticks = []
+    hook_ticks(name, system, ticks)
+    status = measure_status(client, status_path, seconds)
+    tick_times = list(ticks)
+
+    control = measure_control(name, system, client, control_samples, nominal)
+    rss, peak = rss_kb()
+    result = {
+        "import_s": import_s,
+        "status": status,
+        "ticks": tick_stats(tick_times, nominal),
+        "control": control,
+        "rss_kb": rss,
+        "peak_rss_kb": peak,
+    }
+    with open(out, "w") as f:
+        json.dump(result, f)
+
+
+# --- Driver ---
+
+
+def fmt(value, spec, unit):
+    """`value` formatted with `spec` and `unit`, or "n/a" for a measurement the run didn't get."""
+    return "n/a" if value is None else f"{value:{spec}} {unit}"
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(baseline, results):
+    old = dict(flatten(baseline["apps"]))
+    for key, value in flatten(results["apps"]):
+        if key in old and old[key]:
+            change = (value - old[key]) / old[key] * 100
+            print(f"  {key:36s} {old[key]:12.2f} -> {value:12.2f} ({change:+6.1f}%)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--seconds", type=float, default=10.0,
+                        help="length of the /status load phase (ticks are sampled during it)")
+    parser.add_argument("--control-samples", type=int, default=10)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the apps' own output")
+    parser.add_argument("--worker", choices=list(APPS), help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.seconds, args.control_samples, args.out)
+        return
+
+    env = dict(os.environ, GPIOZERO_PIN_FACTORY="mock", EMS_TELEMETRY_DB=":memory:")
+    results = {
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "seconds": args.seconds,
+        "apps": {},
+    }
+    for name in args.apps:
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            output = None if args.verbose else subprocess.DEVNULL
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name,
+                                   "--out", out.name, "--seconds", str(args.seconds),
+                                   "--control-samples", str(args.control_samples)],
+                                  env=env, stdout=output, stderr=output)
+            if proc.returncode != 0:
+                print(f"{name:6s} failed (exit {proc.returncode}); rerun with --verbose")
+                continue
+            r = results["apps"][name] = json.load(out)
+        s, t, c = r["status"], r["ticks"], r["control"]
+        print(f"{name:6s} status {s['rps']:7.0f} req/s p50 {s['p50_ms']:.2f} ms "
+              f"p99 {s['p99_ms']:.2f} ms | tick {fmt(t['mean_interval_s'], '.3f', 's')} "
+              f"jitter p99 {fmt(t['jitter_p99_ms'], '.1f', 'ms')} | control p50 "
+              f"{fmt(c['p50_ms'], '.1f', 'ms')} p99 {fmt(c['p99_ms'], '.1f', 'ms')} | "
+              f"RSS {r['rss_kb'] / 1024:.1f} MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Changes since {baseline.get('commit')}:")
+        compare(baseline, results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Hot-path cost of metrics.py, in microseconds.
+
+Times the primitive operations and the request hooks that metrics.init_app
+adds, then the same workloads with and without metrics attached: a Flask
+request (end to end, so noisier) and a ControlLoop tick with LoopMetrics (on a
+VirtualClock, so only the loop's own work is timed).
+
+    python bench/metrics_overhead.py [--n 200000] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask
+
+import metrics
+from engine import ControlLoop, VirtualClock
+
+
+def per_call_us(func, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def flask_request_us(with_metrics, n):
+    app = Flask(__name__)
+    app.add_url_rule("/status", "status", lambda: "{}")
+    if with_metrics:
+        metrics.init_app(app, metrics.Registry())
+    client = app.test_client()
+    return per_call_us(lambda: client.get("/status"), n)
+
+
+def flask_hooks_us(n):
+    """The before/after_request pair that init_app adds, timed in isolation."""
+    app = Flask(__name__)
+    app.add_url_rule("/status", "status", lambda: "{}")
+    metrics.init_app(app, metrics.Registry())
+    before = app.before_request_funcs[None][-1]
+    after = app.after_request_funcs[None][-1]
+    response = app.response_class("{}")
+    with app.test_request_context("/status"):
+        return per_call_us(lambda: after(response) if before() is None else None, n)
+
+
+def loop_tick_us(with_metrics, ticks):
+    registry = metrics.Registry()
+    loop = ControlLoop(lambda: None, lambda: None, interval=1.0, clock=VirtualClock(),
+                       metrics=metrics.LoopMetrics(registry) if with_metrics else None)
+    started = time.perf_counter()
+    loop.run_for(ticks)
+    return (time.perf_counter() - started) / ticks * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=200000)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    histogram = registry.histogram("bench_seconds", "bench")
+    child = histogram.labels()
+    labelled = registry.histogram("bench_route_seconds", "bench", ("route", "method"))
+    counter = registry.counter("bench_total", "bench").labels()
+    for i in range(1000):
+        child.observe(i / 1e4)
+        labelled.labels("/status", "GET").observe(i / 1e4)
+
+    requests = max(1000, args.n // 20)
+    # The with/without variants are interleaved and the best of five kept, so
+    # machine noise (tens of us per request here) doesn't swamp the difference
+    flask = {False: [], True: []}
+    loop = {False: [], True: []}
+    for _ in range(5):
+        for variant in (False, True):
+            flask[variant].append(flask_request_us(variant, requests // 5))
+            loop[variant].append(loop_tick_us(variant, args.n // 20))
+    results = {
+        "histogram_observe_us": per_call_us(lambda: child.observe(0.0003), args.n),
+        "labelled_observe_us": per_call_us(
+            lambda: labelled.labels("/status", "GET").observe(0.0003), args.n),
+        "counter_inc_us": per_call_us(counter.inc, args.n),
+        "render_us": per_call_us(registry.render, 1000),
+        "flask_hooks_us": flask_hooks_us(args.n),
+        "flask_request_us": min(flask[False]),
+        "flask_request_with_metrics_us": min(flask[True]),
+        "loop_tick_us": min(loop[False]),
+        "loop_tick_with_metrics_us": min(loop[True]),
+    }
+    results["loop_overhead_us"] = (results["loop_tick_with_metrics_us"]
+                                   - results["loop_tick_us"])
+    for key, value in results.items():
+        print(f"{key:32s} {value:8.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
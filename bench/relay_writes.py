@@ -0,0 +1,87 @@
+"""Count GPIO writes per relay: legacy switch functions vs RelayBank.
+
+Replays the same availability trace through the old "write every relay every
+tick" pattern and through RelayBank, using counting stand-in devices.
+
+    python bench/relay_writes.py [--ticks 86400] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from relays import RelayBank, SOURCES
+
+
+class CountingRelay:
+    def __init__(self):
+        self.value = False
+        self.writes = 0
+
+    def on(self):
+        self.value = True
+        self.writes += 1
+
+    def off(self):
+        self.value = False
+        self.writes += 1
+
+
+def availability_trace(ticks, seed):
+    """Solar follows a day cycle, the grid drops out now and then."""
+    rng = random.Random(seed)
+    grid = True
+    for t in range(ticks):
+        hour = (t // 3600) % 24
+        solar = 7 <= hour < 18
+        if rng.random() < 0.0005:
+            grid = not grid
+        yield solar, grid
+
+
+def choose(solar, grid):
+    return "solar" if solar else "grid" if grid else "battery"
+
+
+def run_legacy(trace):
+    devices = {name: CountingRelay() for name in SOURCES + ("load",)}
+    for solar, grid in trace:
+        source = choose(solar, grid)
+        # ems.switch_to_*: every source relay written every tick
+        for name in SOURCES:
+            if name == source:
+                devices[name].on()
+            else:
+                devices[name].off()
+        devices["load"].on()
+    return {name: d.writes for name, d in devices.items()}
+
+
+def run_bank(trace):
+    devices = {name: CountingRelay() for name in SOURCES + ("load",)}
+    bank = RelayBank(devices)
+    for solar, grid in trace:
+        bank.select(choose(solar, grid))
+        bank.set("load", True)
+    return dict(bank.writes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=86400)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    trace = list(availability_trace(args.ticks, args.seed))
+    for label, runner in (("legacy", run_legacy), ("relaybank", run_bank)):
+        started = time.perf_counter()
+        writes = runner(trace)
+        elapsed = time.perf_counter() - started
+        total = sum(writes.values())
+        print(f"{label:10s} writes={total:8d} {writes} ({elapsed * 1e6 / args.ticks:.2f} us/tick)")
+
+
+if __name__ == "__main__":
+    main()
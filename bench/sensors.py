@@ -0,0 +1,104 @@
+"""Throughput and CPU cost of the sensors.py sampling pipeline on FakeSensors.
+
+For each rate, runs a Sampler over --channels fake sensors for --seconds while
+this thread drains and decimates the ring at the control rate (--poll-hz),
+as the control loop would. Reports achieved samples/s per channel, sample
+interval jitter (p50/p99 of the gap between samples), late and dropped
+samples, process CPU use and the cost of one decimation. A rate of 0 reads
+as fast as possible (the ceiling of this machine).
+
+    python bench/sensors.py [--rates 200 500 1000 0] [--channels 3]
+                            [--seconds 5] [--poll-hz 1] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sensors import FAKE_SENSORS, SPEC_DEFAULTS, SensorPipeline
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
+
+
+def make_spec(rate, channels, capacity):
+    fakes = list(FAKE_SENSORS["channels"].items())
+    spec = dict(SPEC_DEFAULTS, rate_hz=rate, capacity=capacity, channels={})
+    for k in range(channels):
+        name, channel = fakes[k % len(fakes)]
+        spec["channels"][name if k < len(fakes) else f"{name}{k}"] = channel
+    return spec
+
+
+def run(rate, channels, seconds, poll_hz, capacity):
+    pipeline = SensorPipeline(make_spec(rate, channels, capacity))
+    width = pipeline.sampler.ring.width
+    gaps, poll_us = [], []
+    last_t = None
+    pipeline.start()
+    time.sleep(0.2)  # thread start-up
+    pipeline.reader.read()  # start measuring from here
+    pipeline.samples = 0
+    cpu, wall = time.process_time(), time.perf_counter()
+    deadline = wall + seconds
+    while time.perf_counter() < deadline:
+        time.sleep(1.0 / poll_hz)
+        started = time.perf_counter()
+        block, count = pipeline.reader.read()
+        pipeline.decimate(block, count)  # what poll() does once per control tick
+        poll_us.append((time.perf_counter() - started) * 1e6)
+        for t in block[0::width]:
+            if last_t is not None:
+                gaps.append(t - last_t)
+            last_t = t
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    pipeline.stop()
+    sampler = pipeline.sampler
+    samples = pipeline.samples
+    return {
+        "rate_hz": rate,
+        "channels": channels,
+        "samples_per_s": samples / wall,
+        "reads_per_s": samples * channels / wall,
+        "gap_p50_us": percentile(gaps, 50) * 1e6,
+        "gap_p99_us": percentile(gaps, 99) * 1e6,
+        "late": sampler.late,
+        "dropped": pipeline.reader.dropped,
+        "cpu_percent": cpu / wall * 100,
+        "cpu_us_per_sample": cpu / samples * 1e6 if samples else None,
+        "decimate_us": percentile(poll_us, 50),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=int, nargs="+", default=[200, 500, 1000, 0])
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--poll-hz", type=float, default=1.0)
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="ring slots (default: SPEC_DEFAULTS, or enough for the fastest rate)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for rate in args.rates:
+        # As-fast-as-possible needs a ring that holds a whole poll interval
+        capacity = args.capacity or (SPEC_DEFAULTS["capacity"] if rate else 1 << 18)
+        r = run(rate, args.channels, args.seconds, args.poll_hz, capacity)
+        results.append(r)
+        print(f"rate {rate or 'max':>5} Hz x {args.channels} ch | {r['samples_per_s']:8.0f} samples/s "
+              f"gap p50 {r['gap_p50_us']:6.0f} us p99 {r['gap_p99_us']:6.0f} us | late {r['late']:5d} "
+              f"dropped {r['dropped']:6d} | CPU {r['cpu_percent']:5.1f}% "
+              f"({r['cpu_us_per_sample']:.1f} us/sample) | decimate {r['decimate_us']:.0f} us")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
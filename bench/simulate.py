@@ -0,0 +1,117 @@
+"""Check simulate.py against a tick-by-tick replay, then time a full year.
+
+The reference replays each scenario one tick at a time with the same rules as
+ems.integrate_battery/apply_policy and app2.integrate_battery/apply_policy.
+
+    python bench/simulate.py [--scenarios 2000] [--days 365] [--check-days 3]
+                             [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simulate
+
+
+def target(solar, grid):
+    return "solar" if solar else "grid" if grid else "battery"
+
+
+def reference_ems(solar_trace, grid_trace, soc, n):
+    source = target(solar_trace[0], grid_trace[0])
+    shed = 0
+    for solar, grid in zip(solar_trace, grid_trace):
+        for _ in range(n):
+            if source == "solar" and solar:
+                soc = min(100, soc + 1)
+            elif source == "grid" and grid:
+                soc = min(100, soc + 0.5)
+            else:
+                soc = max(0, soc - 0.3)
+            source = target(solar, grid)
+            shed += soc < 25
+    return soc, shed
+
+
+def reference_app2(solar_trace, grid_trace, soc, n):
+    source = target(solar_trace[0], grid_trace[0])
+    load = soc > 30
+    shed = 0
+    for solar, grid in zip(solar_trace, grid_trace):
+        for _ in range(n):
+            if source == "solar" and solar:
+                soc = min(100, soc + 0.5)
+            elif source == "grid" and grid:
+                pass
+            elif source == "battery" and load:
+                soc = max(0, soc - 1.0)
+            source = target(solar, grid)
+            if soc < 25 and source == "battery":
+                load = False
+            elif soc > 30:
+                load = True
+            shed += not load
+    return soc, shed
+
+
+REFERENCES = {"ems": reference_ems, "app2": reference_app2}
+
+
+def check(policy, days, block, scenarios=16, seed=1):
+    """Max SoC and shed-tick differences between simulate() and the reference."""
+    chunks = list(simulate.scenarios(scenarios, days, block, seed, cloudy=0.5,
+                                     outages_per_day=4, outage_hours=1))
+    solar = np.concatenate([c[0] for c in chunks])
+    grid = np.concatenate([c[1] for c in chunks])
+    n = int(round(block / simulate.TICKS[policy]))
+    soc_diff = shed_diff = 0
+    for initial in (85.0, 27.0):
+        result = simulate.simulate(chunks, policy, block, initial)
+        for s in range(scenarios):
+            soc, shed = REFERENCES[policy](solar[:, s], grid[:, s], initial, n)
+            soc_diff = max(soc_diff, abs(soc - result["final_soc"][s]))
+            shed_ticks = result["shed_hours"][s] * 3600 / simulate.TICKS[policy]
+            shed_diff = max(shed_diff, abs(shed - round(shed_ticks)))
+    return soc_diff, shed_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--block", type=int, default=300)
+    parser.add_argument("--check-days", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for policy in simulate.POLICIES:
+        soc_diff, shed_diff = check(policy, args.check_days, 60)
+        started = time.perf_counter()
+        result = simulate.simulate(simulate.scenarios(args.scenarios, args.days, args.block),
+                                   policy, args.block)
+        elapsed = time.perf_counter() - started
+        ticks = args.scenarios * args.days * 86400 / simulate.TICKS[policy]
+        results[policy] = {
+            "max_soc_error": soc_diff,
+            "max_shed_tick_error": shed_diff,
+            "seconds": elapsed,
+            "ticks_per_s": ticks / elapsed,
+            "mean_shed_hours": float(result["shed_hours"].mean()),
+        }
+        print(f"{policy:5s} vs reference: max SoC error {soc_diff:.2e}, "
+              f"max shed error {shed_diff} ticks | {args.scenarios} x {args.days} days "
+              f"in {elapsed:.1f} s ({ticks / elapsed / 1e9:.2f} G ticks/s)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Scaling of sites.py: many in-memory sites on one scheduler thread.
+
+Two measurements per site count:
+
+  virtual  SiteScheduler on a VirtualClock for --virtual-seconds of clock
+           time: site-ticks per wall second and us per site-tick (the pure
+           CPU cost of a tick, with no sleeping)
+  realtime the same sites at a 1 s interval in real time for --seconds:
+           CPU use of the process and tick lateness p50/p99, for the heap
+           scheduler and (with --threads) for one ControlLoop thread per site,
+           the layout the single-site apps use
+
+    python bench/sites.py [--sites 10 100 1000] [--seconds 10] [--threads]
+                          [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import ControlLoop, SystemClock, VirtualClock
+from policy import PolicyFile
+from relays import RelayBank
+from sites import DEFAULT_POLICY, RELAY_NAMES, MemoryRelay, Site, SiteScheduler
+
+
+class Lateness:
+    """Stands in for metrics.LoopMetrics and keeps every tick's lateness."""
+
+    def __init__(self):
+        self.samples = []
+
+    def observe_tick(self, duration, lateness):
+        self.samples.append(max(0.0, lateness))
+
+    def percentile(self, q):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else None
+
+
+def make_sites(count):
+    policies = PolicyFile(None, DEFAULT_POLICY)  # shared, as SiteController does
+    sites = []
+    for i in range(count):
+        site = Site(f"sim-{i:04d}", RelayBank({name: MemoryRelay() for name in RELAY_NAMES}),
+                    policies)
+        # Half the sites on grid, half on battery so both policy paths run
+        site.state["grid_available"] = i % 2 == 0
+        sites.append(site)
+    return sites
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+def virtual_run(count, seconds):
+    sites = make_sites(count)
+    scheduler = SiteScheduler(VirtualClock())
+    scheduler.spread(sites)
+    started = time.perf_counter()
+    scheduler.run_for(seconds)
+    elapsed = time.perf_counter() - started
+    ticks = sum(site.ticks for site in sites)
+    return {"site_ticks": ticks, "site_ticks_per_s": ticks / elapsed,
+            "us_per_site_tick": elapsed / ticks * 1e6}
+
+
+def realtime_run(count, seconds, threads):
+    sites = make_sites(count)
+    lateness = Lateness()
+    rss_before = rss_kb()
+    if threads:
+        loops = [ControlLoop(site.integrate, site.step, interval=site.interval,
+                             clock=SystemClock(), metrics=lateness) for site in sites]
+        for loop in loops:
+            loop.start()
+    else:
+        scheduler = SiteScheduler(SystemClock(), metrics=lateness)
+        scheduler.spread(sites)
+        scheduler.start()
+    time.sleep(1.0)  # settle: the first round of ticks and thread start-up
+    lateness.samples.clear()
+    cpu, wall = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    rss_after = rss_kb()
+    if threads:
+        for loop in loops:
+            loop.stop()
+    else:
+        scheduler.stop()
+    return {
+        "cpu_percent": cpu / wall * 100,
+        "late_p50_ms": (lateness.percentile(50) or 0) * 1e3,
+        "late_p99_ms": (lateness.percentile(99) or 0) * 1e3,
+        "ticks_per_s": len(lateness.samples) / wall,
+        "rss_delta_kb": rss_after - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--virtual-seconds", type=float, default=600.0)
+    parser.add_argument("--threads", action="store_true",
+                        help="also measure one ControlLoop thread per site")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for count in args.sites:
+        r = results[count] = {"virtual": virtual_run(count, args.virtual_seconds),
+                              "heap": realtime_run(count, args.seconds, False)}
+        v, h = r["virtual"], r["heap"]
+        print(f"{count:5d} sites | virtual {v['site_ticks_per_s']:8.0f} site-ticks/s "
+              f"({v['us_per_site_tick']:.1f} us each) | heap: CPU {h['cpu_percent']:5.1f}% "
+              f"late p50 {h['late_p50_ms']:.2f} ms p99 {h['late_p99_ms']:.2f} ms")
+        if args.threads:
+            t = r["threads"] = realtime_run(count, args.seconds, True)
+            print(f"{'':11s} | threads: CPU {t['cpu_percent']:5.1f}% late p50 "
+                  f"{t['late_p50_ms']:.2f} ms p99 {t['late_p99_ms']:.2f} ms "
+                  f"RSS +{t['rss_delta_kb'] / 1024:.1f} MB (heap +{h['rss_delta_kb'] / 1024:.1f} MB)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Accuracy and cost of soc.SocEstimator on a synthetic battery.
+
+Simulates a 12 V pack through discharge/charge/rest cycles at --rate Hz: the
+true SoC integrates the true current, the sensors see the terminal voltage
+(true OCV, a larger internal resistance than the model assumes, noise) and
+the current with an offset and noise. Every estimator starts from a wrong
+SoC (--start). Compared:
+
+  coulomb  counting only (SocEstimator without voltage)
+  voltage  per-second mean voltage through the OCV table (what sensors.py did
+           before SocEstimator)
+  kalman   SocEstimator, fed every sample
+
+Reports RMS / max error after the first --settle minutes, the final error,
+and the estimator's cost per sample and samples per second.
+
+    python bench/soc.py [--hours 2] [--rate 100] [--start 60] [--seed 1]
+                        [--json results.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from soc import SocEstimator, soc_from_voltage
+
+CAPACITY_AH = 100.0
+TRUE_OHMS = 0.025  # the estimators assume 0.02
+CURRENT_OFFSET = 0.3  # A, sensor bias
+# (minutes, amps): + discharges, - charges
+CYCLE = [(40, 12.0), (10, 0.0), (25, -18.0), (15, 4.0)]
+
+
+def samples(hours, rate, true_start, seed):
+    """(t, measured volts, measured amps, true SoC) per sample."""
+    rng = random.Random(seed)
+    truth = SocEstimator(CAPACITY_AH, soc=true_start, internal_ohms=TRUE_OHMS)
+    dt = 1.0 / rate
+    total = int(hours * 3600 * rate)
+    period = sum(minutes for minutes, _ in CYCLE) * 60
+    for n in range(total):
+        t = n * dt
+        into = t % period
+        for minutes, amps in CYCLE:
+            if into < minutes * 60:
+                break
+            into -= minutes * 60
+        amps += 1.5 * math.sin(t / 7.0)  # load wander
+        soc = truth.update(t, None, amps)
+        ocv, _ = truth.ocv(soc)
+        volts = ocv - amps * TRUE_OHMS + rng.gauss(0.0, 0.03)
+        yield t, volts, amps + CURRENT_OFFSET + rng.gauss(0.0, 0.2), soc
+
+
+def errors(estimates, settle):
+    tail = [e - s for t, e, s in estimates if t >= settle and e is not None]
+    return {"rms": math.sqrt(sum(x * x for x in tail) / len(tail)),
+            "max": max(abs(x) for x in tail), "final": tail[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--rate", type=int, default=100)
+    parser.add_argument("--start", type=float, default=60.0, help="initial SoC guess (truth: 85)")
+    parser.add_argument("--settle", type=float, default=20.0, help="minutes before errors count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    trace = list(samples(args.hours, args.rate, 85.0, args.seed))
+    coulomb = SocEstimator(CAPACITY_AH, soc=args.start)
+    kalman = SocEstimator(CAPACITY_AH, soc=args.start)
+    runs = {"coulomb": [], "voltage": [], "kalman": []}
+    second, volts_sum, amps_sum, count = 0, 0.0, 0.0, 0
+    voltage_soc = None
+    kalman_s = 0.0
+    for t, volts, amps, true_soc in trace:
+        coulomb.update(t, None, amps)
+        started = time.perf_counter()
+        kalman.update(t, volts, amps)
+        kalman_s += time.perf_counter() - started
+        volts_sum, amps_sum, count = volts_sum + volts, amps_sum + amps, count + 1
+        if int(t) != second:  # per-second decimation, as the control loop sees it
+            voltage_soc = soc_from_voltage(volts_sum / count, amps_sum / count, 0.02)
+            second, volts_sum, amps_sum, count = int(t), 0.0, 0.0, 0
+        if count == 0:  # once a second
+            runs["coulomb"].append((t, coulomb.soc, true_soc))
+            runs["voltage"].append((t, voltage_soc, true_soc))
+            runs["kalman"].append((t, kalman.soc, true_soc))
+
+    # Raw throughput: one estimator, no trace bookkeeping
+    bench = SocEstimator(CAPACITY_AH, soc=args.start)
+    update = bench.update
+    started = time.perf_counter()
+    for t, volts, amps, _ in trace:
+        update(t, volts, amps)
+    raw_s = time.perf_counter() - started
+
+    results = {"samples": len(trace), "hours": args.hours, "rate_hz": args.rate,
+               "start_guess": args.start, "true_start": 85.0,
+               "errors": {name: errors(run, args.settle * 60) for name, run in runs.items()},
+               "kalman_sigma": kalman.sigma,
+               "kalman_ohms": kalman.internal_ohms, "true_ohms": TRUE_OHMS,
+               "us_per_update": raw_s / len(trace) * 1e6,
+               "updates_per_s": len(trace) / raw_s,
+               "us_per_update_in_loop": kalman_s / len(trace) * 1e6}
+    print(f"{len(trace)} samples ({args.hours} h at {args.rate} Hz), start guess "
+          f"{args.start}% (truth 85%)")
+    for name, e in results["errors"].items():
+        print(f"  {name:8s} rms {e['rms']:6.2f}%  max {e['max']:6.2f}%  final {e['final']:+6.2f}%")
+    print(f"  kalman sigma {kalman.sigma:.2f}%, resistance {kalman.internal_ohms * 1e3:.1f} mOhm "
+          f"(true {TRUE_OHMS * 1e3:.1f}) | {results['us_per_update']:.2f} us/update, "
+          f"{results['updates_per_s']:.0f} updates/s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
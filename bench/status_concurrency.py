@@ -0,0 +1,79 @@
+"""/status latency in app2.py while relay transitions are running.
+
+Reader threads hammer /status through the Flask test client (mock GPIO)
+while, in the second phase, another thread keeps flipping grid availability
+so the actuator is constantly doing break-before-make transfers.
+With copy-on-write snapshots the two phases should show the same p99.
+
+    python bench/status_concurrency.py [--readers 4] [--seconds 5]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app2
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def read_status(client, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        client.get('/status')
+        samples.append(time.perf_counter() - started)
+
+
+def flip_grid(client, stop):
+    grid = True
+    while not stop.is_set():
+        grid = not grid
+        client.post('/control', json={"grid_available": grid})
+        time.sleep(0.25)
+
+
+def run_phase(app, readers, seconds, transitions):
+    stop = threading.Event()
+    samples = []
+    threads = [threading.Thread(target=read_status, args=(app.test_client(), stop, samples))
+               for _ in range(readers)]
+    if transitions:
+        threads.append(threading.Thread(target=flip_grid, args=(app.test_client(), stop)))
+    relays = app.extensions["ems"].relays
+    writes_before = relays.total_writes
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return samples, relays.total_writes - writes_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    app = app2.create_app()
+    app.extensions["ems"].start()
+    time.sleep(0.5)
+
+    for label, transitions in (("idle", False), ("transitions", True)):
+        samples, writes = run_phase(app, args.readers, args.seconds, transitions)
+        print(f"{label:12s} requests={len(samples):7d} "
+              f"p50={percentile(samples, 50) * 1000:.3f} ms "
+              f"p99={percentile(samples, 99) * 1000:.3f} ms "
+              f"max={max(samples) * 1000:.3f} ms relay_writes={writes}")
+
+
+if __name__ == "__main__":
+    main()
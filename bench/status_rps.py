@@ -0,0 +1,69 @@
+"""/status requests per second: jsonify-per-request vs serialize-once.
+
+Runs ems.py on mock GPIO and drives it through the Flask test client, so the
+numbers cover the Flask/Werkzeug stack but not the socket layer. Run it on
+the target (e.g. a Pi 4) before and after a change and compare.
+
+    python bench/status_rps.py [--seconds 3] [--json results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify
+
+import ems
+from engine import orjson
+
+
+def legacy_status(system):
+    # What /status did before: encode the live dict on every request
+    return jsonify(system.state)
+
+
+def measure(client, path, seconds, headers=None):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        client.get(path, headers=headers)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    app = ems.create_app()
+    system = app.extensions["ems"]
+    app.add_url_rule('/status-legacy', 'status_legacy', lambda: legacy_status(system))
+    client = app.test_client()
+    time.sleep(0.2)  # let the control loop publish its first snapshot
+    etag = client.get('/status').headers['ETag']
+
+    results = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "encoder": "orjson" if orjson is not None else "json",
+        "legacy_rps": measure(client, '/status-legacy', args.seconds),
+        "cached_rps": measure(client, '/status', args.seconds),
+        "not_modified_rps": measure(client, '/status', args.seconds, {'If-None-Match': etag}),
+    }
+    for key, value in results.items():
+        print(f"{key:18s} {value:.0f}" if isinstance(value, float) else f"{key:18s} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Telemetry log throughput, range-read speed and write amplification.
+
+Writes a day of 1 s samples into a fresh SQLite file for several batch sizes
+(batch 1 is the naive commit-per-tick baseline) and reports samples/s, bytes
+the process pushed to storage (/proc/self/io write_bytes, falling back to
+wchar on filesystems that don't account it) versus the 14 logical bytes per
+sample, and how long hour/day range scans and hourly compaction take.
+
+    python bench/telemetry_db.py [--samples 86400] [--batches 1,10,60,600]
+                                 [--dir DIR] [--json results.json]
+
+Run it with --dir on the SD card to measure the device you care about.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import relay_mask
+from telemetry_db import TelemetryLog
+
+SAMPLE_BYTES = 14  # timestamp (8) + SoC (4) + source (1) + relay mask (1)
+
+
+def io_counters():
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def run(path, samples, batch_size):
+    log = TelemetryLog(path, batch_size=batch_size, flush_interval=1e9,
+                       retain_seconds=3600)
+    relays = relay_mask({"solar": True, "grid": False, "battery": False, "load": True})
+    start_ts = 1_700_000_000.0
+    before = io_counters()
+    started = time.perf_counter()
+    for i in range(samples):
+        log.record_sample(start_ts + i, 50 + (i % 500) / 10, "solar", relays)
+        if i % 600 == 0:
+            log.record_event("control", {"mode": "auto"}, timestamp=start_ts + i)
+    log.flush()
+    elapsed = time.perf_counter() - started
+    after = io_counters()
+
+    written = after.get("write_bytes", 0) - before.get("write_bytes", 0)
+    if not written:  # tmpfs and some containers don't account write_bytes
+        written = after.get("wchar", 0) - before.get("wchar", 0)
+
+    t = time.perf_counter()
+    hour = log.samples(start_ts + samples / 2, start_ts + samples / 2 + 3600)
+    hour_ms = (time.perf_counter() - t) * 1e3
+    t = time.perf_counter()
+    day = log.samples(start_ts, start_ts + samples)
+    day_ms = (time.perf_counter() - t) * 1e3
+    t = time.perf_counter()
+    log.compact(now=start_ts + samples)
+    compact_ms = (time.perf_counter() - t) * 1e3
+    log.close()
+
+    return {
+        "batch_size": batch_size,
+        "samples": samples,
+        "seconds": elapsed,
+        "samples_per_s": samples / elapsed,
+        "flushes": log.flushes,
+        "bytes_written": written,
+        "write_amplification": written / (samples * SAMPLE_BYTES),
+        "file_bytes": os.path.getsize(path),
+        "hour_scan_ms": hour_ms,
+        "hour_rows": len(hour),
+        "day_scan_ms": day_ms,
+        "day_rows": len(day),
+        "compact_ms": compact_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=86400)
+    parser.add_argument("--batches", default="1,10,60,600")
+    parser.add_argument("--dir", default=None, help="directory for the test database")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for batch_size in (int(b) for b in args.batches.split(",")):
+            path = os.path.join(tmp, f"telemetry-{batch_size}.db")
+            r = run(path, args.samples, batch_size)
+            results.append(r)
+            print(f"batch={r['batch_size']:4d} {r['samples_per_s']:9.0f} samples/s "
+                  f"flushes={r['flushes']:6d} written={r['bytes_written'] / 1e6:7.1f} MB "
+                  f"amplification={r['write_amplification']:6.1f}x "
+                  f"hour={r['hour_scan_ms']:.1f} ms day={r['day_scan_ms']:.1f} ms "
+                  f"compact={r['compact_ms']:.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
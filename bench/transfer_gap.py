@@ -0,0 +1,119 @@
+"""Source transfer gaps of relays.RelayBank under different dead times.
+
+Drives --transfers random source changes through a RelayBank whose devices
+model relay contacts: a contact opens its release time after off() and closes
+its operate time after on(), each with some jitter. Compared:
+
+  none       no dead time (ems.py, app.py, debug/app.py and sbems before)
+  fixed      0.2 s for every relay (app2.py before)
+  default    relays.DEAD_TIME for every relay
+  measured   each relay's release time plus --margin
+
+Reports, per setting, the gap between the break and make edges (what
+ems_transfer_gap_seconds records), the blackout at the contacts (old contact
+open -> new contact closed) and how many transfers overlapped two sources.
+
+    python bench/transfer_gap.py [--transfers 200] [--margin 0.002] [--seed 1]
+                                 [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import GAP_BUCKETS
+from relays import DEAD_TIME, SOURCES, RelayBank
+
+# Seconds. Release is slower than operate with a flyback diode across the coil.
+RELEASE = {"solar": 0.009, "grid": 0.012, "battery": 0.014}
+OPERATE = 0.006
+JITTER = 0.001
+
+
+class ContactRelay:
+    """Relay whose contacts follow the coil after an operate/release delay."""
+
+    def __init__(self, release, rng):
+        self.release = release
+        self.rng = rng
+        self.value = False
+        self.opened = self.closed = None  # contact times of the last off()/on()
+
+    def on(self):
+        self.value = True
+        self.closed = time.perf_counter() + OPERATE + self.rng.uniform(0, JITTER)
+
+    def off(self):
+        self.value = False
+        self.opened = time.perf_counter() + self.release + self.rng.uniform(0, JITTER)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def run(dead_time, transfers, seed):
+    rng = random.Random(seed)
+    devices = {name: ContactRelay(RELEASE[name], rng) for name in SOURCES}
+    gaps = []
+    bank = RelayBank(devices, dead_time=dead_time, on_transfer=gaps.append)
+    current = "grid"
+    bank.select(current)
+    blackouts, overlaps = [], 0
+    started = time.perf_counter()
+    for _ in range(transfers):
+        target = rng.choice([s for s in SOURCES if s != current])
+        bank.select(target)
+        blackout = devices[target].closed - devices[current].opened
+        overlaps += blackout < 0
+        blackouts.append(blackout)
+        current = target
+    elapsed = time.perf_counter() - started
+    return {
+        "gap_p50_ms": percentile(gaps, 50) * 1e3,
+        "gap_p99_ms": percentile(gaps, 99) * 1e3,
+        "blackout_p50_ms": percentile(blackouts, 50) * 1e3,
+        "blackout_p99_ms": percentile(blackouts, 99) * 1e3,
+        "overlaps": overlaps,
+        "histogram": [sum(1 for g in gaps if lo < g <= hi)
+                      for lo, hi in zip((0.0,) + GAP_BUCKETS, GAP_BUCKETS + (float("inf"),))],
+        "transfers_per_s": transfers / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transfers", type=int, default=200)
+    parser.add_argument("--margin", type=float, default=0.002, help="seconds over the release time")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    settings = {
+        "none": 0.0,
+        "fixed": 0.2,
+        "default": DEAD_TIME,
+        "measured": {name: release + JITTER + args.margin for name, release in RELEASE.items()},
+    }
+    results = {}
+    for label, dead_time in settings.items():
+        r = results[label] = run(dead_time, args.transfers, args.seed)
+        print(f"{label:8s} | edge gap p50 {r['gap_p50_ms']:6.1f} ms p99 {r['gap_p99_ms']:6.1f} ms "
+              f"| blackout p50 {r['blackout_p50_ms']:6.1f} ms p99 {r['blackout_p99_ms']:6.1f} ms "
+              f"| overlaps {r['overlaps']:4d}/{args.transfers}")
+    bounds = [f"<={b * 1e3:g}ms" for b in GAP_BUCKETS] + ["+Inf"]
+    print("\nedge gap histogram (transfers per bucket)")
+    print(" " * 9 + " ".join(f"{b:>8s}" for b in bounds))
+    for label, r in results.items():
+        print(f"{label:8s} " + " ".join(f"{n:8d}" for n in r["histogram"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+# --- WebSocket control channel ---
+# One session per dashboard carries both directions: commands in (acked with
+# the server-side latency) and state updates out whenever the published state
+# version changes. This replaces the /status read + /control write round trip.
+
+KEEPALIVE_SECONDS = 15
+
+
+def serve_session(ws, store, execute, keepalive=KEEPALIVE_SECONDS):
+    """Serve one socket until it closes.
+
+    `ws` needs send()/receive() (flask-sock style), `store` is an
+    engine.StateStore and `execute(data)` applies a /control payload and
+    returns a dict merged into the ack.
+    """
+    send_lock = threading.Lock()
+    closed = threading.Event()
+
+    def send(message):
+        with send_lock:
+            ws.send(json.dumps(message))
+
+    def push_state():
+        seen = -1
+        try:
+            while not closed.is_set():
+                version, snapshot = store.wait(seen, timeout=keepalive)
+                if version != seen and snapshot is not None:
+                    seen = version
+                    send({"type": "state", "version": version, "state": snapshot})
+        except Exception:
+            closed.set()  # socket went away
+
+    threading.Thread(target=push_state, daemon=True).start()
+
+    try:
+        while not closed.is_set():
+            raw = ws.receive()
+            if raw is None:
+                break
+            started = time.perf_counter()
+            try:
+                command = json.loads(raw)
+                if not isinstance(command, dict):
+                    raise ValueError("command must be a JSON object")
+            except ValueError as e:
+                send({"type": "ack", "id": None, "ok": False, "error": str(e)})
+                continue
+
+            ack = {"type": "ack", "id": command.get("id")}
+            try:
+                ack.update(execute(command.get("data") or {}))
+                ack["ok"] = True
+            except Exception as e:
+                ack.update(ok=False, error=str(e))
+            ack["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            send(ack)
+    finally:
+        closed.set()
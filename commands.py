@@ -0,0 +1,46 @@
+# --- /control payloads ---
+# A /control body is one command object or a batch: a list of them, or
+# {"commands": [...]}. The whole batch is checked before anything is applied,
+# so a bad command rejects the request with nothing changed; the apps then
+# apply it as one state change and one relay transition.
+
+COMMAND_FIELDS = ("mode", "relay", "state", "solar_available", "grid_available", "toggle")
+MODES = ("auto", "manual")
+FLAGS = ("state", "solar_available", "grid_available")
+
+
+def check_command(data, relays, toggles=()):
+    """Raise ValueError unless `data` is a command this app can apply."""
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    unknown = sorted(set(data) - set(COMMAND_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown field {unknown[0]!r}")
+    if "mode" in data and data["mode"] not in MODES:
+        raise ValueError(f"Unknown mode {data['mode']!r}")
+    if ("relay" in data) != ("state" in data):
+        raise ValueError("'relay' and 'state' go together")
+    if "relay" in data and data["relay"] not in relays:
+        raise ValueError(f"Unknown relay {data['relay']!r}")
+    for field in FLAGS:
+        if field in data and not isinstance(data[field], bool):
+            raise ValueError(f"{field!r} must be true or false")
+    if "toggle" in data and data["toggle"] not in toggles:
+        raise ValueError(f"Cannot toggle {data['toggle']!r}")
+
+
+def parse_commands(payload, relays, toggles=()):
+    """The list of commands in a /control body, all checked; raises ValueError."""
+    if isinstance(payload, dict) and "commands" in payload:
+        payload = payload["commands"]
+        if not isinstance(payload, list):
+            raise ValueError("'commands' must be a list")
+    if not isinstance(payload, list):
+        check_command(payload, relays, toggles)
+        return [payload]
+    for i, command in enumerate(payload):
+        try:
+            check_command(command, relays, toggles)
+        except ValueError as e:
+            raise ValueError(f"Command {i}: {e}") from None
+    return payload
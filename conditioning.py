@@ -0,0 +1,168 @@
+import json
+from collections import deque
+
+# --- Input conditioning ---
+# Availability inputs flap: a passing cloud drops solar for a few seconds, a
+# brownout blips the grid. Fed straight into the policy table every flap is a
+# source transfer: two relay operations and a new state version, and back
+# again on the next tick. Three filters sit between the raw inputs and the
+# relays:
+#
+#   debounce  an input changes only once the raw value has held for a window.
+#             Separate windows for becoming available (rise) and unavailable
+#             (fall) give hysteresis: slow to trust a source, quick to drop it
+#   dwell     after a transfer, stay on the new source for min_dwell seconds
+#   rate      at most max_transfers transfers per transfer_window seconds
+#
+# Dwell and rate only hold back optional transfers, i.e. moving to a preferred
+# source while the current one still works. Leaving a source that became
+# unavailable always goes through at once.
+#
+# The apps run pass-through unless a deployment opts in (EMS_CONDITIONING):
+# with the filters on, a restored source or a dashboard availability toggle
+# takes effect only after the rise window and the dwell, not at once.
+
+INPUTS = ("solar_available", "grid_available")
+
+DEFAULTS = {
+    "rise": 5.0,  # seconds an input must read available before it counts
+    "fall": 0.0,  # ...and unavailable (0: at once)
+    "min_dwell": 30.0,  # seconds on a source before an optional transfer
+    "max_transfers": 6,  # optional transfers per transfer_window (None: no limit)
+    "transfer_window": 600.0,
+}
+
+# Raw inputs straight to the policy, as before conditioning existed
+PASS_THROUGH = {"rise": 0.0, "fall": 0.0, "min_dwell": 0.0, "max_transfers": None}
+
+
+def validate(settings):
+    """Check conditioning settings; raises ValueError describing the first problem."""
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown conditioning keys: {', '.join(sorted(unknown))}")
+    for key, value in settings.items():
+        if key == "max_transfers" and value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{key} must be a non-negative number")
+
+
+class Debounce:
+    """One boolean input that follows the raw value once it has held long enough."""
+
+    def __init__(self, rise, fall):
+        self.rise = rise
+        self.fall = fall
+        self.value = None  # the first reading is taken as is
+        self.suppressed = 0  # raw changes that reverted before their window ran out
+        self._pending = None  # when the raw value started to differ from value
+
+    def update(self, raw, now):
+        raw = bool(raw)
+        if self.value is None or raw == self.value:
+            if self._pending is not None:
+                self.suppressed += 1
+                self._pending = None
+            self.value = raw
+        elif self._pending is None and (self.rise if raw else self.fall) > 0:
+            self._pending = now
+        elif self._pending is None or now - self._pending >= (self.rise if raw else self.fall):
+            self.value = raw
+            self._pending = None
+        return self.value
+
+
+class Conditioner:
+    """Debounced availability and held-back source transfers for one EMS.
+
+    Called from the control loop thread only, with the loop clock's time.
+    `settings` (a dict or its JSON) overrides DEFAULTS, so {} turns on every
+    filter with its default; None means PASS_THROUGH.
+    """
+
+    def __init__(self, settings=None):
+        if isinstance(settings, str):
+            settings = json.loads(settings)
+        settings = dict(DEFAULTS, **(PASS_THROUGH if settings is None else settings))
+        validate(settings)
+        self.settings = settings
+        self.inputs = {name: Debounce(settings["rise"], settings["fall"]) for name in INPUTS}
+        self._debounced = settings["rise"] > 0 or settings["fall"] > 0
+        self.transfers = 0
+        self.suppressed = {"dwell": 0, "rate": 0}  # transfers held back, once per hold
+        self._source = None  # the source of the last transfer and when it happened
+        self._since = None
+        self._recent = deque()  # times of transfers within transfer_window
+        self._held = None  # (current, target) of the transfer being held back
+
+    @property
+    def settled(self):
+        """True when no input change or transfer is waiting out its window.
+
+        Until the raw inputs change, decide() will then return what it did last.
+        """
+        if self._held is not None:
+            return False
+        return not self._debounced or all(d._pending is None for d in self.inputs.values())
+
+    def filter(self, state, now):
+        """Debounced copies of the availability inputs in `state`."""
+        return {name: debounce.update(state[name], now)
+                for name, debounce in self.inputs.items() if name in state}
+
+    def transfer(self, current, target, inputs, now):
+        """`target`, or `current` while the transfer is held back."""
+        if current != self._source:
+            # Changed outside the policy (manual control): no dwell to honour
+            self._source, self._since = current, None
+        if target == current:
+            self._held = None
+            return current
+        forced = (current is None or target is None
+                  or not inputs.get(f"{current}_available", True))
+        if not forced:
+            settings = self.settings
+            window = settings["transfer_window"]
+            while self._recent and now - self._recent[0] >= window:
+                self._recent.popleft()
+            if self._since is not None and now - self._since < settings["min_dwell"]:
+                return self._hold("dwell", current, target)
+            if (settings["max_transfers"] is not None
+                    and len(self._recent) >= settings["max_transfers"]):
+                return self._hold("rate", current, target)
+        self._held = None
+        self._source, self._since = target, now
+        self._recent.append(now)
+        self.transfers += 1
+        return target
+
+    def _hold(self, reason, current, target):
+        if self._held != (current, target):
+            self._held = (current, target)
+            self.suppressed[reason] += 1
+        return current
+
+    def decide(self, policy, state, load_on, now):
+        """policy.decide() on the debounced inputs, with transfers held back.
+
+        `state` holds the raw inputs, battery_level, mode and power_source.
+        """
+        inputs = self.filter(state, now)
+        decision = policy.decide(inputs.get("solar_available"), inputs.get("grid_available"),
+                                 True, state["battery_level"], load_on, state["mode"])
+        if decision is None:
+            return None
+        current = None if state["power_source"] == "none" else state["power_source"]
+        source = self.transfer(current, decision[0], inputs, now)
+        if source != decision[0]:
+            # Staying put: the load rule for the source we stay on applies
+            decision = policy.decide(source == "solar", source == "grid", True,
+                                     state["battery_level"], load_on, state["mode"])
+            decision = (source, decision[1])
+        return decision
+
+    def counts(self):
+        """Suppressed flaps per input and held transfers per reason."""
+        return {"inputs": {name: d.suppressed for name, d in self.inputs.items()},
+                "transfers": dict(self.suppressed), "transferred": self.transfers}
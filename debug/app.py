@@ -1,8 +1,18 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 from gpiozero import OutputDevice
 import threading
 import time
 import logging
+import os
+import sys
+
+# Shared modules (engine, stream) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import assets
+from engine import StateStore
+from policy import PolicyFile
+from relays import DEAD_TIME, RelayBank, load_dead_time
+from stream import SSE_HEADERS, event_stream, parse_last_event_id
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -10,6 +20,8 @@ logger = logging.getLogger('EMS')
 
 app = Flask(__name__)
 
+assets.serve_static(app)
+
 # GPIO Setup (BCM numbering)
 try:
     RELAY_SOLAR = OutputDevice(17, active_high=False)  # IN1
@@ -35,75 +47,70 @@ except Exception as e:
     RELAY_BATT = SimulatedRelay("Battery")
     RELAY_LOAD = SimulatedRelay("Load")
 
+# All relay writes go through the bank: only changed bits hit the GPIO, and a
+# make waits out the release time of the relays just broken (EMS_DEAD_TIME)
+relays = RelayBank({
+    "solar": RELAY_SOLAR,
+    "grid": RELAY_GRID,
+    "battery": RELAY_BATT,
+    "load": RELAY_LOAD
+}, dead_time=load_dead_time(os.environ.get("EMS_DEAD_TIME", DEAD_TIME)))
+
+# Source priority and load shedding as a compiled table (see policy.py);
+# EMS_POLICY may name a JSON file that overrides these and is hot-reloaded
+DEFAULT_POLICY = {
+    "priority": ["solar", "grid", "battery"],
+    "shed_below": 25,
+    "restore_above": None,
+    "shed_on": ["solar", "grid", "battery"],
+    "mode": "auto",
+}
+policies = PolicyFile(os.environ.get("EMS_POLICY"), DEFAULT_POLICY)
+
 # System state
 system_state = {
-    "mode": "auto",
+    "mode": policies.policy.mode,
     "power_source": "battery",
     "battery_level": 85,
     "solar_available": False,
     "grid_available": True,
     "critical_load": True,
     "non_critical_load": True,
-    "relay_status": {
-        "solar": RELAY_SOLAR.value,
-        "grid": RELAY_GRID.value,
-        "battery": RELAY_BATT.value,
-        "load": RELAY_LOAD.value
-    }
+    "relay_status": relays.status()
 }
 
+# Published state snapshots for /stream
+state_store = StateStore()
+
 def set_power_source(source):
     """Set active power source and disable others"""
     logger.debug(f"Switching to {source} power")
     
-    # Turn off all power relays first
-    RELAY_SOLAR.off()
-    RELAY_GRID.off()
-    RELAY_BATT.off()
-    
-    # Enable the requested source
-    if source == "solar":
-        RELAY_SOLAR.on()
-    elif source == "grid":
-        RELAY_GRID.on()
-    elif source == "battery":
-        RELAY_BATT.on()
+    # Break the other sources, then make the requested one (changed relays only)
+    written = relays.select(source)
+    if written:
+        logger.debug(f"Relays written: {written}")
     
     # Update system state
-    system_state["power_source"] = source
-    system_state["relay_status"]["solar"] = RELAY_SOLAR.value
-    system_state["relay_status"]["grid"] = RELAY_GRID.value
-    system_state["relay_status"]["battery"] = RELAY_BATT.value
+    system_state["power_source"] = source or "none"
+    system_state["relay_status"] = relays.status()
 
 # Simulated battery drain/charge thread
 def simulate_system():
     while True:
         try:
             # Update relay status in state
-            system_state["relay_status"] = {
-                "solar": RELAY_SOLAR.value,
-                "grid": RELAY_GRID.value,
-                "battery": RELAY_BATT.value,
-                "load": RELAY_LOAD.value
-            }
+            system_state["relay_status"] = relays.status()
             
-            # Auto mode logic
-            if system_state["mode"] == "auto":
-                # Power source priority: Solar > Grid > Battery
-                if system_state["solar_available"]:
-                    set_power_source("solar")
-                elif system_state["grid_available"]:
-                    set_power_source("grid")
-                else:
-                    set_power_source("battery")
-                
-                # Load shedding when battery low
-                if system_state["battery_level"] < 25:
-                    RELAY_LOAD.off()
-                    system_state["non_critical_load"] = False
-                else:
-                    RELAY_LOAD.on()
-                    system_state["non_critical_load"] = True
+            # Source and load relay from the policy table (None in manual mode)
+            decision = policies.current().decide(
+                system_state["solar_available"], system_state["grid_available"], True,
+                system_state["battery_level"], relays.is_on("load"), system_state["mode"])
+            if decision is not None:
+                source, load_on = decision
+                set_power_source(source)
+                relays.set("load", load_on)
+                system_state["non_critical_load"] = load_on
             
             # Simulate battery changes
             if system_state["power_source"] == "solar" and system_state["solar_available"]:
@@ -113,6 +120,7 @@ def simulate_system():
             else:
                 system_state["battery_level"] = max(0, system_state["battery_level"] - 0.5)
             
+            state_store.publish(system_state)
             time.sleep(1)
         except Exception as e:
             logger.error(f"Simulation error: {e}")
@@ -128,7 +136,14 @@ def index():
 
 @app.route('/status')
 def get_status():
-    return jsonify(system_state)
+    # JSON encoded once per state version; If-None-Match gets a 304
+    return assets.status_response(state_store)
+
+@app.route('/stream')
+def stream():
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID', request.args.get('since')))
+    return Response(event_stream(state_store, last_id),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
 
 @app.route('/control', methods=['POST'])
 def control():
@@ -157,7 +172,7 @@ def control():
                         set_power_source("battery")
             # Handle load relay separately
             elif relay_name == "load":
-                RELAY_LOAD.value = state
+                relays.set("load", state)
                 system_state["non_critical_load"] = state
         
         # Source availability toggles
@@ -169,6 +184,7 @@ def control():
             system_state["grid_available"] = data["grid_available"]
             logger.info(f"Grid available: {data['grid_available']}")
         
+        state_store.publish(system_state)
         return jsonify(success=True)
     except Exception as e:
         logger.error(f"Control error: {e}")
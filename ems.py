@@ -1,46 +1,172 @@
-from flask import Flask, render_template_string, jsonify, request
-from gpiozero import OutputDevice
+from flask import Flask, Response, render_template_string, jsonify, request
+import argparse
+import atexit
+import os
 import threading
-import time
+import assets
+import metrics
+from channel import serve_session
+from commands import parse_commands
+from conditioning import Conditioner
+from engine import ControlLoop, StateStore, make_clock
+from policy import PolicyFile
+from relays import DEAD_TIME, RELAY_LOCK, RelayBank, claim_relays, load_dead_time, open_relays
+from sense import DEFAULT_BOUNCE, SenseInputs, load_pins
+from sensors import SensorPipeline, load_spec
+from stream import SSE_HEADERS, event_stream, parse_last_event_id
+from telemetry import TelemetryRing, history, parse_query, relay_mask
 
-app = Flask(__name__)
-
-# GPIO Setup (BCM numbering)
-RELAY_SOLAR = OutputDevice(17, active_high=False)  # IN1
-RELAY_GRID = OutputDevice(18, active_high=False)   # IN2
-RELAY_BATT = OutputDevice(27, active_high=False)   # IN3
-RELAY_LOAD = OutputDevice(22, active_high=False)   # IN4
+# --- Configuration ---
+# create_app(config) reads these keys; EMS_* environment variables of the same
+# name override the defaults, and `config` overrides both. Importing this
+# module (or calling create_app) touches no hardware and starts no thread.
+DEFAULT_CONFIG = {
+    "EMS_PINS": {"solar": 17, "grid": 18, "battery": 27, "load": 22},  # BCM, IN1-IN4
+    "EMS_TIME_SCALE": None,  # speed-up factor, or "virtual"
+    "EMS_POLICY": None,  # JSON policy file, reloaded when it changes
+    "EMS_TELEMETRY_DB": "ems_telemetry.db",
+    "EMS_RELAY_LOCK": RELAY_LOCK,  # only one process drives the relays ("" disables)
+    "EMS_DEAD_TIME": DEAD_TIME,  # release time before a make: seconds, or {relay: seconds}
+    "EMS_LAZY_START": True,  # claim the relays and start the loop on the first request
+    "EMS_CONDITIONING": None,  # None: raw inputs; {} or overrides: debounce/dwell/rate on
+    "EMS_SENSORS": None,  # None: simulated battery; "fake", a spec or JSON file (see sensors.py)
+    "EMS_SENSE_PINS": None,  # edge-triggered availability inputs, {input: BCM pin} (see sense.py)
+    "EMS_SENSE_BOUNCE": DEFAULT_BOUNCE,  # seconds
+}
+ENV_KEYS = ("EMS_TIME_SCALE", "EMS_POLICY", "EMS_TELEMETRY_DB", "EMS_RELAY_LOCK", "EMS_SENSORS",
+            "EMS_SENSE_PINS", "EMS_DEAD_TIME", "EMS_CONDITIONING")
 
-# System state
-system_state = {
+# Source priority and load shedding: compiled from EMS_POLICY (if set) over
+# these defaults, and reloaded when the file changes
+DEFAULT_POLICY = {
+    "priority": ["solar", "grid", "battery"],
+    "shed_below": 25,
+    "restore_above": None,
+    "shed_on": ["solar", "grid", "battery"],
     "mode": "auto",
-    "power_source": "battery",
-    "battery_level": 85,
-    "solar_available": False,
-    "grid_available": True,
-    "critical_load": True,
-    "non_critical_load": True,
-    "relay_status": {
-        "solar": RELAY_SOLAR.value,
-        "grid": RELAY_GRID.value,
-        "battery": RELAY_BATT.value,
-        "load": RELAY_LOAD.value
-    }
 }
 
-# Simulated battery drain/charge thread
-def simulate_system():
-    while True:
-        # Update relay status
-        system_state["relay_status"] = {
-            "solar": RELAY_SOLAR.value,
-            "grid": RELAY_GRID.value,
-            "battery": RELAY_BATT.value,
-            "load": RELAY_LOAD.value
+TOGGLE_FIELDS = ("solar_available", "grid_available")
+
+
+class EnergySystem:
+    """State, relays and control loop of one EMS.
+
+    Cheap to create: the GPIO, the telemetry stores and the loop thread come
+    up in open()/start(), once per process.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # Real time unless EMS_TIME_SCALE (or --time-scale) asks for faster/virtual time
+        self.clock = make_clock(config["EMS_TIME_SCALE"])
+        self.policies = PolicyFile(config["EMS_POLICY"], DEFAULT_POLICY)
+        # Debounced availability and rate-limited transfers, so flapping inputs
+        # don't swap sources every tick
+        self.conditioner = Conditioner(config["EMS_CONDITIONING"])
+
+        # System state
+        self.state = {
+            "mode": self.policies.policy.mode,
+            "power_source": "battery",
+            "battery_level": 85,
+            "solar_available": False,
+            "grid_available": True,
+            "critical_load": True,
+            "non_critical_load": True,
+            "relay_status": {name: False for name in config["EMS_PINS"]}
         }
-        
-        # Simulate battery changes
-        if system_state["power_source"] == "solar" and system_state["solar_available"]:
+
+        # Published state snapshots for /status and /stream
+        self.state_store = StateStore()
+
+        # Prometheus metrics at /metrics: loop timings, relay switches, state
+        # gauges and per-route latency
+        self.registry = metrics.Registry()
+        self.loop_metrics = metrics.LoopMetrics(self.registry)
+        metrics.register_state(self.registry, self.state_store)
+        metrics.register_conditioning(self.registry, self.conditioner)
+
+        # Wakes immediately on /control, ticks every second
+        self.control_loop = ControlLoop(self.integrate_battery, self.apply_policy,
+                                        interval=1.0, clock=self.clock,
+                                        metrics=self.loop_metrics)
+
+        # Serializes control changes and policy steps, so a server-side toggle
+        # can't race another client and a batch is applied as a whole
+        self.control_lock = threading.Lock()
+        # What the last full policy step decided on (see _apply_policy)
+        self._decided_on = None
+        self.relays = None
+        self.sensors = None  # sensors.SensorPipeline when EMS_SENSORS is set
+        self.sense_inputs = None  # sense.SenseInputs when EMS_SENSE_PINS is set
+        self.telemetry = None
+        self.telemetry_log = None
+        self.started = False
+        self._relay_lock = None
+        self._open_lock = threading.Lock()
+
+    def open(self):
+        """Claim the relays and open the telemetry stores (once; no thread)."""
+        with self._open_lock:
+            if self.relays is not None:
+                return
+            from telemetry_db import TelemetryLog  # sqlite3 is only needed from here on
+            self._relay_lock = claim_relays(self.config["EMS_RELAY_LOCK"])
+
+            # All relay writes go through the bank: only changed bits hit the GPIO
+            self.relays = RelayBank(open_relays(self.config["EMS_PINS"], active_high=False),
+                                    dead_time=load_dead_time(self.config["EMS_DEAD_TIME"]))
+            metrics.register_relays(self.registry, self.relays)
+
+            # Measured battery and availability inputs, sampled on their own thread
+            sensor_spec = load_spec(self.config["EMS_SENSORS"])
+            sense_pins = load_pins(self.config["EMS_SENSE_PINS"])
+            if sensor_spec is not None:
+                # Inputs with a sense pin come from its edges, not the tick average
+                self.sensors = SensorPipeline(sensor_spec, skip=sense_pins or ())
+                metrics.register_sensors(self.registry, self.sensors)
+
+            # One week of per-tick samples (~8.5 MB, fixed)
+            self.telemetry = TelemetryRing()
+
+            # Durable samples and control/relay events (SQLite WAL, flushed in batches)
+            self.telemetry_log = TelemetryLog(self.config["EMS_TELEMETRY_DB"], clock=self.clock)
+            atexit.register(self.telemetry_log.close)
+
+            # Availability sense lines: each edge is applied at once (see sense())
+            if sense_pins is not None:
+                self.sense_inputs = SenseInputs(sense_pins, self.sense,
+                                                self.config["EMS_SENSE_BOUNCE"])
+                self.state.update(self.sense_inputs.values())
+
+            self.state["relay_status"] = self.relays.status()
+            self.state_store.publish(self.state)
+
+    def start(self):
+        """open(), then start the control loop thread. Safe to call repeatedly."""
+        self.open()
+        with self._open_lock:
+            if not self.started:
+                self.started = True
+                if self.sensors is not None:
+                    self.sensors.start()
+                self.control_loop.start()
+        return self
+
+    def use_clock(self, clock):
+        """Switch the loop and telemetry to another clock (relay dead time stays real time)."""
+        self.clock = self.control_loop.clock = clock
+        if self.telemetry_log is not None:
+            self.telemetry_log.clock = clock
+
+    # Battery integration, run once per tick
+    def integrate_battery(self):
+        system_state = self.state
+        if self.sensors is not None:
+            # Measured: the sensor samples since the last tick, averaged
+            system_state.update(self.sensors.poll())
+        elif system_state["power_source"] == "solar" and system_state["solar_available"]:
             # Charging from solar
             system_state["battery_level"] = min(100, system_state["battery_level"] + 1)
         elif system_state["power_source"] == "grid" and system_state["grid_available"]:
@@ -49,60 +175,133 @@ def simulate_system():
         else:
             # Discharging
             system_state["battery_level"] = max(0, system_state["battery_level"] - 0.3)
-        
-        # Auto mode logic
-        if system_state["mode"] == "auto":
-            # Power source priority: Solar > Grid > Battery
-            if system_state["solar_available"]:
-                switch_to_solar()
-            elif system_state["grid_available"]:
-                switch_to_grid()
-            else:
-                switch_to_battery()
-            
-            # Load shedding when battery low
-            if system_state["battery_level"] < 25:
-                RELAY_LOAD.off()
-                system_state["non_critical_load"] = False
-            else:
-                RELAY_LOAD.on()
-                system_state["non_critical_load"] = True
-        
-        time.sleep(1)
-
-# Power switching functions
-def switch_to_solar():
-    RELAY_SOLAR.on()
-    RELAY_GRID.off()
-    RELAY_BATT.off()
-    system_state["power_source"] = "solar"
-
-def switch_to_grid():
-    RELAY_SOLAR.off()
-    RELAY_GRID.on()
-    RELAY_BATT.off()
-    system_state["power_source"] = "grid"
-
-def switch_to_battery():
-    RELAY_SOLAR.off()
-    RELAY_GRID.off()
-    RELAY_BATT.on()
-    system_state["power_source"] = "battery"
-
-# Start simulation thread
-sim_thread = threading.Thread(target=simulate_system, daemon=True)
-sim_thread.start()
-
-@app.route('/')
-def dashboard():
-    return render_template_string('''
+
+        # Keep a fixed-memory history of every tick for /history
+        now = self.clock.time()
+        soc, source = system_state["battery_level"], system_state["power_source"]
+        relays = relay_mask(self.relays.status())  # once, for both stores
+        self.telemetry.append(now, soc, source, relays)
+        # ...and a durable copy that survives a restart (batched, not per tick)
+        self.telemetry_log.record_sample(now, soc, source, relays)
+
+    # Source selection and load shedding, run on every tick and control change
+    def apply_policy(self):
+        # Under control_lock, so a tick never sees half of a /control batch
+        with self.control_lock:
+            self._apply_policy()
+
+    def _apply_policy(self):
+        system_state, relays = self.state, self.relays
+        policy = self.policies.current()
+        if self._policy_inputs(policy) == self._decided_on and self.conditioner.settled:
+            # Most ticks: only the battery level moved, within its band, so the
+            # decision and the relays stand. Publish just the new level.
+            level = system_state["battery_level"]
+            if level != self.state_store.snapshot["battery_level"]:
+                self.state_store.update(battery_level=level)
+            return
+
+        # One table lookup on the conditioned inputs: source and load relay
+        decision = self.conditioner.decide(policy, system_state,
+                                           relays.is_on("load"), self.clock.monotonic())
+        if decision is not None:
+            source, load_on = decision
+            self.switch_to(source)
+            relays.set("load", load_on)
+            system_state["non_critical_load"] = load_on
+
+        # Update relay status, logging actual transitions
+        relay_status = relays.status()
+        if relay_status != system_state["relay_status"]:
+            self.telemetry_log.record_event("relays", relay_status)
+        system_state["relay_status"] = relay_status
+
+        # Publish for /stream clients (version only moves on real changes)
+        self.state_store.publish(system_state)
+        self._decided_on = self._policy_inputs(policy)
+
+    def _policy_inputs(self, policy):
+        """Everything a policy step depends on, battery level reduced to its band."""
+        state = self.state
+        return (policy, policy.band(state["battery_level"]), state["solar_available"],
+                state["grid_available"], state["mode"], state["power_source"])
+
+    # Power switching (None disconnects every source)
+    def switch_to(self, source):
+        self.relays.select(source)
+        self.state["power_source"] = source or "none"
+
+    def apply_control(self, data):
+        """Apply a /control payload and wake the loop. Returns the loop sequence number.
+
+        `data` is one command or a batch (see commands.py). The batch is checked
+        first, then applied as one state change and one relay transition.
+        """
+        commands = parse_commands(data, self.config["EMS_PINS"], TOGGLE_FIELDS)
+        system_state = self.state
+        changes, relay_changes = {}, {}
+        for command in commands:
+            # Mode toggle
+            if "mode" in command:
+                changes["mode"] = command["mode"]
+
+            # Manual relay control (the last command for a relay wins)
+            if "relay" in command:
+                relay_name = command["relay"]
+                state = command["state"]
+                relay_changes[relay_name] = state
+                if relay_name == "load":
+                    changes["non_critical_load"] = state
+                elif state:
+                    changes["power_source"] = relay_name
+
+            # Source availability toggles
+            for field in TOGGLE_FIELDS:
+                if field in command:
+                    changes[field] = command[field]
+
+            # Server-side flip, so clients don't need to read the state first
+            if "toggle" in command:
+                field = command["toggle"]
+                changes[field] = not changes.get(field, system_state[field])
+
+        with self.control_lock:
+            self.relays.apply(relay_changes)
+            system_state.update(changes)
+            self._decided_on = None  # manual relays or load: take a full step
+            self.telemetry_log.record_event("control", data)
+
+        # Wake the control loop so the change reaches the relays now, not next tick
+        return self.control_loop.notify()
+
+    def sense(self, name, value):
+        """Edge on a sense input (gpiozero's thread): record it and wake the loop."""
+        with self.control_lock:
+            self.state[name] = value
+            self.telemetry_log.record_event("sense", {name: value})
+        self.control_loop.notify()
+
+    def execute_control(self, data):
+        """Apply a command (or batch) and return once the relays reflect it.
+
+        Raises TimeoutError if the loop hasn't applied it within a second
+        (stalled, or not started): the current version wouldn't include it.
+        """
+        seq = self.apply_control(data)
+        if not self.control_loop.wait_applied(seq, timeout=1.0):
+            raise TimeoutError(f"Control change {seq} is queued but was not applied within 1 s")
+        return {"version": self.state_store.version}
+
+
+# Dashboard template; rendered once, on first use (see compile_dashboard), not per request
+DASHBOARD_TEMPLATE = '''
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>TriEnergy Management System</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+        <link href="{{ asset_url('vendor/bootstrap.min.css') }}" rel="stylesheet">
         <style>
             body {
                 background-color: #f0f8ff;
@@ -361,6 +560,20 @@ def dashboard():
                 </div>
             </div>
             
+            <!-- History Panel -->
+            <div class="dashboard-card card">
+                <div class="card-header bg-success text-white">
+                    <h5 class="mb-0">Battery History (24 h)</h5>
+                </div>
+                <div class="card-body">
+                    <svg id="history-chart" viewBox="0 0 1000 200" preserveAspectRatio="none"
+                         style="width: 100%; height: 160px; background: #f8f9fa; border-radius: 10px;">
+                        <polyline id="history-line" fill="none" stroke="#0d6efd" stroke-width="2"
+                                  vector-effect="non-scaling-stroke" points=""></polyline>
+                    </svg>
+                </div>
+            </div>
+            
             <!-- Information Panel -->
             <div class="dashboard-card card">
                 <div class="card-header bg-info text-white">
@@ -398,179 +611,304 @@ def dashboard():
         </div>
 
         <script>
-            // Update system status every 2 seconds
-            function updateStatus() {
-                fetch('/status')
+            // Render a state snapshot (from /stream or /status)
+            function applyState(data) {
+                // Update battery level
+                document.getElementById('battery-level').style.width = data.battery_level + '%';
+                document.getElementById('battery-label').textContent = Math.round(data.battery_level) + '%';
+                document.getElementById('battery-percent').textContent = Math.round(data.battery_level) + '%';
+                
+                // Update power source highlighting
+                document.querySelectorAll('.power-source').forEach(el => {
+                    el.classList.remove('active');
+                });
+                document.getElementById(data.power_source + '-source').classList.add('active');
+                
+                // Update power status text
+                document.getElementById('battery-status').textContent = 'Powered by: ' + 
+                    data.power_source.charAt(0).toUpperCase() + data.power_source.slice(1);
+                
+                // Update relay switches
+                document.querySelectorAll('.relay-switch').forEach(switchEl => {
+                    const relay = switchEl.dataset.relay;
+                    switchEl.checked = data.relay_status[relay];
+                    document.getElementById(relay + '-relay-status').textContent = 
+                        data.relay_status[relay] ? 'ON' : 'OFF';
+                });
+                
+                // Update load statuses
+                document.getElementById('critical-load').textContent = 'Critical Load: ' + 
+                    (data.critical_load ? 'ON' : 'OFF');
+                document.querySelector('#critical-load').previousElementSibling.className = 
+                    'status-indicator ' + (data.critical_load ? 'status-on' : 'status-off');
+                
+                document.getElementById('non-critical-load').textContent = 'Non-Critical Load: ' + 
+                    (data.non_critical_load ? 'ON' : 'OFF');
+                document.querySelector('#non-critical-load').previousElementSibling.className = 
+                    'status-indicator ' + (data.non_critical_load ? 'status-on' : 'status-off');
+                
+                // Update solar status
+                document.getElementById('solar-status').textContent = 'Status: ' + 
+                    (data.relay_status.solar ? 'ON' : 'OFF');
+                document.querySelector('#solar-status').previousElementSibling.className = 
+                    'status-indicator ' + (data.relay_status.solar ? 'status-on' : 'status-off');
+                
+                // Update grid status
+                document.getElementById('grid-status').textContent = 'Status: ' + 
+                    (data.relay_status.grid ? 'ON' : 'OFF');
+                document.querySelector('#grid-status').previousElementSibling.className = 
+                    'status-indicator ' + (data.relay_status.grid ? 'status-on' : 'status-off');
+                
+                // Update availability indicators
+                document.getElementById('solar-avail-text').textContent = 
+                    data.solar_available ? 'Available' : 'Not Available';
+                document.getElementById('solar-avail-indicator').className = 
+                    'status-indicator ' + (data.solar_available ? 'status-on' : 'status-off');
+                
+                document.getElementById('grid-avail-text').textContent = 
+                    data.grid_available ? 'Available' : 'Not Available';
+                document.getElementById('grid-avail-indicator').className = 
+                    'status-indicator ' + (data.grid_available ? 'status-on' : 'status-off');
+                
+                // Update mode buttons
+                document.getElementById('auto-btn').classList.toggle('active', data.mode === 'auto');
+                document.getElementById('manual-btn').classList.toggle('active', data.mode === 'manual');
+            }
+            
+            // Battery history: a few hundred downsampled points, refreshed each minute
+            function updateHistory() {
+                const now = Date.now() / 1000;
+                fetch(`/history?from=${now - 86400}&to=${now}&points=300`)
                     .then(response => response.json())
                     .then(data => {
-                        // Update battery level
-                        document.getElementById('battery-level').style.width = data.battery_level + '%';
-                        document.getElementById('battery-label').textContent = Math.round(data.battery_level) + '%';
-                        document.getElementById('battery-percent').textContent = Math.round(data.battery_level) + '%';
-                        
-                        // Update power source highlighting
-                        document.querySelectorAll('.power-source').forEach(el => {
-                            el.classList.remove('active');
-                        });
-                        document.getElementById(data.power_source + '-source').classList.add('active');
-                        
-                        // Update power status text
-                        document.getElementById('battery-status').textContent = 'Powered by: ' + 
-                            data.power_source.charAt(0).toUpperCase() + data.power_source.slice(1);
-                        
-                        // Update relay switches
-                        document.querySelectorAll('.relay-switch').forEach(switchEl => {
-                            const relay = switchEl.dataset.relay;
-                            switchEl.checked = data.relay_status[relay];
-                            document.getElementById(relay + '-relay-status').textContent = 
-                                data.relay_status[relay] ? 'ON' : 'OFF';
-                        });
-                        
-                        // Update load statuses
-                        document.getElementById('critical-load').textContent = 'Critical Load: ' + 
-                            (data.critical_load ? 'ON' : 'OFF');
-                        document.querySelector('#critical-load').previousElementSibling.className = 
-                            'status-indicator ' + (data.critical_load ? 'status-on' : 'status-off');
-                        
-                        document.getElementById('non-critical-load').textContent = 'Non-Critical Load: ' + 
-                            (data.non_critical_load ? 'ON' : 'OFF');
-                        document.querySelector('#non-critical-load').previousElementSibling.className = 
-                            'status-indicator ' + (data.non_critical_load ? 'status-on' : 'status-off');
-                        
-                        // Update solar status
-                        document.getElementById('solar-status').textContent = 'Status: ' + 
-                            (data.relay_status.solar ? 'ON' : 'OFF');
-                        document.querySelector('#solar-status').previousElementSibling.className = 
-                            'status-indicator ' + (data.relay_status.solar ? 'status-on' : 'status-off');
-                        
-                        // Update grid status
-                        document.getElementById('grid-status').textContent = 'Status: ' + 
-                            (data.relay_status.grid ? 'ON' : 'OFF');
-                        document.querySelector('#grid-status').previousElementSibling.className = 
-                            'status-indicator ' + (data.relay_status.grid ? 'status-on' : 'status-off');
-                        
-                        // Update availability indicators
-                        document.getElementById('solar-avail-text').textContent = 
-                            data.solar_available ? 'Available' : 'Not Available';
-                        document.getElementById('solar-avail-indicator').className = 
-                            'status-indicator ' + (data.solar_available ? 'status-on' : 'status-off');
-                        
-                        document.getElementById('grid-avail-text').textContent = 
-                            data.grid_available ? 'Available' : 'Not Available';
-                        document.getElementById('grid-avail-indicator').className = 
-                            'status-indicator ' + (data.grid_available ? 'status-on' : 'status-off');
-                        
-                        // Update mode buttons
-                        document.getElementById('auto-btn').classList.toggle('active', data.mode === 'auto');
-                        document.getElementById('manual-btn').classList.toggle('active', data.mode === 'manual');
+                        const span = Math.max(1, data.to - data.from);
+                        document.getElementById('history-line').setAttribute('points',
+                            data.t.map((t, i) =>
+                                ((t - data.from) / span * 1000).toFixed(1) + ',' +
+                                (200 - data.soc[i] * 2).toFixed(1)
+                            ).join(' '));
                     });
             }
+            updateHistory();
+            setInterval(updateHistory, 60000);
             
-            // Control handlers
-            document.getElementById('auto-btn').addEventListener('click', () => {
+            function updateStatus() {
+                fetch('/status')
+                    .then(response => response.json())
+                    .then(applyState);
+            }
+            
+            // Control channel: one WebSocket carries commands and state updates.
+            // Without it, commands go to POST /control and state comes from /stream.
+            let socket = null;
+            let nextCommandId = 1;
+            const sentAt = new Map();
+            
+            function sendControl(payload) {
+                if (socket) {
+                    const id = nextCommandId++;
+                    sentAt.set(id, performance.now());
+                    socket.send(JSON.stringify({id: id, data: payload}));
+                    return;
+                }
                 fetch('/control', {
                     method: 'POST',
                     headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({mode: 'auto'})
+                    body: JSON.stringify(payload)
                 });
+            }
+            
+            // Control handlers
+            document.getElementById('auto-btn').addEventListener('click', () => {
+                sendControl({mode: 'auto'});
             });
             
             document.getElementById('manual-btn').addEventListener('click', () => {
-                fetch('/control', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({mode: 'manual'})
-                });
+                sendControl({mode: 'manual'});
             });
             
             document.querySelectorAll('.relay-switch').forEach(switchEl => {
                 switchEl.addEventListener('change', function() {
-                    fetch('/control', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({
-                            relay: this.dataset.relay,
-                            state: this.checked
-                        })
+                    sendControl({
+                        relay: this.dataset.relay,
+                        state: this.checked
                     });
                 });
             });
             
+            // Toggles are flipped server-side: one message, no read-then-write race
             document.getElementById('toggle-solar').addEventListener('click', () => {
-                fetch('/status')
-                    .then(response => response.json())
-                    .then(data => {
-                        const newState = !data.solar_available;
-                        fetch('/control', {
-                            method: 'POST',
-                            headers: {'Content-Type': 'application/json'},
-                            body: JSON.stringify({solar_available: newState})
-                        });
-                    });
+                sendControl({toggle: 'solar_available'});
             });
             
             document.getElementById('toggle-grid').addEventListener('click', () => {
-                fetch('/status')
-                    .then(response => response.json())
-                    .then(data => {
-                        const newState = !data.grid_available;
-                        fetch('/control', {
-                            method: 'POST',
-                            headers: {'Content-Type': 'application/json'},
-                            body: JSON.stringify({grid_available: newState})
-                        });
-                    });
+                sendControl({toggle: 'grid_available'});
             });
             
-            // Initial update and set interval
-            updateStatus();
-            setInterval(updateStatus, 2000);
+            // Live updates: push stream, with 2 s polling only as a fallback
+            let pollTimer = null;
+            let source = null;
+            function startPolling() {
+                if (pollTimer) return;
+                updateStatus();
+                pollTimer = setInterval(updateStatus, 2000);
+            }
+            function stopPolling() {
+                clearInterval(pollTimer);
+                pollTimer = null;
+            }
+            
+            function startStream() {
+                if (!window.EventSource) {
+                    startPolling();
+                    return;
+                }
+                if (source) return;
+                // EventSource reconnects by itself and resumes with Last-Event-ID
+                source = new EventSource('/stream');
+                source.addEventListener('state', e => {
+                    stopPolling();
+                    applyState(JSON.parse(e.data));
+                });
+                source.onerror = startPolling;
+            }
+            function stopStream() {
+                if (source) source.close();
+                source = null;
+                stopPolling();
+            }
+            
+            function connectSocket() {
+                if (!window.WebSocket) {
+                    startStream();
+                    return;
+                }
+                const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+                const ws = new WebSocket(scheme + location.host + '/ws');
+                let opened = false;
+                ws.onopen = () => {
+                    opened = true;
+                    socket = ws;
+                    stopStream();
+                };
+                ws.onmessage = e => {
+                    const msg = JSON.parse(e.data);
+                    if (msg.type === 'state') {
+                        applyState(msg.state);
+                    } else if (msg.type === 'ack') {
+                        const rtt = performance.now() - sentAt.get(msg.id);
+                        sentAt.delete(msg.id);
+                        if (!msg.ok) console.error('Command failed:', msg.error);
+                        console.debug(`Command ${msg.id} acked in ${rtt.toFixed(1)} ms ` +
+                                      `(server ${msg.latency_ms} ms)`);
+                    }
+                };
+                ws.onclose = () => {
+                    socket = null;
+                    startStream();
+                    // Only retry a server that has spoken WebSocket before
+                    if (opened) setTimeout(connectSocket, 2000);
+                };
+            }
+            
+            connectSocket();
         </script>
     </body>
     </html>
-    ''')
-
-@app.route('/status')
-def get_status():
-    return jsonify(system_state)
-
-@app.route('/control', methods=['POST'])
-def control():
-    data = request.json
-    
-    # Mode toggle
-    if "mode" in data:
-        system_state["mode"] = data["mode"]
-    
-    # Manual relay control
-    if "relay" in data and "state" in data:
-        relay_name = data["relay"]
-        state = data["state"]
-        
-        if relay_name == "solar":
-            RELAY_SOLAR.value = state
-            if state:
-                system_state["power_source"] = "solar"
-        elif relay_name == "grid":
-            RELAY_GRID.value = state
-            if state:
-                system_state["power_source"] = "grid"
-        elif relay_name == "battery":
-            RELAY_BATT.value = state
-            if state:
-                system_state["power_source"] = "battery"
-        elif relay_name == "load":
-            RELAY_LOAD.value = state
-            system_state["non_critical_load"] = state
-    
-    # Source availability toggles
-    if "solar_available" in data:
-        system_state["solar_available"] = data["solar_available"]
-    
-    if "grid_available" in data:
-        system_state["grid_available"] = data["grid_available"]
-    
-    return jsonify(success=True)
+    '''
+
+
+def compile_dashboard(app):
+    """Render the dashboard once: bytes + ETag + gzip/brotli variants."""
+    with app.app_context():
+        return assets.CompiledAsset(render_template_string(DASHBOARD_TEMPLATE), "text/html")
+
+
+def create_app(config=None):
+    """The EMS Flask app; its EnergySystem is app.extensions["ems"].
+
+    Nothing is claimed here: the relays, telemetry stores and control loop
+    start with the first request (or an explicit start()), and the dashboard
+    is compiled when it is first served.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update({key: os.environ[key] for key in ENV_KEYS if key in os.environ})
+    app.config.update(config or {})
+    system = app.extensions["ems"] = EnergySystem(app.config)
+    metrics.init_app(app, system.registry)
+    assets.serve_static(app)
+    dashboard_page = app.extensions["dashboard"] = assets.LazyAsset(
+        lambda: compile_dashboard(app))
+
+    if app.config["EMS_LAZY_START"]:
+        @app.before_request
+        def start_system():
+            if not system.started:
+                system.start()
+
+    @app.route('/')
+    def dashboard():
+        return dashboard_page.response()
+
+    @app.route('/status')
+    def get_status():
+        # JSON encoded once per state version; If-None-Match gets a 304
+        return assets.status_response(system.state_store)
+
+    @app.route('/history')
+    def get_history():
+        # ?from=&to= in Unix seconds (default: last 24 h), ?points= target size
+        try:
+            start, end, points, method = parse_query(request.args, system.clock.time())
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        return jsonify(history(system.telemetry, start, end, points, method))
+
+    @app.route('/stream')
+    def stream():
+        last_id = parse_last_event_id(request.headers.get('Last-Event-ID', request.args.get('since')))
+        return Response(event_stream(system.state_store, last_id),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    @app.route('/control', methods=['POST'])
+    def control():
+        # One command or a batch; answers with the state version that includes it
+        try:
+            result = system.execute_control(request.json)
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        except RuntimeError as e:  # the control step failed: nothing reached the relays
+            return jsonify(success=False, error=str(e)), 500
+        except TimeoutError as e:  # queued, but the loop didn't get to it
+            return jsonify(success=False, error=str(e)), 504
+        return jsonify(success=True, **result)
+
+    # One WebSocket per dashboard carries commands and state updates (optional)
+    try:
+        from flask_sock import Sock
+    except ImportError:
+        # WebSocket channel is optional; dashboards fall back to /stream + /control
+        Sock = None
+    if Sock is not None:
+        sock = Sock(app)
+
+        @sock.route('/ws')
+        def control_socket(ws):
+            serve_session(ws, system.state_store, system.execute_control)
+
+    return app
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EMS dashboard")
+    parser.add_argument("--time-scale", default=os.environ.get("EMS_TIME_SCALE"),
+                        help="speed-up factor, or 'virtual' to tick as fast as possible")
+    args = parser.parse_args()
+    app = create_app({"EMS_TIME_SCALE": args.time_scale})
+    # debug=True runs this file twice: the reloader's watcher, which never
+    # serves, and the server it restarts on changes. Only the server claims
+    # the relays and starts the loop (WERKZEUG_RUN_MAIN is set there).
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        app.extensions["ems"].start()
     app.run(host='0.0.0.0', port=5000, debug=True)
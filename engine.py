@@ -0,0 +1,330 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import orjson
+except ImportError:
+    # Optional fast encoder; the stdlib one is used otherwise
+    orjson = None
+
+# --- Clocks ---
+# The control loop and relay sequencing read time and sleep through a clock
+# object, so tests and what-if runs can go faster than real time: ScaledClock
+# runs N times faster, VirtualClock jumps straight to the next deadline (a
+# simulated day takes as long as the CPU needs for 86400 ticks). Both start at
+# the current monotonic time, so a running loop can be switched over.
+
+
+class SystemClock:
+    """Real time (the default)."""
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """event.wait(timeout), with timeout in clock seconds."""
+        return event.wait(timeout)
+
+
+class ScaledClock(SystemClock):
+    """Real time sped up by `scale`."""
+
+    def __init__(self, scale):
+        self.scale = float(scale)
+        self._mono0 = time.monotonic()
+        self._wall0 = time.time()
+
+    def monotonic(self):
+        return self._mono0 + (time.monotonic() - self._mono0) * self.scale
+
+    def time(self):
+        return self._wall0 + (self.monotonic() - self._mono0)
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.scale)
+
+    def wait(self, event, timeout):
+        return event.wait(None if timeout is None else timeout / self.scale)
+
+
+class VirtualClock(SystemClock):
+    """Simulated time that only moves when something sleeps or waits."""
+
+    def __init__(self):
+        self._now = self._mono0 = time.monotonic()
+        self._wall0 = time.time()
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self._now
+
+    def time(self):
+        return self._wall0 + (self._now - self._mono0)
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+    def wait(self, event, timeout):
+        if event.is_set() or timeout is None:
+            return event.wait(timeout)
+        self.sleep(timeout)
+        return event.is_set()
+
+
+def make_clock(scale=None):
+    """Clock for a --time-scale value: 1 (or None) is real time, "virtual" or 0
+    runs as fast as possible, anything else is a speed-up factor."""
+    if scale in (None, "", "1", 1):
+        return SystemClock()
+    if scale in ("virtual", "0", 0):
+        return VirtualClock()
+    return ScaledClock(float(scale))
+
+
+# --- Event-driven control loop ---
+# Replaces the fixed `time.sleep()` polling loops. The policy step runs as soon
+# as a control change is signalled, and a periodic tick is kept only for the
+# battery integration.
+
+
+class ControlLoop:
+    """Runs `step` on every control change and `integrate` once per interval."""
+
+    def __init__(self, integrate, step, interval=1.0, name="control-loop", clock=None,
+                 metrics=None):
+        self.integrate = integrate
+        self.step = step
+        self.interval = interval
+        self.name = name
+        self.clock = clock or SystemClock()
+        self.metrics = metrics  # optional metrics.LoopMetrics
+        self.latencies = deque(maxlen=256)  # control-to-relay latency (seconds)
+        self._wake = threading.Event()
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._applied = 0
+        self._failed = 0  # the latest change whose step raised
+        self.error = None  # ...and its exception
+        self._pending_since = None
+        self._running = False
+        self._thread = None
+        self._next_tick = None
+
+    def notify(self):
+        """Signal a control change. Returns a sequence number for wait_applied()."""
+        with self._cond:
+            self._requested += 1
+            if self._pending_since is None:
+                self._pending_since = time.perf_counter()
+            seq = self._requested
+        self._wake.set()
+        return seq
+
+    def wait_applied(self, seq, timeout=None):
+        """Block until the change numbered `seq` has been applied to the relays.
+
+        Returns False on timeout. Raises RuntimeError if the step that picked
+        the change up failed (and no later step has applied it since).
+        """
+        with self._cond:
+            done = self._cond.wait_for(
+                lambda: self._applied >= seq or self._failed >= seq, timeout)
+            if done and self._applied < seq:
+                raise RuntimeError(f"Control step failed: {self.error}")
+            return done
+
+    @property
+    def last_latency(self):
+        return self.latencies[-1] if self.latencies else None
+
+    def start(self):
+        self._running = True
+        self._wake.set()  # apply the policy once at startup
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run_for(self, seconds):
+        """Run the loop in the calling thread for `seconds` of clock time.
+
+        With a VirtualClock this replays hours of ticks in well under a second.
+        """
+        self._wake.set()
+        self.run(until=self.clock.monotonic() + seconds)
+
+    def run(self, until=None):
+        if self._next_tick is None:
+            self._next_tick = self.clock.monotonic() + self.interval
+        while self._running if until is None else self.clock.monotonic() < until:
+            deadline = self._next_tick if until is None else min(self._next_tick, until)
+            self.clock.wait(self._wake, max(0.0, deadline - self.clock.monotonic()))
+            if self._wake.is_set():
+                self._wake.clear()
+            if self._requested != self._applied:
+                with self._cond:
+                    seq = self._requested
+                    started = self._pending_since
+                    self._pending_since = None
+            else:
+                # A plain tick (most of a VirtualClock run): nothing to pick up
+                seq, started = self._applied, None
+
+            began = time.perf_counter()
+            lateness = None
+            error = None
+            try:
+                now = self.clock.monotonic()
+                if now >= self._next_tick:
+                    lateness = now - self._next_tick
+                    self.integrate()
+                    self._next_tick += self.interval
+                    if self._next_tick <= now:
+                        # We fell behind (e.g. a slow relay sequence); don't burst.
+                        self._next_tick = now + self.interval
+                self.step()
+            except Exception as e:
+                print(f"Control loop error: {e}")
+                error = e
+
+            finished = time.perf_counter()
+            if error is not None or seq != self._applied:
+                with self._cond:
+                    if error is not None:
+                        # Not applied: waiters get the error instead of a false success
+                        self._failed, self.error = seq, error
+                    else:
+                        self._applied = seq
+                        if started is not None:
+                            self.latencies.append(finished - started)
+                    self._cond.notify_all()
+            if self.metrics is not None:
+                if lateness is not None:
+                    self.metrics.observe_tick(finished - began, lateness)
+                if started is not None and error is None:
+                    self.metrics.control_latency.observe(finished - started)
+
+
+# --- Versioned state snapshots ---
+# Copy-on-write: every published state is a new dict that is never mutated
+# afterwards, paired with a version number. Readers fetch the current
+# (version, snapshot) pair with one attribute read and never take a lock;
+# writers build the next snapshot off to the side and swap it in. The version
+# only moves when the content actually changed, so stream clients are woken
+# (and sent an event) only for real changes.
+
+
+class StateStore:
+    """Immutable, versioned state snapshots with lock-free reads."""
+
+    def __init__(self, initial=None):
+        self._current = (0, initial)
+        self._encoded = (None, None)
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._waiting = 0  # threads in wait(); with none, a swap skips the condition
+        self._listeners = []
+        # Distinguishes versions across restarts, for ETags
+        self.instance = os.urandom(4).hex()
+
+    @property
+    def version(self):
+        return self._current[0]
+
+    @property
+    def snapshot(self):
+        return self._current[1]
+
+    def get(self):
+        """Return (version, snapshot). O(1), no locking; do not mutate the snapshot."""
+        return self._current
+
+    def encoded(self):
+        """Return (version, JSON bytes) for the current snapshot.
+
+        Encoded at most once per version, on the first request that needs it.
+        """
+        version, snapshot = self._current
+        cached = self._encoded
+        if cached[0] != version:
+            cached = (version, encode_json(snapshot))
+            self._encoded = cached
+        return cached
+
+    def etag(self, version):
+        return f"{self.instance}-{version}"
+
+    def publish(self, state):
+        """Publish a copy of a mutable `state` dict. Returns the current version."""
+        snapshot = copy_tree(state)
+        with self._write_lock:
+            return self._swap(snapshot)
+
+    def update(self, **changes):
+        """Publish the current snapshot with `changes` applied. Returns the version."""
+        with self._write_lock:
+            snapshot = dict(self._current[1] or {})
+            snapshot.update(changes)
+            return self._swap(snapshot)
+
+    def _swap(self, snapshot):
+        version, current = self._current
+        if snapshot == current:
+            return version
+        self._current = (version + 1, snapshot)
+        if self._waiting:
+            with self._cond:
+                self._cond.notify_all()
+        for listener in self._listeners:
+            listener(version + 1)
+        return version + 1
+
+    def subscribe(self, listener):
+        """Call `listener(version)` from the writer thread on every new version.
+
+        Listeners must be quick and thread-safe (e.g. loop.call_soon_threadsafe).
+        """
+        self._listeners.append(listener)
+
+    def wait(self, since, timeout=None):
+        """Wait until the version differs from `since`. Returns (version, snapshot)."""
+        with self._cond:
+            self._waiting += 1
+            try:
+                self._cond.wait_for(lambda: self._current[0] != since, timeout)
+            finally:
+                self._waiting -= 1
+        return self._current
+
+
+def copy_tree(value):
+    """Copy nested dicts and lists (JSON-like state); far cheaper than deepcopy."""
+    if isinstance(value, dict):
+        return {k: copy_tree(v) if isinstance(v, (dict, list)) else v
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_tree(v) if isinstance(v, (dict, list)) else v for v in value]
+    return value
+
+
+def encode_json(obj):
+    """Compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
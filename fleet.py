@@ -0,0 +1,489 @@
+"""Fleet aggregator: polls many EMS nodes' /status and serves a combined view.
+
+    python fleet.py nodes.json [--port 5100] [--interval 2]
+    python fleet.py --serve-fake 500 [--fake-port 7000]   # fake nodes, for testing
+
+nodes.json is a list of base URLs, or {"nodes": [{"name": ..., "url": ...}]}.
+
+Fleet queries (ASGI; also `EMS_FLEET=nodes.json uvicorn --factory fleet:create_app`):
+
+    /fleet                        counts by source, SoC bucket and shed state
+    /fleet/nodes?source=battery&soc_below=30&shed=1&online=1
+    /fleet/nodes/<name>           one node's last status
+    /metrics
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from engine import encode_json, orjson
+
+# --- Node connections ---
+# One persistent HTTP/1.1 connection per node, reused for every poll, so a
+# poll is one request on an open socket rather than a TCP handshake. Each
+# request sends the last ETag; an unchanged node answers 304 with no body
+# and costs neither JSON parsing nor an index update.
+
+
+class HTTPError(Exception):
+    pass
+
+
+class NodeClient:
+    """Keep-alive GET client for one host:port."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path, headers=None):
+        """Returns (status, headers, body); reconnects when the socket is gone."""
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        try:
+            return await self._read_response()
+        except BaseException:
+            self.close()  # half-read response (or a timeout): start clean next time
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HTTPError("connection closed")
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise HTTPError(f"bad status line {status_line[:40]!r}")
+        version, status = parts[0], int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304):
+            body = b""
+        else:
+            body = await self.reader.read()  # no length: the server closes
+            self.close()
+        if headers.get("connection", "").lower() == "close" or version == b"HTTP/1.0":
+            self.close()
+        return status, headers, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def load_json(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+# --- Fleet index ---
+# Nodes are filed under their source, SoC bucket, shed state and online flag
+# as the polls come in, so a fleet query intersects a few small sets instead
+# of scanning every node's status.
+
+SOC_BUCKET = 10  # percent per bucket: 0-9, 10-19, ..., 90-100
+
+
+def soc_bucket(soc):
+    return min(int(soc) // SOC_BUCKET, 100 // SOC_BUCKET - 1) if soc is not None else None
+
+
+def is_shed(status):
+    """True if the node's non-critical load relay is off."""
+    relays = status.get("relay_status") or {}
+    if "load" in relays:
+        return not relays["load"]
+    return not status.get("load_on", status.get("non_critical_load", True))
+
+
+class FleetIndex:
+    """Node names by source, SoC bucket, shed state and online flag."""
+
+    FIELDS = ("source", "bucket", "shed", "online")
+
+    def __init__(self):
+        self.keys = {}  # name: {field: value}
+        self.sets = {field: {} for field in self.FIELDS}  # field: {value: set(names)}
+
+    def update(self, name, status, online):
+        if status is not None:
+            keys = {"source": status.get("power_source"),
+                    "bucket": soc_bucket(status.get("battery_level")),
+                    "shed": is_shed(status), "online": online}
+        else:
+            keys = dict(self.keys.get(name) or dict.fromkeys(self.FIELDS), online=online)
+        old = self.keys.get(name)
+        if old == keys:
+            return
+        for field in self.FIELDS:
+            if old is not None and old[field] != keys[field]:
+                self.sets[field][old[field]].discard(name)
+            if old is None or old[field] != keys[field]:
+                self.sets[field].setdefault(keys[field], set()).add(name)
+        self.keys[name] = keys
+
+    def query(self, **filters):
+        """Names matching all filters, e.g. query(source="battery", shed=True).
+
+        `bucket` may also be a list of buckets (SoC ranges).
+        """
+        selected = None
+        for field in sorted(filters, key=lambda f: self._size(f, filters[f])):
+            values = filters[field]
+            values = values if isinstance(values, (list, tuple, range)) else [values]
+            names = set().union(*(self.sets[field].get(v, ()) for v in values))
+            selected = names if selected is None else selected & names
+            if not selected:
+                return set()
+        return set(self.keys) if selected is None else selected
+
+    def _size(self, field, values):
+        values = values if isinstance(values, (list, tuple, range)) else [values]
+        return sum(len(self.sets[field].get(v, ())) for v in values)
+
+    def counts(self):
+        return {field: {str(value): len(names) for value, names in by_value.items() if names}
+                for field, by_value in self.sets.items()}
+
+
+# --- Poller ---
+
+
+class Node:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url.rstrip("/")
+        parts = urlsplit(self.url)
+        self.client = NodeClient(parts.hostname, parts.port or 80)
+        self.path = (parts.path or "") + "/status"
+        self.status = None
+        self.etag = None
+        self.failures = 0
+        self.last_ok = None
+        self.error = None
+
+
+class Fleet:
+    """Polls every node on its own cadence and keeps the index current.
+
+    Each node is a task: poll, then sleep until its next slot. A failed or
+    timed-out poll backs off exponentially (with jitter) up to
+    `max_backoff`, so dead nodes cost little and don't delay healthy ones;
+    `offline_after` consecutive failures mark a node offline.
+    """
+
+    def __init__(self, nodes, interval=2.0, timeout=1.0, max_backoff=60.0,
+                 offline_after=3, max_in_flight=100, registry=None):
+        self.nodes = {node.name: node for node in nodes}
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.offline_after = offline_after
+        self.max_in_flight = max_in_flight
+        self.index = FleetIndex()
+        self.polls = self.not_modified = self.errors = 0
+        self.lateness = deque(maxlen=16384)  # seconds each poll started after its slot
+        self._tasks = []
+        self._limit = None
+        registry = registry or metrics.Registry()
+        self.registry = registry
+        self.poll_seconds = registry.histogram(
+            "ems_fleet_poll_duration_seconds", "Time for one node /status poll").labels()
+        registry.counter("ems_fleet_polls_total", "Polls by result", ("result",),
+                         callback=lambda: {("changed",): self.polls - self.not_modified - self.errors,
+                                           ("not_modified",): self.not_modified,
+                                           ("error",): self.errors})
+        registry.gauge("ems_fleet_nodes", "Nodes by online state", ("online",),
+                       callback=lambda: {(str(k).lower(),): len(v)
+                                         for k, v in self.index.sets["online"].items()})
+
+    def start(self):
+        self._limit = asyncio.Semaphore(self.max_in_flight)
+        count = max(1, len(self.nodes))
+        for i, node in enumerate(self.nodes.values()):
+            # Spread the first polls over one interval rather than all at once
+            self._tasks.append(asyncio.ensure_future(
+                self._run(node, self.interval * i / count)))
+
+    async def stop(self):
+        while self._tasks:
+            # wait_for (before Python 3.12) can swallow a cancel that races a
+            # response; cancel again until every task has actually finished
+            for task in self._tasks:
+                task.cancel()
+            _, pending = await asyncio.wait(self._tasks, timeout=0.1)
+            self._tasks = list(pending)
+        for node in self.nodes.values():
+            node.client.close()
+
+    def backoff(self, failures):
+        delay = min(self.max_backoff, self.interval * 2 ** (failures - 1))
+        return delay * random.uniform(0.75, 1.0)
+
+    async def _run(self, node, phase):
+        loop = asyncio.get_running_loop()
+        slot = loop.time() + phase
+        while True:
+            await asyncio.sleep(max(0.0, slot - loop.time()))
+            self.lateness.append(loop.time() - slot)
+            ok = await self.poll(node)
+            now = loop.time()
+            if ok:
+                slot += self.interval
+                if slot <= now:
+                    slot = now + self.interval  # fell behind; don't burst
+            else:
+                slot = now + self.backoff(node.failures)
+
+    async def poll(self, node):
+        """One /status request; returns True on success (200 or 304)."""
+        headers = {"If-None-Match": node.etag} if node.etag else None
+        started = time.perf_counter()
+        async with self._limit:
+            try:
+                status, response_headers, body = await asyncio.wait_for(
+                    node.client.get(node.path, headers), self.timeout)
+                if status == 200:
+                    snapshot = load_json(body)
+                    if not isinstance(snapshot, dict):
+                        raise HTTPError("status is not a JSON object")
+                elif status != 304:
+                    raise HTTPError(f"HTTP {status}")
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    HTTPError, ValueError) as e:
+                self.polls += 1
+                self.errors += 1
+                node.failures += 1
+                node.error = str(e) or type(e).__name__
+                if node.failures >= self.offline_after:
+                    self.index.update(node.name, None, False)
+                return False
+        self.polls += 1
+        self.poll_seconds.observe(time.perf_counter() - started)
+        node.failures = 0
+        node.error = None
+        node.last_ok = time.time()
+        if status == 304:
+            self.not_modified += 1
+            self.index.update(node.name, None, True)
+        else:
+            node.status = snapshot
+            node.etag = response_headers.get("etag")
+            self.index.update(node.name, snapshot, True)
+        return True
+
+    def describe(self, node):
+        return {"name": node.name, "url": node.url, "status": node.status,
+                "online": self.index.keys.get(node.name, {}).get("online", False),
+                "failures": node.failures, "error": node.error, "last_ok": node.last_ok}
+
+    def query(self, params):
+        """Index filters from query parameters; raises ValueError on bad values."""
+        filters = {}
+        if "source" in params:
+            filters["source"] = params["source"]
+        if "soc_below" in params:
+            limit = float(params["soc_below"])
+            filters["bucket"] = range(0, soc_bucket(max(0.0, limit - 1e-9)) + 1)
+        for field in ("shed", "online"):
+            if field in params:
+                if params[field] not in ("0", "1"):
+                    raise ValueError(f"{field} must be 0 or 1")
+                filters[field] = params[field] == "1"
+        names = self.index.query(**filters)
+        nodes = [self.nodes[name] for name in sorted(names)]
+        if "soc_below" in params:  # buckets are coarse; check the exact value
+            nodes = [n for n in nodes if n.status and n.status.get("battery_level", 100) < limit]
+        return nodes
+
+
+def load_nodes(spec):
+    """Nodes from a file path, a list of URLs, or {"nodes": [{"name", "url"}]}."""
+    if isinstance(spec, str):
+        with open(spec) as f:
+            spec = json.load(f)
+    if isinstance(spec, dict):
+        spec = spec["nodes"]
+    return [Node(entry["name"], entry["url"]) if isinstance(entry, dict)
+            else Node(urlsplit(entry).netloc, entry) for entry in spec]
+
+
+# --- Query API (ASGI) ---
+
+
+async def respond(send, status, content_type, body):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def respond_json(send, status, payload):
+    await respond(send, status, "application/json", encode_json(payload))
+
+
+class FleetApp:
+    """Serves fleet queries from the index; polling runs on the same event loop."""
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.started = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    self.start()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.fleet.stop()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        self.start()  # servers that skip the lifespan protocol
+        path = scope["path"]
+        params = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        if path == "/fleet":
+            await respond_json(send, 200, {"nodes": len(self.fleet.nodes),
+                                           "counts": self.fleet.index.counts()})
+        elif path == "/fleet/nodes":
+            try:
+                nodes = self.fleet.query(params)
+            except ValueError as e:
+                await respond_json(send, 400, {"success": False, "error": str(e)})
+                return
+            await respond_json(send, 200, [self.fleet.describe(n) for n in nodes])
+        elif path.startswith("/fleet/nodes/"):
+            node = self.fleet.nodes.get(path[len("/fleet/nodes/"):])
+            if node is None:
+                await respond_json(send, 404, {"success": False, "error": "Unknown node"})
+                return
+            await respond_json(send, 200, self.fleet.describe(node))
+        elif path == "/metrics":
+            await respond(send, 200, metrics.CONTENT_TYPE, self.fleet.registry.render().encode())
+        else:
+            await respond_json(send, 404, {"success": False, "error": "Not Found"})
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            self.fleet.start()
+
+
+def create_app(nodes=None, **options):
+    """FleetApp over the nodes in `nodes` (default: the EMS_FLEET file)."""
+    return FleetApp(Fleet(load_nodes(nodes or os.environ["EMS_FLEET"]), **options))
+
+
+# --- Fake nodes ---
+# Lightweight stand-ins for a Pi running ems.py: each port answers /status
+# with keep-alive, an ETag and 304s, and its state moves every few seconds.
+
+
+def fake_status(index, version):
+    rng = random.Random(index * 1000003 + version)
+    source = rng.choice(("solar", "grid", "battery", "battery"))
+    soc = round(rng.uniform(5, 100), 1)
+    return {"mode": "auto", "power_source": source, "battery_level": soc,
+            "relay_status": {"solar": source == "solar", "grid": source == "grid",
+                             "battery": source == "battery", "load": soc >= 25}}
+
+
+async def serve_fake_node(index, port, change_every):
+    started = time.monotonic() - random.Random(index).uniform(0, change_every)
+    cache = {}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                if_none_match = None
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    if line.lower().startswith(b"if-none-match:"):
+                        if_none_match = line.split(b":", 1)[1].strip().decode()
+                version = int((time.monotonic() - started) / change_every)
+                etag = f'"{index}-{version}"'
+                if if_none_match == etag:
+                    writer.write(f"HTTP/1.1 304 Not Modified\r\nETag: {etag}\r\n\r\n".encode())
+                else:
+                    if cache.get("version") != version:
+                        cache.update(version=version, body=encode_json(fake_status(index, version)))
+                    body = cache["body"]
+                    writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                                 f"ETag: {etag}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                                 + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+def raise_fd_limit(wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+
+async def serve_fake_nodes(count, base_port, change_every=10.0):
+    raise_fd_limit(2 * count + 64)  # a listening and an accepted socket per node
+    servers = [await serve_fake_node(i, base_port + i, change_every) for i in range(count)]
+    print(f"{count} fake nodes on 127.0.0.1:{base_port}-{base_port + count - 1}", flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def fake_node_urls(count, base_port):
+    return [{"name": f"fake-{i:04d}", "url": f"http://127.0.0.1:{base_port + i}"}
+            for i in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EMS fleet aggregator")
+    parser.add_argument("nodes", nargs="?", default=os.environ.get("EMS_FLEET"),
+                        help="JSON file listing the nodes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--serve-fake", type=int, metavar="N", help="run N fake nodes instead")
+    parser.add_argument("--fake-port", type=int, default=7000)
+    args = parser.parse_args()
+
+    if args.serve_fake:
+        asyncio.run(serve_fake_nodes(args.serve_fake, args.fake_port))
+    else:
+        import uvicorn
+
+        if not args.nodes:
+            parser.error("a nodes file (or EMS_FLEET) is required")
+        nodes = load_nodes(args.nodes)
+        raise_fd_limit(len(nodes) + 256)
+        app = FleetApp(Fleet(nodes, interval=args.interval, timeout=args.timeout))
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
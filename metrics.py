@@ -0,0 +1,284 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+
+# --- Prometheus metrics ---
+# A minimal, dependency-free registry that renders the Prometheus text format
+# (version 0.0.4). The hot path only does a bisect and two additions under an
+# uncontended lock; values the apps already keep (relay write counts, the
+# published state) are read through callbacks at scrape time and cost nothing
+# between scrapes.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from 50 us (a table lookup tick) to 2.5 s (a sleep-loop overrun)
+DURATION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Seconds, around relay release times (a few ms) up to the old fixed 0.2 s dead time
+GAP_BUCKETS = (0.001, 0.002, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1, 0.2, 0.5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    """One metric family: children per label-value tuple, or a scrape callback.
+
+    `callback()` returns {label_values: value} and replaces stored children.
+    """
+
+    def __init__(self, kind, name, documentation, labelnames=(), callback=None,
+                 buckets=DURATION_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for these label values; cache it on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = (_HistogramValue(self.buckets) if self.kind == "histogram"
+                             else _Value())
+                    self._children[values] = child
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if self.callback is not None:
+            for values, value in self.callback().items():
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value)}")
+            return lines
+        for values, child in list(self._children.items()):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}")
+                continue
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of one app, rendered together for /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Metric("counter", name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Metric("gauge", name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._add(Metric("histogram", name, documentation, labelnames, buckets=buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A broken callback must not take the whole scrape down
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Standard EMS metrics ---
+
+
+class LoopMetrics:
+    """Tick duration, tick jitter and control latency of a control loop."""
+
+    def __init__(self, registry, prefix="ems"):
+        self.tick_duration = registry.histogram(
+            f"{prefix}_tick_duration_seconds", "Time spent in one control loop tick").labels()
+        self.tick_jitter = registry.histogram(
+            f"{prefix}_tick_jitter_seconds",
+            "How late a tick started relative to its schedule").labels()
+        self.control_latency = registry.histogram(
+            f"{prefix}_control_latency_seconds",
+            "Time from a control request until the loop applied it").labels()
+
+    def observe_tick(self, duration, jitter):
+        self.tick_duration.observe(duration)
+        self.tick_jitter.observe(max(0.0, jitter))
+
+
+def register_relays(registry, relays, prefix="ems"):
+    """Per-relay switch counters and dead times, and the transfer gap histogram."""
+    registry.counter(f"{prefix}_relay_switches_total", "GPIO writes per relay", ("relay",),
+                     callback=lambda: {(name,): count for name, count in relays.writes.items()})
+    registry.gauge(f"{prefix}_relay_dead_time_seconds",
+                   "Release time allowed after breaking a relay before any make", ("relay",),
+                   callback=lambda: {(name,): t for name, t in relays.dead_time.items()})
+    gap = registry.histogram(f"{prefix}_transfer_gap_seconds",
+                             "Time from the last break edge to the first make edge of a transfer",
+                             buckets=GAP_BUCKETS).labels()
+    relays.on_transfer = gap.observe
+
+
+def register_actuator(registry, actuator, priorities, prefix="ems"):
+    """Commands, coalescing and backlog of an actuator.Actuator.
+
+    `priorities` names the actuator's priority levels (actuator.PRIORITY_NAMES).
+    """
+    registry.counter(f"{prefix}_actuator_commands_total", "Relay commands submitted",
+                     ("priority",), callback=lambda: {(name,): actuator.commands[i]
+                                                      for i, name in enumerate(priorities)})
+    registry.counter(f"{prefix}_actuator_coalesced_total",
+                     "Pending relay commands replaced by a newer one before being applied",
+                     callback=lambda: {(): actuator.coalesced})
+    registry.gauge(f"{prefix}_actuator_pending", "Relay commands waiting for the actuator",
+                   callback=lambda: {(): actuator.depth})
+
+
+def register_conditioning(registry, conditioner, prefix="ems"):
+    """Input flaps and source transfers held back by a conditioning.Conditioner."""
+    registry.counter(f"{prefix}_input_flaps_suppressed_total",
+                     "Availability changes that reverted within the debounce window",
+                     ("input",), callback=lambda: {(name,): d.suppressed
+                                                   for name, d in conditioner.inputs.items()})
+    registry.counter(f"{prefix}_transfers_suppressed_total",
+                     "Source transfers held back by minimum dwell or the rate limit",
+                     ("reason",), callback=lambda: {(reason,): count for reason, count
+                                                    in conditioner.suppressed.items()})
+    registry.counter(f"{prefix}_source_transfers_total", "Source transfers made by the policy",
+                     callback=lambda: {(): conditioner.transfers})
+
+
+def register_sensors(registry, pipeline, prefix="ems"):
+    """Decimated sensor readings and sampler counters of a sensors.SensorPipeline."""
+    sampler = pipeline.sampler
+    registry.gauge(f"{prefix}_sensor_volts", "Mean voltage over the last control tick",
+                   ("channel",), callback=lambda: {(name,): means[0] for name, means
+                                                   in pipeline.means.items()})
+    registry.gauge(f"{prefix}_sensor_amps", "Mean current over the last control tick",
+                   ("channel",), callback=lambda: {(name,): means[1] for name, means
+                                                   in pipeline.means.items()})
+    registry.counter(f"{prefix}_sensor_samples_total", "Sensor samples consumed",
+                     callback=lambda: {(): pipeline.samples})
+    registry.counter(f"{prefix}_sensor_dropped_total",
+                     "Samples overwritten in the ring before the control loop read them",
+                     callback=lambda: {(): pipeline.reader.dropped})
+    registry.counter(f"{prefix}_sensor_late_total", "Samples taken after their slot",
+                     callback=lambda: {(): sampler.late})
+    registry.counter(f"{prefix}_sensor_errors_total", "Failed sensor reads",
+                     callback=lambda: {(): sampler.errors})
+    if pipeline.soc is not None:
+        registry.gauge(f"{prefix}_soc_sigma_percent",
+                       "Standard deviation of the state-of-charge estimate",
+                       callback=lambda: {(): pipeline.soc.sigma})
+
+
+def register_state(registry, store, prefix="ems", sources=("solar", "grid", "battery")):
+    """Battery level, active source and load gauges from the published state."""
+    def snapshot():
+        return store.snapshot or {}
+
+    registry.gauge(f"{prefix}_battery_level_percent", "Battery state of charge",
+                   callback=lambda: {(): snapshot().get("battery_level", 0)})
+    registry.gauge(f"{prefix}_power_source", "1 for the active power source", ("source",),
+                   callback=lambda: {(s,): int(snapshot().get("power_source") == s)
+                                     for s in sources})
+    registry.gauge(f"{prefix}_source_available", "1 if the source is available", ("source",),
+                   callback=lambda: {(s,): int(bool(snapshot().get(f"{s}_available")))
+                                     for s in sources if f"{s}_available" in snapshot()})
+    registry.gauge(f"{prefix}_load_on", "1 if the non-critical load relay is on",
+                   callback=lambda: {(): int(bool(snapshot().get("relay_status", {}).get("load")))})
+    registry.gauge(f"{prefix}_state_version", "Version of the published state",
+                   callback=lambda: {(): store.version})
+
+
+def init_app(app, registry, prefix="ems"):
+    """Per-route request latency histograms and a /metrics endpoint."""
+    latency = registry.histogram(f"{prefix}_http_request_duration_seconds",
+                                 "Flask request handling time", ("route", "method"))
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_latency(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            latency.labels(route, request.method).observe(time.perf_counter() - started)
+        return response
+
+    app.add_url_rule("/metrics", "metrics",
+                     lambda: Response(registry.render(), content_type=CONTENT_TYPE))
+    return latency
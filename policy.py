@@ -0,0 +1,173 @@
+"""Declarative source-priority and load-shedding policy.
+
+    python policy.py FILE    # validate a policy file and print its table
+"""
+import json
+import os
+import sys
+import time
+
+from relays import SOURCES
+
+# --- Compiled policy ---
+# A policy is a small JSON-able spec:
+#
+#   {"priority": ["solar", "grid", "battery"],  # first available source wins
+#    "shed_below": 25,                           # shed the load when SoC < this
+#    "restore_above": 30,                        # restore when SoC > this (None: as
+#                                                # soon as SoC is not below shed_below)
+#    "shed_on": ["battery"],                     # sources on which shedding applies
+#    "mode": "auto"}                             # startup mode
+#
+# It is compiled once into a decision table over the discretised inputs:
+# availability of each source (3 bits), SoC band (below / between / above the
+# thresholds), the current load relay and the mode. A tick is then one table
+# lookup, and changing the policy means swapping in a new, validated table.
+
+SPEC_KEYS = ("priority", "shed_below", "restore_above", "shed_on", "mode")
+MODES = ("auto", "manual")
+LOW, HOLD, HIGH = 0, 1, 2  # SoC bands
+
+
+def validate(spec):
+    """Check a policy spec; raises ValueError describing the first problem."""
+    unknown = set(spec) - set(SPEC_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown policy keys: {', '.join(sorted(unknown))}")
+    priority = spec.get("priority")
+    if not isinstance(priority, list) or not priority:
+        raise ValueError("priority must be a non-empty list of sources")
+    for name in priority:
+        if name not in SOURCES:
+            raise ValueError(f"Unknown source {name!r} in priority")
+    if len(set(priority)) != len(priority):
+        raise ValueError("priority lists a source twice")
+    for key in ("shed_below", "restore_above"):
+        value = spec.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not 0 <= value <= 100):
+            raise ValueError(f"{key} must be a number from 0 to 100 (or null)")
+    if spec.get("restore_above") is not None:
+        if spec.get("shed_below") is None:
+            raise ValueError("restore_above needs shed_below")
+        if spec["restore_above"] < spec["shed_below"]:
+            raise ValueError("restore_above must not be below shed_below")
+    shed_on = spec.get("shed_on", list(SOURCES))
+    if not isinstance(shed_on, list) or any(name not in SOURCES for name in shed_on):
+        raise ValueError("shed_on must be a list of sources")
+    if spec.get("mode", "auto") not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+
+
+class Policy:
+    """A validated policy spec compiled into a 128-entry decision table."""
+
+    def __init__(self, spec):
+        validate(spec)
+        self.spec = dict(spec)
+        self.priority = tuple(spec["priority"])
+        self.shed_below = spec.get("shed_below")
+        self.restore_above = spec.get("restore_above")
+        self.shed_on = frozenset(spec.get("shed_on", SOURCES))
+        self.mode = spec.get("mode", "auto")
+        self.table = [self._decide(key) for key in range(128)]
+
+    @staticmethod
+    def key(solar, grid, battery, band, load_on, manual):
+        return (solar | grid << 1 | battery << 2 | band << 3
+                | bool(load_on) << 5 | bool(manual) << 6)
+
+    def _decide(self, key):
+        """Slow path, run once per table entry at compile time."""
+        if key >> 6 & 1 or key >> 3 & 3 == 3:
+            return None  # manual mode (or an unused band code): leave the relays alone
+        available = {name: bool(key >> bit & 1) for bit, name in enumerate(SOURCES)}
+        source = next((name for name in self.priority if available[name]), None)
+        band, load_on = key >> 3 & 3, bool(key >> 5 & 1)
+        if band == LOW and source in self.shed_on:
+            load_on = False
+        elif band == HIGH:
+            load_on = True
+        return source, load_on
+
+    def band(self, soc):
+        if soc is None or self.shed_below is None:
+            return HIGH
+        if soc < self.shed_below:
+            return LOW
+        if self.restore_above is None or soc > self.restore_above:
+            return HIGH
+        return HOLD
+
+    def decide(self, solar, grid, battery, soc, load_on, mode="auto"):
+        """(source or None, load_on) for this tick, or None in manual mode."""
+        return self.table[Policy.key(bool(solar), bool(grid), bool(battery),
+                                     self.band(soc), load_on, mode != "auto")]
+
+
+class PolicyFile:
+    """The current Policy, recompiled when its JSON file changes.
+
+    The file only needs the keys it overrides; the rest come from `default`.
+    A file that fails validation is reported and the running policy is kept.
+    Without a file (or once it is deleted) the default policy applies.
+    """
+
+    def __init__(self, path, default, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.default = Policy(default)
+        self.policy = self.default
+        self._mtime = None
+        self._checked = time.monotonic()
+        self.reload()
+
+    def current(self):
+        now = time.monotonic()
+        if self.path and now - self._checked >= self.check_interval:
+            self._checked = now
+            self.reload()
+        return self.policy
+
+    def reload(self):
+        """Pick up file changes now. Returns True if the policy was swapped."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            if self.policy is not self.default:
+                print(f"Policy file {self.path} removed; using the default policy")
+            self.policy = self.default
+            return True
+        try:
+            with open(self.path) as f:
+                spec = dict(self.default.spec, **json.load(f))
+            policy = Policy(spec)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Policy reload failed ({self.path}): {e}; keeping the current policy")
+            return False
+        self.policy = policy
+        print(f"Policy loaded from {self.path}: {' > '.join(policy.priority)}")
+        return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.strip())
+    with open(sys.argv[1]) as f:
+        try:
+            compiled = Policy(json.load(f))
+        except ValueError as e:
+            sys.exit(f"Invalid policy: {e}")
+    print(f"OK: {json.dumps(compiled.spec)}")
+    for key, decision in enumerate(compiled.table):
+        if key >> 3 & 3 == 3 or key >> 6:
+            continue
+        available = [name for bit, name in enumerate(SOURCES) if key >> bit & 1]
+        band = ("low", "hold", "high")[key >> 3 & 3]
+        print(f"  available={','.join(available) or '-':20s} soc={band:4s} "
+              f"load={'on' if key >> 5 & 1 else 'off':3s} -> {decision}")
@@ -0,0 +1,170 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+# --- Relay bank ---
+# Holds the desired on/off vector for a set of relays and only touches the GPIO
+# for bits that actually change. A multi-relay change is applied as one ordered
+# transaction: everything that turns off goes first (break), then everything
+# that turns on (make), so two sources are never connected at once.
+#
+# Dead time: a released relay's contacts take a few milliseconds to open (the
+# release time, from the datasheet or measured with a scope on the contacts).
+# Every relay has its own; a make waits until each relay broken before it has
+# had its release time since its break edge, including breaks made by an
+# earlier transaction. The edges are timestamped, and the gap between the last
+# break and the first make of a transfer (the blackout the load sees, give or
+# take the contacts' own timing) is reported to `on_transfer`. The dead time is
+# physical: it is always waited in real time, whatever clock (--time-scale) the
+# control loop runs on.
+
+SOURCES = ("solar", "grid", "battery")
+# Seconds: a typical hobby relay module releases in 5-10 ms, with margin
+DEAD_TIME = 0.02
+
+
+def load_dead_time(value):
+    """EMS_DEAD_TIME as seconds, or {relay: seconds}; a JSON string of either."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    times = value.values() if isinstance(value, dict) else [value]
+    if any(not isinstance(t, (int, float)) or t < 0 for t in times):
+        raise ValueError(f"Dead time must be seconds >= 0, got {value!r}")
+    return value
+
+
+class RelayBank:
+    """Diff-only, batched writes to a named set of relays."""
+
+    def __init__(self, relays, dead_time=0.0, on_transfer=None, sleep=time.sleep):
+        # relays: {name: device with on(), off() and value}
+        self.relays = dict(relays)
+        self.sleep = sleep  # real time; only a bank of simulated relays may pass another
+        self.on_transfer = on_transfer  # called with each transfer gap (seconds)
+        self.writes = {name: 0 for name in self.relays}
+        self.edges = {}  # {name: (value, perf_counter time)} of each relay's last write
+        self.last_gap = None
+        self._state = {name: bool(device.value) for name, device in self.relays.items()}
+        self._released = 0.0  # perf_counter time by which every broken relay has opened
+        self._lock = threading.Lock()
+        self.set_dead_time(dead_time)
+
+    def set_dead_time(self, dead_time):
+        """Release time before a make: seconds for every relay, or {name: seconds}
+        (relays left out get DEAD_TIME)."""
+        if isinstance(dead_time, dict):
+            unknown = set(dead_time) - set(self.relays)
+            if unknown:
+                raise ValueError(f"Dead time for unknown relays: {sorted(unknown)}")
+            self.dead_time = {name: dead_time.get(name, DEAD_TIME) for name in self.relays}
+        else:
+            self.dead_time = {name: dead_time for name in self.relays}
+
+    def apply(self, changes):
+        """Apply {name: bool} as one transaction. Returns the names written."""
+        with self._lock:
+            diff = {name: bool(value) for name, value in changes.items()
+                    if bool(value) != self._state[name]}
+            if not diff:
+                return []
+            breaks = [name for name, value in diff.items() if not value]
+            makes = [name for name, value in diff.items() if value]
+
+            now = None
+            for name in breaks:
+                self.relays[name].off()
+                now = time.perf_counter()
+                self.edges[name] = (False, now)
+                self._released = max(self._released, now + self.dead_time[name])
+                self._state[name] = False
+                self.writes[name] += 1
+            if makes:
+                wait = self._released - time.perf_counter()
+                if wait > 0:
+                    self.sleep(wait)  # let the released contacts open
+            for name in makes:
+                self.relays[name].on()
+                self.edges[name] = (True, time.perf_counter())
+                self._state[name] = True
+                self.writes[name] += 1
+            if breaks and makes:
+                self.last_gap = self.edges[makes[0]][1] - now
+                if self.on_transfer is not None:
+                    self.on_transfer(self.last_gap)
+            return breaks + makes
+
+    def set(self, name, value):
+        return self.apply({name: value})
+
+    def select(self, source, sources=SOURCES):
+        """Connect `source` (or nothing, for None) and disconnect the others."""
+        return self.apply({name: name == source for name in sources})
+
+    def is_on(self, name):
+        return self._state[name]
+
+    def status(self):
+        return dict(self._state)
+
+    @property
+    def total_writes(self):
+        return sum(self.writes.values())
+
+
+class PinRelay:
+    """RPi.GPIO pin wrapped as an active-low relay device for RelayBank."""
+
+    def __init__(self, gpio, pin):
+        self.gpio = gpio
+        self.pin = pin
+        self.value = False
+
+    def on(self):
+        self.gpio.output(self.pin, self.gpio.LOW)
+        self.value = True
+
+    def off(self):
+        self.gpio.output(self.pin, self.gpio.HIGH)
+        self.value = False
+
+
+# --- Claiming the relays ---
+# Importing an app never touches the GPIO: the pins are opened when it starts,
+# and only by one process at a time. A second process (a stray `python
+# ems.py`, a tool importing the app, the debug reloader's watcher) gets an
+# error instead of silently driving the same relays.
+
+RELAY_LOCK = "/tmp/ems-relays.lock"
+
+
+def claim_relays(lock_path=RELAY_LOCK):
+    """Take an exclusive lock for this process; returns the lock file to keep.
+
+    Raises RuntimeError if another process holds it. A falsy path disables
+    the check. The lock goes away with the process, however it exits.
+    """
+    if not lock_path:
+        return None
+    lock = open(lock_path, "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.seek(0)
+        holder = lock.read().strip() or "?"
+        lock.close()
+        raise RuntimeError(f"Relays are in use by process {holder} (lock {lock_path})")
+    lock.truncate(0)
+    lock.write(str(os.getpid()))
+    lock.flush()
+    return lock
+
+
+def open_relays(pins, **options):
+    """gpiozero OutputDevices for {name: BCM pin}.
+
+    gpiozero (and its pin factory) is imported here, not at module import.
+    """
+    from gpiozero import OutputDevice
+    return {name: OutputDevice(pin, **options) for name, pin in pins.items()}
@@ -1,10 +1,20 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, render_template, request
 import RPi.GPIO as GPIO
 import threading
-import time
+import os
+import sys
+
+# Shared modules (assets, relays) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import assets
+from policy import PolicyFile
+from relays import DEAD_TIME, PinRelay, RelayBank, load_dead_time
+from sense import load_pins
 
 app = Flask(__name__)
 
+assets.serve_static(app)
+
 # GPIO Setup
 RELAY_GRID = 17
 RELAY_BATTERY = 18
@@ -20,10 +30,29 @@ for pin in [RELAY_GRID, RELAY_BATTERY, RELAY_SOLAR, RELAY_OUTPUT]:
     GPIO.setup(pin, GPIO.OUT)
     GPIO.output(pin, GPIO.HIGH)  # Start in OFF state
 
+# Relay writes go through the bank: only pins whose state changes are written,
+# and a make waits out the release time of the relays just broken (EMS_DEAD_TIME)
+relays = RelayBank({
+    'grid': PinRelay(GPIO, RELAY_GRID),
+    'battery': PinRelay(GPIO, RELAY_BATTERY),
+    'solar': PinRelay(GPIO, RELAY_SOLAR),
+    'output': PinRelay(GPIO, RELAY_OUTPUT),
+}, dead_time=load_dead_time(os.environ.get('EMS_DEAD_TIME', DEAD_TIME)))
+
+# Source priority as a compiled table (see policy.py). EMS_POLICY may name a
+# JSON file that overrides it; the file is reloaded whenever it changes.
+DEFAULT_POLICY = {
+    'priority': ['solar', 'battery', 'grid'],
+    'shed_below': None,
+    'shed_on': [],
+    'mode': 'auto',
+}
+policies = PolicyFile(os.environ.get('EMS_POLICY'), DEFAULT_POLICY)
+
 # System State
 state = {
-    'mode': 'auto',
-    'source_priority': ['solar', 'battery', 'grid'],
+    'mode': policies.policy.mode,
+    'source_priority': list(policies.policy.priority),
     'solar_available': True,
     'battery_available': True,
     'grid_available': True,
@@ -31,45 +60,57 @@ state = {
     'output_enabled': False
 }
 
+# Wakes the source loop early (sense line edges); otherwise it runs every 2 s
+wake = threading.Event()
+
 def update_power_source():
     while True:
-        if state['mode'] == 'auto':
-            # Auto source selection logic
-            for source in state['source_priority']:
-                if source == 'solar' and state['solar_available']:
-                    activate_source('solar')
-                    break
-                elif source == 'battery' and state['battery_available']:
-                    activate_source('battery')
-                    break
-                elif source == 'grid' and state['grid_available']:
-                    activate_source('grid')
-                    break
+        wake.clear()  # before reading the state, so an edge during this pass isn't lost
+        policy = policies.current()
+        state['source_priority'] = list(policy.priority)
+        # Auto source selection: one table lookup (None in manual mode, or
+        # when no source is available, which keeps the current one)
+        decision = policy.decide(state['solar_available'], state['grid_available'],
+                                 state['battery_available'], None, False, state['mode'])
+        if decision is not None and decision[0] is not None:
+            activate_source(decision[0])
         update_output()
-        time.sleep(2)
+        wake.wait(2)
 
 def activate_source(source):
-    # Turn off all sources first
-    GPIO.output(RELAY_GRID, GPIO.HIGH)
-    GPIO.output(RELAY_BATTERY, GPIO.HIGH)
-    GPIO.output(RELAY_SOLAR, GPIO.HIGH)
-    
-    # Activate selected source
-    if source == 'grid':
-        GPIO.output(RELAY_GRID, GPIO.LOW)
-    elif source == 'battery':
-        GPIO.output(RELAY_BATTERY, GPIO.LOW)
-    elif source == 'solar':
-        GPIO.output(RELAY_SOLAR, GPIO.LOW)
-    
+    # Break the other sources, then make the selected one. Relays that are
+    # already in the right state are not written, so the active relay no
+    # longer pulses on every pass.
+    relays.select(source)
     state['active_source'] = source
 
 def update_output():
     # Enable/disable output relay
-    if state['output_enabled'] and state['active_source']:
-        GPIO.output(RELAY_OUTPUT, GPIO.LOW)
-    else:
-        GPIO.output(RELAY_OUTPUT, GPIO.HIGH)
+    relays.set('output', bool(state['output_enabled'] and state['active_source']))
+
+# Availability sense lines (optional), e.g.
+# EMS_SENSE_PINS='{"grid_available": 5, "solar_available": 6}'. RPi.GPIO calls
+# on_sense from its event thread on every edge, so a lost source is switched
+# away from at once instead of on the loop's next 2 s pass.
+SENSE_PINS = load_pins(os.environ.get('EMS_SENSE_PINS')) or {}
+SENSE_BOUNCE_MS = 5
+
+def read_sense(options):
+    level = GPIO.input(options['pin'])
+    return level == (GPIO.LOW if options.get('pull_up') else GPIO.HIGH)
+
+def on_sense(pin):
+    for name, options in SENSE_PINS.items():
+        if options['pin'] == pin:
+            state[name] = read_sense(options)
+    wake.set()
+
+for name, options in SENSE_PINS.items():
+    GPIO.setup(options['pin'], GPIO.IN,
+               pull_up_down=GPIO.PUD_UP if options.get('pull_up') else GPIO.PUD_DOWN)
+    state[name] = read_sense(options)
+    GPIO.add_event_detect(options['pin'], GPIO.BOTH, callback=on_sense,
+                          bouncetime=SENSE_BOUNCE_MS)
 
 # Start background thread
 thread = threading.Thread(target=update_power_source, daemon=True)
@@ -79,10 +120,6 @@ thread.start()
 def index():
     return render_template('index.html', state=state)
 
-@app.route('/static/<path:filename>')
-def static_files(filename):
-    return send_from_directory('static', filename)
-
 @app.route('/set_mode', methods=['POST'])
 def set_mode():
     state['mode'] = request.form['mode']
@@ -0,0 +1,66 @@
+import json
+import time
+from functools import partial
+
+# --- Edge-triggered availability inputs ---
+# Grid-sense and solar-sense lines (an optocoupler on the charger output, a
+# comparator on the panel voltage) wired to GPIO inputs. gpiozero calls back
+# on every edge from its pin factory's event thread: interrupt-driven
+# underneath, since the RPi.GPIO factory uses add_event_detect and lgpio and
+# pigpio use alerts. A lost source is therefore handled within milliseconds
+# instead of at the next 1-2 s tick.
+#
+#   EMS_SENSE_PINS = {"grid_available": 5, "solar_available": 6}
+#                    (or a JSON string of it; a value may also be a dict of
+#                    DigitalInputDevice options, e.g. {"pin": 5, "pull_up": true}
+#                    for a line pulled low while the source is present)
+
+SENSE_INPUTS = ("solar_available", "grid_available")
+DEFAULT_BOUNCE = 0.005  # seconds; edges closer than this are contact bounce
+
+
+def load_pins(value):
+    """EMS_SENSE_PINS as {input: DigitalInputDevice options}, or None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    pins = {}
+    for name, options in value.items():
+        if name not in SENSE_INPUTS:
+            raise ValueError(f"Unknown sense input {name!r}")
+        pins[name] = dict(options) if isinstance(options, dict) else {"pin": options}
+    return pins
+
+
+class SenseInputs:
+    """Availability inputs on GPIO, reported as `on_change(name, value)` on each edge.
+
+    The callback runs on gpiozero's event thread: it must be quick and
+    thread-safe (record the value, wake the control loop).
+    """
+
+    def __init__(self, pins, on_change, bounce_time=DEFAULT_BOUNCE):
+        from gpiozero import DigitalInputDevice  # the pin factory loads here, not at import
+        self.on_change = on_change
+        self.devices = {}
+        self.edges = {name: 0 for name in pins}
+        self.last_edge = None  # (name, value, perf_counter time) of the latest edge
+        for name, options in pins.items():
+            device = DigitalInputDevice(bounce_time=bounce_time or None, **options)
+            device.when_activated = partial(self._edge, name, True)
+            device.when_deactivated = partial(self._edge, name, False)
+            self.devices[name] = device
+
+    def _edge(self, name, value):
+        self.last_edge = (name, value, time.perf_counter())
+        self.edges[name] += 1
+        self.on_change(name, value)
+
+    def values(self):
+        """The current level of every input, e.g. to seed the state at startup."""
+        return {name: device.is_active for name, device in self.devices.items()}
+
+    def close(self):
+        for device in self.devices.values():
+            device.close()
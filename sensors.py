@@ -0,0 +1,313 @@
+import json
+import math
+import random
+import threading
+import time
+from array import array
+
+from soc import SocEstimator
+
+# --- Sensor ingestion ---
+# Replaces the simulated battery and the hand-set availability flags with
+# measurements. A sampler thread reads every sensor (voltage, current) at
+# hundreds of Hz into a ring buffer; the control loop drains it once per tick,
+# averages the block (decimation: a boxcar filter down to the tick rate) and
+# turns the means into the EMS inputs: solar_available/grid_available from
+# voltage thresholds, and battery_level from a SocEstimator (soc.py) fed with
+# every battery sample.
+#
+#   EMS_SENSORS = None     the old simulation (default)
+#               = "fake"   FakeSensors, for running and benchmarking anywhere
+#               = {...} or a JSON file with {"rate_hz": 500, "channels":
+#                 {"battery": {"type": "ina219", "bus": 1, "address": 64,
+#                 "shunt_ohms": 0.1}, "solar": {...}, "grid": {...}}}
+
+FAKE_SENSORS = {
+    "rate_hz": 500,
+    "channels": {
+        # 12 V battery drifting between ~40% and ~95% over an hour
+        "battery": {"type": "fake", "voltage": 12.3, "swing": 0.35, "period": 3600,
+                    "current": 3.0, "noise": 0.02},
+        "solar": {"type": "fake", "voltage": 15.0, "swing": 6.0, "period": 600, "noise": 0.3},
+        "grid": {"type": "fake", "voltage": 13.8, "noise": 0.05},
+    },
+}
+
+SPEC_DEFAULTS = {
+    "rate_hz": 500,  # samples per second per sensor (0: as fast as possible)
+    "capacity": 4096,  # ring slots; the control loop must drain it within this many samples
+    "solar_min_v": 14.0,  # panel voltage above which solar counts as available
+    "grid_min_v": 12.5,  # charger output voltage above which the grid counts as available
+    "internal_ohms": 0.02,  # battery resistance, for the voltage sag under load
+    "capacity_ah": 100.0,  # battery capacity, for coulomb counting
+}
+
+
+def load_spec(value):
+    """EMS_SENSORS as a spec dict with defaults filled in, or None."""
+    if not value:
+        return None
+    if value == "fake":
+        value = FAKE_SENSORS
+    elif isinstance(value, str):
+        with open(value) as f:
+            value = json.load(f)
+    spec = dict(SPEC_DEFAULTS, **value)
+    if not isinstance(spec.get("channels"), dict) or not spec["channels"]:
+        raise ValueError("EMS_SENSORS needs a 'channels' object")
+    return spec
+
+
+# --- Sensors: read() -> (volts, amps); raise OSError on a failed read ---
+
+
+class FakeSensor:
+    """A sine wave plus Gaussian noise, for running without hardware."""
+
+    def __init__(self, voltage=12.0, current=0.0, swing=0.0, period=60.0, noise=0.0, seed=None):
+        self.voltage = voltage
+        self.current = current
+        self.swing = swing
+        self.omega = 2 * math.pi / period
+        self.noise = noise
+        self.gauss = random.Random(seed).gauss
+
+    def read(self):
+        wave = self.swing * math.sin(time.monotonic() * self.omega)
+        return (self.voltage + wave + self.gauss(0.0, self.noise),
+                self.current + self.gauss(0.0, self.noise))
+
+
+class INA219:
+    """Bus voltage and shunt current of a TI INA219 on I2C (needs smbus2).
+
+    Uses the power-on configuration: 32 V range, +-320 mV shunt range, 12-bit
+    conversions every 532 us, i.e. up to ~1.8 kHz.
+    """
+
+    SHUNT_VOLTAGE = 0x01
+    BUS_VOLTAGE = 0x02
+
+    def __init__(self, bus=1, address=0x40, shunt_ohms=0.1):
+        from smbus2 import SMBus  # only needed with real sensors
+        self.bus = SMBus(bus)
+        self.address = address
+        self.shunt_ohms = shunt_ohms
+
+    def _register(self, register):
+        raw = self.bus.read_word_data(self.address, register)
+        return (raw & 0xFF) << 8 | raw >> 8  # the INA219 sends the MSB first
+
+    def read(self):
+        shunt = self._register(self.SHUNT_VOLTAGE)
+        if shunt & 0x8000:
+            shunt -= 0x10000
+        bus = self._register(self.BUS_VOLTAGE)
+        return (bus >> 3) * 0.004, shunt * 10e-6 / self.shunt_ohms
+
+
+class ADCSensor:
+    """Voltage (and optionally current) through a voltage divider/current
+    sense amplifier into MCP3008 channels, read with gpiozero."""
+
+    def __init__(self, voltage_channel, current_channel=None, voltage_scale=1.0,
+                 current_scale=1.0, current_offset=0.0):
+        from gpiozero import MCP3008
+        self.voltage = MCP3008(voltage_channel)
+        self.current = MCP3008(current_channel) if current_channel is not None else None
+        self.voltage_scale = voltage_scale
+        self.current_scale = current_scale
+        self.current_offset = current_offset
+
+    def read(self):
+        voltage = self.voltage.value * self.voltage_scale
+        if self.current is None:
+            return voltage, 0.0
+        return voltage, (self.current.value - self.current_offset) * self.current_scale
+
+
+SENSOR_TYPES = {"fake": FakeSensor, "ina219": INA219, "adc": ADCSensor}
+
+
+def open_sensor(spec):
+    options = dict(spec)
+    kind = options.pop("type", None)
+    if kind not in SENSOR_TYPES:
+        raise ValueError(f"Unknown sensor type {kind!r}")
+    return SENSOR_TYPES[kind](**options)
+
+
+# --- Ring buffer ---
+# Single producer (the sampler thread), single consumer (the control loop),
+# no lock. Samples are fixed-width rows of doubles in one flat array. The
+# writer fills a slot and only then advances `head`, which the reader never
+# writes; the reader keeps its own tail. If the reader falls more than a ring
+# behind, the oldest samples are overwritten, and it notices afterwards by
+# re-reading `head` and discards any rows that may have changed under it.
+
+
+class SampleRing:
+    """Fixed-width rows of floats; `head` counts the rows ever written."""
+
+    def __init__(self, width, capacity=4096):
+        self.width = width
+        self.capacity = capacity
+        self.data = array("d", bytes(8 * width * capacity))
+        self.head = 0
+
+    def push(self, row):
+        """Write one row (an array('d') of `width` values). Writer thread only."""
+        i = self.head % self.capacity * self.width
+        self.data[i:i + self.width] = row
+        self.head += 1  # publishes the row
+
+
+class RingReader:
+    """The consumer side of a SampleRing."""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.tail = ring.head
+        self.dropped = 0  # rows overwritten before they were read
+
+    def read(self):
+        """Rows written since the last read as (flat array, row count)."""
+        ring = self.ring
+        width, capacity = ring.width, ring.capacity
+        head = ring.head
+        start = max(self.tail, head - capacity)
+        a, b = start % capacity * width, head % capacity * width
+        if head == start:
+            block = ring.data[0:0]
+        elif a < b:
+            block = ring.data[a:b]
+        else:  # wraps around the end of the ring
+            block = ring.data[a:] + ring.data[:b]
+        # Rows older than this may have been reused by the writer while we copied
+        valid_from = ring.head - capacity + 1
+        stale = min(head - start, max(0, valid_from - start))
+        if stale:
+            block = block[stale * width:]
+        self.dropped += start - self.tail + stale
+        self.tail = head
+        return block, head - start - stale
+
+
+# --- Sampling thread ---
+
+
+class Sampler:
+    """Reads every sensor at `rate_hz` on its own thread into a SampleRing.
+
+    Row layout: monotonic time, then volts and amps per sensor.
+    """
+
+    def __init__(self, sensors, rate_hz=500, capacity=4096, name="sensor-sampler"):
+        self.names = list(sensors)
+        self.sensors = [sensors[name] for name in self.names]
+        self.rate_hz = rate_hz
+        self.name = name
+        self.ring = SampleRing(1 + 2 * len(self.sensors), capacity)
+        self.late = 0  # samples taken after their slot (the thread fell behind)
+        self.errors = 0  # failed sensor reads (that row is skipped)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def run(self):
+        period = 1.0 / self.rate_hz if self.rate_hz else 0.0
+        row = array("d", bytes(8 * self.ring.width))
+        push, sensors, clock = self.ring.push, self.sensors, time.perf_counter
+        deadline = clock()
+        while self._running:
+            row[0] = clock()
+            try:
+                k = 1
+                for sensor in sensors:
+                    row[k], row[k + 1] = sensor.read()
+                    k += 2
+            except OSError:
+                self.errors += 1
+            else:
+                push(row)
+            if period:
+                # Absolute schedule, so the rate doesn't drift with read time
+                deadline += period
+                delay = deadline - clock()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.late += 1
+                    if delay < -period:
+                        deadline = clock()  # fell behind by a whole slot; don't burst
+
+
+class SensorPipeline:
+    """Sensors -> sampler thread -> ring -> one decimated reading per tick."""
+
+    def __init__(self, spec, skip=()):
+        self.spec = spec
+        self.skip = frozenset(skip)  # inputs reported elsewhere (edge-triggered sense pins)
+        sensors = {name: open_sensor(channel) for name, channel in spec["channels"].items()}
+        self.sampler = Sampler(sensors, spec["rate_hz"], spec["capacity"])
+        self.reader = RingReader(self.sampler.ring)
+        self.means = {}  # {channel: (volts, amps)} of the last block
+        # Battery SoC, updated per sample (not per block) so the coulomb count
+        # integrates the real current waveform
+        self.soc = None
+        if "battery" in self.sampler.names:
+            self.soc = SocEstimator(spec["capacity_ah"], internal_ohms=spec["internal_ohms"])
+        self.samples = 0  # rows consumed
+
+    def start(self):
+        if self.sampler._thread is None:
+            self.sampler.start()
+        return self
+
+    def stop(self):
+        self.sampler.stop()
+
+    def poll(self):
+        """Average the samples since the last poll into EMS inputs.
+
+        Returns {} until the first samples arrive; keys only for the
+        channels that exist (battery_level, solar_available, grid_available).
+        """
+        self.decimate(*self.reader.read())
+        return self.inputs()
+
+    def decimate(self, block, count):
+        """Per-channel means of `count` rows read from the ring."""
+        if count:
+            width = self.sampler.ring.width
+            self.means = {name: (sum(block[1 + 2 * k::width]) / count,
+                                 sum(block[2 + 2 * k::width]) / count)
+                          for k, name in enumerate(self.sampler.names)}
+            self.samples += count
+            if self.soc is not None:
+                k = 1 + 2 * self.sampler.names.index("battery")
+                update = self.soc.update
+                for t, volts, amps in zip(block[0::width], block[k::width], block[k + 1::width]):
+                    update(t, volts, amps)
+
+    def inputs(self):
+        spec, means = self.spec, self.means
+        inputs = {}
+        if self.soc is not None and self.soc.soc is not None:
+            inputs["battery_level"] = round(self.soc.soc, 1)
+        if "solar" in means and "solar_available" not in self.skip:
+            inputs["solar_available"] = means["solar"][0] > spec["solar_min_v"]
+        if "grid" in means and "grid_available" not in self.skip:
+            inputs["grid_available"] = means["grid"][0] > spec["grid_min_v"]
+        return inputs
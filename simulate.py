@@ -0,0 +1,215 @@
+"""Offline, NumPy-batched replay of the ems.py and app2.py battery policies.
+
+    python simulate.py [--policy ems|app2] [--scenarios 2000] [--days 365]
+                       [--block 300] [--seed 0]
+
+Runs the same charge/discharge and shedding rules as the live control loops
+over many availability scenarios at once, for capacity planning.
+"""
+import argparse
+import time
+
+import numpy as np
+
+# --- Batched policy simulator ---
+# Availability is piecewise constant in blocks (default 5 minutes). Within a
+# block every scenario sits on one source with a fixed charge rate, so the
+# per-tick SoC recurrence is a clamped straight line and a whole block of 1 s
+# ticks is evaluated in closed form: one NumPy pass per block, vectorised over
+# scenarios. The first tick of each block is stepped explicitly, because the
+# live loops integrate with the source chosen on the previous tick.
+
+NONE, SOLAR, GRID, BATTERY = 0, 1, 2, 3  # same codes as telemetry.SOURCE_CODES
+SOURCE_NAMES = {SOLAR: "solar", GRID: "grid", BATTERY: "battery"}
+
+# Seconds per control tick in the live apps
+TICKS = {"ems": 1.0, "app2": 2.0}
+
+
+class State:
+    """Per-scenario SoC, current source and load relay, as arrays."""
+
+    def __init__(self, n, soc):
+        self.soc = np.full(n, float(soc))
+        self.source = np.full(n, NONE, dtype=np.int8)
+        self.load = np.zeros(n, dtype=bool)
+
+
+def target_source(solar, grid):
+    """Solar > Grid > Battery, as in both apps' auto mode."""
+    return np.where(solar, SOLAR, np.where(grid, GRID, BATTERY)).astype(np.int8)
+
+
+def count_below(start, rate, n, level):
+    """How many of start + rate*k, k = 0..n-1, are below `level`."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rising = np.where(start >= level, 0,
+                          np.minimum(n, np.ceil((level - start) / rate)))
+        falling = np.where(start < level, n,
+                           n - np.minimum(n, np.floor((start - level) / -rate) + 1))
+    flat = np.where(start < level, n, 0)
+    return np.where(rate > 0, rising, np.where(rate < 0, falling, flat)).astype(np.int64)
+
+
+# --- ems.py: +1 on solar, +0.5 on grid, -0.3 otherwise; shed below 25 ---
+
+EMS_RATES = np.array([-0.3, 1.0, 0.5, -0.3])  # indexed by source code
+
+
+def ems_start(state, solar, grid):
+    state.source[:] = target_source(solar, grid)
+    state.load[:] = state.soc >= 25
+
+
+def ems_block(state, solar, grid, n):
+    """Advance n ticks. Returns ticks spent shed per scenario."""
+    first = np.where((state.source == SOLAR) & solar, 1.0,
+                     np.where((state.source == GRID) & grid, 0.5, -0.3))
+    soc1 = np.clip(state.soc + first, 0, 100)
+    target = target_source(solar, grid)
+    rate = EMS_RATES[target]
+    shed = count_below(soc1, rate, n, 25)
+    state.soc = np.clip(soc1 + rate * (n - 1), 0, 100)
+    state.source = target
+    state.load = state.soc >= 25
+    return shed
+
+
+# --- app2.py: +0.5 on solar, hold on grid, -1 on battery with the load on;
+# shed below 25 (on battery only), restore above 30 ---
+
+def app2_start(state, solar, grid):
+    state.source[:] = target_source(solar, grid)
+    state.load[:] = state.soc > 30
+
+
+def app2_block(state, solar, grid, n):
+    """Advance n ticks. Returns ticks spent shed per scenario."""
+    on_battery_load = (state.source == BATTERY) & state.load
+    first = np.where((state.source == SOLAR) & solar, 0.5,
+                     np.where(on_battery_load, -1.0, 0.0))
+    soc1 = np.clip(state.soc + first, 0, 100)
+    target = target_source(solar, grid)
+    battery = target == BATTERY
+    load1 = np.where(battery & (soc1 < 25), False, np.where(soc1 > 30, True, state.load))
+    m = n - 1  # remaining ticks after the first
+
+    # Solar: charge until full; the load comes back once above 30
+    solar_end = np.minimum(100, soc1 + 0.5 * m)
+    solar_shed = np.where(load1, 0, np.clip(np.floor((30 - soc1) / 0.5), 0, m))
+    # Battery with the load on: drain until below 25, then shed and hold
+    k_shed = np.floor(soc1 - 25) + 1  # tick (after the first) that drops below 25
+    drains_out = battery & load1 & (k_shed <= m)
+    battery_end = np.where(load1, np.where(k_shed <= m, soc1 - k_shed, soc1 - m), soc1)
+    battery_shed = np.where(load1, np.where(k_shed <= m, m - k_shed + 1, 0), m)
+
+    state.soc = np.where(target == SOLAR, solar_end,
+                         np.where(battery, np.maximum(0, battery_end), soc1))
+    shed = (~load1).astype(np.int64) + np.where(
+        target == SOLAR, solar_shed, np.where(battery, battery_shed, m * ~load1))
+    state.load = np.where(target == SOLAR, load1 | (state.soc > 30),
+                          np.where(drains_out, False, load1))
+    state.source = target
+    return shed.astype(np.int64)
+
+
+POLICIES = {"ems": (ems_start, ems_block), "app2": (app2_start, app2_block)}
+
+
+def simulate(chunks, policy="ems", block_seconds=300, initial_soc=85.0, trace_every=3600):
+    """Run `policy` over availability `chunks`.
+
+    `chunks` yields (solar, grid) boolean arrays of shape (blocks, scenarios);
+    each row holds for `block_seconds`. Returns a dict with the SoC trace
+    sampled every `trace_every` seconds (rows) per scenario (columns), seconds
+    on each source, shed hours and the final/minimum SoC.
+    """
+    start, block = POLICIES[policy]
+    tick = TICKS[policy]
+    n = int(round(block_seconds / tick))
+    trace_stride = max(1, int(trace_every // block_seconds))
+    state = None
+    trace, trace_t = [], []
+    elapsed = 0.0
+    for solar, grid in chunks:
+        for i in range(len(solar)):
+            if state is None:
+                scenarios = np.arange(solar.shape[1])
+                state = State(len(scenarios), initial_soc)
+                source_ticks = np.zeros((4, len(scenarios)), dtype=np.int64)
+                shed_ticks = np.zeros(len(scenarios), dtype=np.int64)
+                min_soc = state.soc.copy()
+                start(state, solar[i], grid[i])
+            shed_ticks += block(state, solar[i], grid[i], n)
+            source_ticks[state.source, scenarios] += n
+            np.minimum(min_soc, state.soc, out=min_soc)
+            elapsed += n * tick
+            if int(round(elapsed / block_seconds)) % trace_stride == 0:
+                trace.append(state.soc.copy())
+                trace_t.append(elapsed)
+    return {
+        "t": np.array(trace_t),
+        "soc": np.array(trace),
+        "seconds": {name: source_ticks[code] * tick for code, name in SOURCE_NAMES.items()},
+        "shed_hours": shed_ticks * tick / 3600,
+        "final_soc": state.soc,
+        "min_soc": min_soc,
+    }
+
+
+# --- Scenario generation ---
+
+
+def scenarios(n, days=365, block_seconds=300, seed=0, cloudy=0.3,
+              outages_per_day=0.2, outage_hours=3.0):
+    """Yield one day of (solar, grid) availability blocks at a time.
+
+    Each scenario gets its own latitude-like day-length swing, cloudy-day
+    probability and grid outage rate; outages are a two-state Markov chain.
+    """
+    rng = np.random.default_rng(seed)
+    per_day = int(86400 // block_seconds)
+    hours = (np.arange(per_day) + 0.5) * block_seconds / 3600
+    swing = rng.uniform(0, 4, n)  # +/- hours of day length over the year
+    cloud_p = rng.uniform(0, 2 * cloudy, n)
+    fail_p = rng.uniform(0, 2 * outages_per_day, n) * block_seconds / 86400
+    restore_p = block_seconds / (outage_hours * 3600)
+    grid_up = np.ones(n, dtype=bool)
+    for day in range(days):
+        length = 12 + swing * np.sin(2 * np.pi * (day - 80) / 365)
+        sunny = rng.random(n) >= cloud_p
+        solar = (np.abs(hours[:, None] - 12.5) < length / 2) & sunny
+        grid = np.empty((per_day, n), dtype=bool)
+        draws = rng.random((per_day, n))
+        for i in range(per_day):
+            grid_up = np.where(grid_up, draws[i] >= fail_p, draws[i] < restore_p)
+            grid[i] = grid_up
+        yield solar, grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="ems")
+    parser.add_argument("--scenarios", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--block", type=int, default=300, help="seconds per availability block")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = simulate(scenarios(args.scenarios, args.days, args.block, args.seed),
+                      args.policy, args.block)
+    elapsed = time.perf_counter() - started
+    total = args.days * 86400
+    print(f"{args.policy}: {args.scenarios} scenarios x {args.days} days in {elapsed:.1f} s")
+    for name, seconds in result["seconds"].items():
+        print(f"  {name:8s} {100 * seconds.mean() / total:5.1f}% of the time")
+    shed = result["shed_hours"]
+    print(f"  shed     mean {shed.mean():.1f} h, p95 {np.percentile(shed, 95):.1f} h, "
+          f"max {shed.max():.1f} h")
+    print(f"  min SoC  mean {result['min_soc'].mean():.1f}, "
+          f"{(result['min_soc'] < 25).mean() * 100:.1f}% of scenarios go below 25")
+
+
+if __name__ == "__main__":
+    main()
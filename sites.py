@@ -0,0 +1,461 @@
+"""One controller process for many relay boards ("sites").
+
+    python sites.py sites.json            # sites from a config file
+    python sites.py --simulate 100        # 100 in-memory sites
+
+A config file looks like:
+
+    {"interval": 1.0,
+     "policy": {"shed_below": 30},                 # over DEFAULT_POLICY
+     "dead_time": 0.02,                            # relay release time (see relays.py)
+     "sites": [
+        {"name": "barn", "pins": {"solar": 17, "grid": 18, "battery": 27, "load": 22}},
+        {"name": "shed", "host": "10.0.0.7",       # a remote pigpio daemon
+         "pins": {"solar": 17, "grid": 18, "battery": 27, "load": 22},
+         "policy_file": "shed-policy.json", "interval": 2.0,
+         "dead_time": {"grid": 0.015, "battery": 0.012}},
+        {"name": "test-bench"}]}                   # no pins: in-memory relays
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from flask import Flask, abort, jsonify, request
+
+import assets
+import metrics
+from commands import parse_commands
+from engine import StateStore, SystemClock, make_clock
+from policy import PolicyFile
+from relays import (DEAD_TIME, RELAY_LOCK, SOURCES, RelayBank, claim_relays, load_dead_time,
+                    open_relays)
+
+# --- Sites ---
+# A site is one relay board with its own relay bank, state and policy, ticked
+# with the same rules as ems.py. Sites never sleep or own a thread: the
+# scheduler below calls integrate() and step(), and a /control change is
+# queued on the site and applied by the scheduler thread (the only writer).
+
+RELAY_NAMES = SOURCES + ("load",)
+
+DEFAULT_POLICY = {
+    "priority": ["solar", "grid", "battery"],
+    "shed_below": 25,
+    "restore_above": None,
+    "shed_on": ["solar", "grid", "battery"],
+    "mode": "auto",
+}
+
+TOGGLE_FIELDS = ("solar_available", "grid_available")
+
+
+class MemoryRelay:
+    """In-memory relay for simulated sites."""
+
+    def __init__(self):
+        self.value = False
+
+    def on(self):
+        self.value = True
+
+    def off(self):
+        self.value = False
+
+
+class Site:
+    """Relay bank, state and policy of one board."""
+
+    def __init__(self, name, relays, policies, interval=1.0):
+        self.name = name
+        self.relays = relays
+        self.policies = policies  # anything with current() -> Policy
+        self.interval = interval
+        self.state = {
+            "mode": policies.current().mode,
+            "power_source": "battery",
+            "battery_level": 85,
+            "solar_available": False,
+            "grid_available": True,
+            "non_critical_load": True,
+            "relay_status": relays.status(),
+        }
+        self.state_store = StateStore()
+        self.pending = deque()  # (seq, checked batch) control requests, applied by step()
+        self.ticks = 0
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._applied = 0  # seq of the last batch step() has published
+
+    def integrate(self):
+        """Battery integration, once per interval."""
+        state = self.state
+        if state["power_source"] == "solar" and state["solar_available"]:
+            state["battery_level"] = min(100, state["battery_level"] + 1)
+        elif state["power_source"] == "grid" and state["grid_available"]:
+            state["battery_level"] = min(100, state["battery_level"] + 0.5)
+        else:
+            state["battery_level"] = max(0, state["battery_level"] - 0.3)
+        self.ticks += 1
+
+    def submit(self, commands):
+        """Queue a checked batch for the next step(); returns its sequence number."""
+        with self._cond:
+            self._submitted += 1
+            self.pending.append((self._submitted, commands))
+            return self._submitted
+
+    def wait_applied(self, seq, timeout=None):
+        """Block until batch `seq` is in the published state. False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._applied >= seq, timeout)
+
+    def step(self):
+        """Apply queued control requests, then the policy; publish."""
+        state, relays = self.state, self.relays
+        # Each entry is a checked batch (see commands.py), applied in order
+        applied = None
+        while self.pending:
+            applied, commands = self.pending.popleft()
+            for command in commands:
+                self.apply_command(command)
+
+        decision = self.policies.current().decide(
+            state["solar_available"], state["grid_available"], True,
+            state["battery_level"], relays.is_on("load"), state["mode"])
+        if decision is not None:
+            source, load_on = decision
+            relays.select(source)
+            state["power_source"] = source or "none"
+            relays.set("load", load_on)
+            state["non_critical_load"] = load_on
+        state["relay_status"] = relays.status()
+        self.state_store.publish(state)
+        if applied is not None:
+            with self._cond:
+                self._applied = applied
+                self._cond.notify_all()
+
+    def apply_command(self, data):
+        """One /control request (same fields as ems.py)."""
+        state = self.state
+        if "mode" in data:
+            state["mode"] = data["mode"]
+        if "relay" in data and "state" in data:
+            relay_name = data["relay"]
+            if relay_name in SOURCES:
+                self.relays.set(relay_name, data["state"])
+                if data["state"]:
+                    state["power_source"] = relay_name
+            elif relay_name == "load":
+                self.relays.set("load", data["state"])
+                state["non_critical_load"] = data["state"]
+        for field in TOGGLE_FIELDS:
+            if field in data:
+                state[field] = data[field]
+        if "toggle" in data:
+            state[data["toggle"]] = not state[data["toggle"]]
+
+
+# --- Scheduler ---
+# One thread and a heap of (next deadline, site) entries instead of a sleeping
+# thread per site: each wakeup pops only the sites that are due, so the cost
+# is O(log N) per tick and nothing runs between deadlines. Sites due within
+# `slack` of each other share a wakeup (a thread wakeup costs more than a
+# site tick), and control changes put the site on a ready queue and wake the
+# thread at once.
+
+
+class SiteScheduler:
+    """Ticks many sites from one thread off a timer heap."""
+
+    def __init__(self, clock=None, metrics=None, slack=0.01, name="site-scheduler"):
+        self.clock = clock or SystemClock()
+        self.metrics = metrics  # optional metrics.LoopMetrics
+        self.slack = slack  # seconds a tick may run early to share a wakeup
+        self.name = name
+        self.sites = {}
+        self._heap = []  # (deadline, seq, site); seq breaks ties
+        self._seq = itertools.count()
+        self._ready = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def add(self, site, offset=0.0):
+        """Schedule `site`; its first tick is `offset` seconds from now."""
+        with self._lock:
+            self.sites[site.name] = site
+            heapq.heappush(self._heap, (self.clock.monotonic() + offset, next(self._seq), site))
+        self.notify(site)  # apply the policy once right away
+        return site
+
+    def spread(self, sites):
+        """Add `sites` with their first ticks spread evenly over one interval."""
+        sites = list(sites)
+        for i, site in enumerate(sites):
+            self.add(site, offset=site.interval * i / max(1, len(sites)))
+
+    def remove(self, name):
+        with self._lock:
+            site = self.sites.pop(name)
+            self._heap[:] = [entry for entry in self._heap if entry[2] is not site]
+            heapq.heapify(self._heap)
+
+    def notify(self, site):
+        """Run `site`'s step() as soon as possible (after a control change)."""
+        self._ready.append(site)
+        self._wake.set()
+
+    def submit(self, name, commands):
+        """Queue a checked /control batch for a site and wake the scheduler.
+
+        Returns the batch's sequence number for the site's wait_applied().
+        """
+        site = self.sites[name]
+        seq = site.submit(commands)
+        self.notify(site)
+        return seq
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run_for(self, seconds):
+        """Run in the calling thread for `seconds` of clock time (see ControlLoop)."""
+        self.run(until=self.clock.monotonic() + seconds)
+
+    def run(self, until=None):
+        heap, ready = self._heap, self._ready
+        while self._running if until is None else self.clock.monotonic() < until:
+            self._wake.clear()
+            while ready:
+                site = ready.popleft()
+                if site.name in self.sites:
+                    self._tick(site)
+
+            now = self.clock.monotonic()
+            while heap and heap[0][0] <= now + self.slack:
+                with self._lock:
+                    deadline, _, site = heapq.heappop(heap)
+                    next_deadline = deadline + site.interval
+                    if next_deadline <= now:
+                        next_deadline = now + site.interval  # fell behind; don't burst
+                    heapq.heappush(heap, (next_deadline, next(self._seq), site))
+                self._tick(site, now - deadline)
+
+            deadline = heap[0][0] if heap else now + 1.0
+            if until is not None:
+                deadline = min(deadline, until)
+            if ready:
+                continue
+            self.clock.wait(self._wake, max(0.0, deadline - self.clock.monotonic()))
+
+    def _tick(self, site, lateness=None):
+        """step() the site; a scheduled tick (with lateness) integrates first."""
+        began = time.perf_counter()
+        try:
+            if lateness is not None:
+                site.integrate()
+            site.step()
+        except Exception as e:
+            # One broken board must not stop the others
+            print(f"Site {site.name} error: {e}")
+        if self.metrics is not None and lateness is not None:
+            self.metrics.observe_tick(time.perf_counter() - began, lateness)
+
+
+# --- Controller ---
+
+
+class SiteController:
+    """The sites of a config, their relays and the shared scheduler."""
+
+    def __init__(self, config):
+        self.config = config
+        self.clock = make_clock(config["EMS_TIME_SCALE"])
+        self.registry = metrics.Registry()
+        self.loop_metrics = metrics.LoopMetrics(self.registry, prefix="ems_sites")
+        self.scheduler = SiteScheduler(self.clock, self.loop_metrics)
+        self.started = False
+        self._relay_lock = None
+        self._start_lock = threading.Lock()
+        self._policies = {}
+        self._register_metrics()
+
+    def _register_metrics(self):
+        sites = self.scheduler.sites
+        self.registry.gauge("ems_sites", "Number of sites", callback=lambda: {(): len(sites)})
+        self.registry.gauge("ems_site_battery_level_percent", "Battery state of charge per site",
+                            ("site",), callback=lambda: {
+                                (name,): site.state["battery_level"]
+                                for name, site in list(sites.items())})
+        self.registry.gauge("ems_site_load_on", "1 if the site's load relay is on", ("site",),
+                            callback=lambda: {(name,): int(site.relays.is_on("load"))
+                                              for name, site in list(sites.items())})
+
+    def policies_for(self, spec, path=None):
+        """A PolicyFile per policy file; sites with the same inline spec share one."""
+        if path:
+            return PolicyFile(path, spec)
+        key = json.dumps(spec, sort_keys=True)
+        if key not in self._policies:
+            self._policies[key] = PolicyFile(None, spec)  # compiled once, not per site
+        return self._policies[key]
+
+    def site_configs(self):
+        """The site entries of EMS_SITES (a file or a dict) plus EMS_SIMULATE_SITES."""
+        spec = self.config["EMS_SITES"] or {}
+        if isinstance(spec, str):
+            with open(spec) as f:
+                spec = json.load(f)
+        defaults = {"interval": spec.get("interval", 1.0),
+                    "dead_time": spec.get("dead_time", DEAD_TIME),
+                    "policy": dict(DEFAULT_POLICY, **spec.get("policy", {}))}
+        entries = list(spec.get("sites", []))
+        entries += [{"name": f"sim-{i:04d}"} for i in range(self.config["EMS_SIMULATE_SITES"])]
+        return defaults, entries
+
+    def open_site(self, entry, defaults, factories):
+        pins = entry.get("pins")
+        if pins:
+            options = {"active_high": False}
+            host = entry.get("host")
+            if host:
+                if host not in factories:
+                    from gpiozero.pins.pigpio import PiGPIOFactory
+                    factories[host] = PiGPIOFactory(host=host)
+                options["pin_factory"] = factories[host]
+            devices = open_relays(pins, **options)
+            # Real contacts: break-before-make waits out their release time
+            dead_time = load_dead_time(entry.get("dead_time", defaults["dead_time"]))
+        else:
+            devices = {name: MemoryRelay() for name in RELAY_NAMES}
+            dead_time = 0.0  # nothing to release; never stall the scheduler
+        policy = dict(defaults["policy"], **entry.get("policy", {}))
+        return Site(entry["name"], RelayBank(devices, dead_time=dead_time),
+                    self.policies_for(policy, entry.get("policy_file")),
+                    entry.get("interval", defaults["interval"]))
+
+    def start(self):
+        """Open every site's relays and start the scheduler thread (once)."""
+        with self._start_lock:
+            if self.started:
+                return self
+            defaults, entries = self.site_configs()
+            names = [entry["name"] for entry in entries]
+            if len(set(names)) != len(names):
+                raise ValueError("Site names must be unique")
+            if any(entry.get("pins") and not entry.get("host") for entry in entries):
+                self._relay_lock = claim_relays(self.config["EMS_RELAY_LOCK"])
+            factories = {}
+            self.scheduler.spread(self.open_site(entry, defaults, factories)
+                                  for entry in entries)
+            self.scheduler.start()
+            self.started = True
+        return self
+
+    def use_clock(self, clock):
+        """Switch the scheduler to another clock (relay dead time stays real time)."""
+        self.clock = self.scheduler.clock = clock
+
+    def execute_control(self, name, data):
+        """Apply a command (or batch) to a site; return once its state reflects it.
+
+        Same contract as ems.py: ValueError for a bad payload, TimeoutError if
+        the scheduler hasn't applied it within a second.
+        """
+        commands = parse_commands(data, RELAY_NAMES, TOGGLE_FIELDS)
+        site = self.scheduler.sites[name]
+        seq = self.scheduler.submit(name, commands)
+        if not site.wait_applied(seq, timeout=1.0):
+            raise TimeoutError(f"Control change {seq} is queued but was not applied within 1 s")
+        return {"version": site.state_store.version}
+
+
+DEFAULT_CONFIG = {
+    "EMS_SITES": None,  # config file path, or the parsed dict
+    "EMS_SIMULATE_SITES": 0,  # extra in-memory sites
+    "EMS_TIME_SCALE": None,
+    "EMS_RELAY_LOCK": RELAY_LOCK,
+    "EMS_LAZY_START": True,
+}
+ENV_KEYS = ("EMS_SITES", "EMS_TIME_SCALE", "EMS_RELAY_LOCK")
+
+
+def create_app(config=None):
+    """Flask app over a SiteController (app.extensions["ems"]), started lazily."""
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update({key: os.environ[key] for key in ENV_KEYS if key in os.environ})
+    app.config.update(config or {})
+    controller = app.extensions["ems"] = SiteController(app.config)
+    metrics.init_app(app, controller.registry)
+
+    if app.config["EMS_LAZY_START"]:
+        @app.before_request
+        def start_sites():
+            if not controller.started:
+                controller.start()
+
+    def site_or_404(name):
+        site = controller.scheduler.sites.get(name)
+        if site is None:
+            abort(404)
+        return site
+
+    @app.route('/sites')
+    def list_sites():
+        return jsonify({name: {"power_source": site.state["power_source"],
+                               "battery_level": site.state["battery_level"],
+                               "load_on": site.relays.is_on("load")}
+                        for name, site in list(controller.scheduler.sites.items())})
+
+    @app.route('/sites/<name>/status')
+    def site_status(name):
+        return assets.status_response(site_or_404(name).state_store)
+
+    @app.route('/sites/<name>/control', methods=['POST'])
+    def site_control(name):
+        site_or_404(name)
+        # One command or a batch, checked the same way as ems.py and app2.py,
+        # answered with the site's state version that includes it
+        try:
+            result = controller.execute_control(name, request.json)
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+        except TimeoutError as e:  # queued, but the scheduler didn't get to it
+            return jsonify(success=False, error=str(e)), 504
+        return jsonify(success=True, **result)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EMS multi-site controller")
+    parser.add_argument("config", nargs="?", default=os.environ.get("EMS_SITES"),
+                        help="JSON file listing the sites")
+    parser.add_argument("--simulate", type=int, default=0, help="add N in-memory sites")
+    parser.add_argument("--time-scale", default=os.environ.get("EMS_TIME_SCALE"),
+                        help="speed-up factor, or 'virtual' to tick as fast as possible")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    app = create_app({"EMS_SITES": args.config, "EMS_SIMULATE_SITES": args.simulate,
+                      "EMS_TIME_SCALE": args.time_scale})
+    controller = app.extensions["ems"].start()
+    print(f"Controlling {len(controller.scheduler.sites)} sites")
+    app.run(host='0.0.0.0', port=args.port, debug=False)
@@ -0,0 +1,117 @@
+from bisect import bisect_right
+
+# --- State-of-charge estimation ---
+# Coulomb counting (integrating the battery current) is precise over minutes
+# but drifts with the current sensor's offset and never corrects a wrong
+# starting SoC. The terminal voltage, through the open-circuit voltage curve
+# after correcting the I*R sag, is absolute but noisy, and biased under load
+# as soon as the assumed resistance is off. An extended Kalman filter over
+# (SoC, resistance) fuses the two: every sample predicts with the coulomb
+# count and corrects with the voltage, weighted by their uncertainties. Each
+# update is a few dozen float operations on a 2x2 covariance: constant time
+# and memory per sample, however long the pack has been running.
+
+# Resting voltage -> SoC (%) of a 12 V lead-acid battery
+OCV_12V = [(11.51, 0.0), (11.66, 10.0), (11.81, 20.0), (11.96, 30.0), (12.10, 40.0),
+           (12.24, 50.0), (12.37, 60.0), (12.50, 70.0), (12.62, 80.0), (12.73, 90.0),
+           (12.84, 100.0)]
+
+
+def soc_from_voltage(voltage, current=0.0, internal_ohms=0.0, table=OCV_12V):
+    """SoC (%) from the terminal voltage, corrected for the sag at `current` (A, + = discharge)."""
+    ocv = voltage + current * internal_ohms
+    if ocv <= table[0][0]:
+        return table[0][1]
+    for (v0, s0), (v1, s1) in zip(table, table[1:]):
+        if ocv <= v1:
+            return s0 + (s1 - s0) * (ocv - v0) / (v1 - v0)
+    return table[-1][1]
+
+
+class SocEstimator:
+    """Coulomb counting corrected by terminal voltage (extended Kalman filter).
+
+    The state is SoC (%) and the internal resistance (ohms), which sets how
+    far the terminal voltage sags under load and drifts with temperature and
+    age; the filter learns it from how the voltage follows the current.
+    `process_noise` (%^2 per second) is how fast trust in the coulomb count
+    decays; `voltage_noise` (V per sqrt(Hz)) is a noise density, so the voltage
+    carries the same weight per second whatever the sampling rate.
+    """
+
+    def __init__(self, capacity_ah=100.0, soc=None, internal_ohms=0.02, table=OCV_12V,
+                 charge_efficiency=0.98, process_noise=1e-4, voltage_noise=0.05,
+                 initial_sigma=20.0, resistance_sigma=0.01, resistance_drift=1e-10):
+        self.capacity_ah = capacity_ah
+        self.charge_efficiency = charge_efficiency
+        self.process_noise = process_noise
+        self.resistance_drift = resistance_drift  # ohms^2 per second
+        self.voltage_density = voltage_noise * voltage_noise
+        self.soc = soc  # None: taken from the first voltage sample
+        self.internal_ohms = internal_ohms
+        # Covariance of (soc, internal_ohms), symmetric: p00, p01, p11
+        self.p00 = initial_sigma * initial_sigma
+        self.p01 = 0.0
+        self.p11 = resistance_sigma * resistance_sigma
+        self.updates = 0
+        self._last = None  # time of the previous sample
+        # The OCV curve as SoC breakpoints with per-segment slopes (V per %)
+        points = sorted((s, v) for v, s in table)
+        self._socs = [s for s, _ in points]
+        self._volts = [v for _, v in points]
+        self._slopes = [(v1 - v0) / (s1 - s0) for (s0, v0), (s1, v1) in zip(points, points[1:])]
+
+    @property
+    def sigma(self):
+        """Standard deviation of the SoC estimate (%)."""
+        return self.p00 ** 0.5
+
+    def ocv(self, soc):
+        """(open-circuit voltage, dV/dSoC) at `soc`."""
+        i = min(max(bisect_right(self._socs, soc) - 1, 0), len(self._slopes) - 1)
+        slope = self._slopes[i]
+        return self._volts[i] + slope * (soc - self._socs[i]), slope
+
+    def update(self, timestamp, voltage, current):
+        """One sample: seconds, volts (None: count only) and amps (+ = discharge).
+
+        Returns the SoC estimate in percent.
+        """
+        if self.soc is None:
+            if voltage is None:
+                return None
+            self.soc = soc_from_voltage(voltage, current, self.internal_ohms,
+                                        list(zip(self._volts, self._socs)))
+        last, self._last = self._last, timestamp
+        if last is None:
+            return self.soc
+        dt = timestamp - last
+        if dt <= 0:
+            return self.soc
+        self.updates += 1
+
+        # Predict: coulomb counting (charging stores a little less than it draws)
+        amps = current if current > 0 else current * self.charge_efficiency
+        soc = self.soc - amps * dt / (36.0 * self.capacity_ah)
+        p00 = self.p00 + self.process_noise * dt
+        p01 = self.p01
+        p11 = self.p11 + self.resistance_drift * dt
+
+        # Correct: expected terminal voltage, OCV(soc) - I * R, vs the measured one
+        if voltage is not None:
+            ocv, slope = self.ocv(soc)
+            innovation = voltage - (ocv - current * self.internal_ohms)
+            h0, h1 = slope, -current  # d(voltage)/d(soc), d(voltage)/d(R)
+            ph0 = p00 * h0 + p01 * h1
+            ph1 = p01 * h0 + p11 * h1
+            s = h0 * ph0 + h1 * ph1 + self.voltage_density / dt
+            k0, k1 = ph0 / s, ph1 / s
+            soc += k0 * innovation
+            self.internal_ohms = max(0.0, self.internal_ohms + k1 * innovation)
+            p00 -= k0 * ph0
+            p01 -= k0 * ph1
+            p11 -= k1 * ph1
+
+        self.soc = min(100.0, max(0.0, soc))
+        self.p00, self.p01, self.p11 = p00, p01, p11
+        return self.soc
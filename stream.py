@@ -0,0 +1,46 @@
+# --- Server-Sent Events ---
+# Each event carries the full state and uses the state version as its id, so a
+# reconnecting EventSource (which sends Last-Event-ID) only gets an event if
+# something changed while it was away.
+
+KEEPALIVE_SECONDS = 15
+RETRY_MS = 2000
+
+
+def parse_last_event_id(value):
+    """Return the version a client last saw, or None for a fresh connection."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+RETRY_FRAME = f"retry: {RETRY_MS}\n\n".encode()
+# Comment line keeps proxies and the browser from timing out
+KEEPALIVE_FRAME = b": keepalive\n\n"
+
+
+def format_event(version, body):
+    """SSE frame for one state version; `body` is the pre-encoded JSON."""
+    return b"id: %d\nevent: state\ndata: %s\n\n" % (version, body)
+
+
+def event_stream(store, last_id=None, keepalive=KEEPALIVE_SECONDS):
+    """Yield SSE frames for every new state version published to `store`."""
+    seen = last_id if last_id is not None else -1
+    yield RETRY_FRAME
+    while True:
+        version, snapshot = store.wait(seen, timeout=keepalive)
+        if version == seen or snapshot is None:
+            seen = version
+            yield KEEPALIVE_FRAME
+            continue
+        # Same pre-encoded bytes /status serves; encoded once per version
+        seen, body = store.encoded()
+        yield format_event(seen, body)
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
@@ -0,0 +1,206 @@
+import math
+import threading
+from array import array
+
+_numpy = False  # not imported yet
+
+# --- Telemetry ring buffer ---
+# Fixed-memory history of the control loop: one sample per tick stored in
+# compact typed columns (14 bytes per sample), so a week of 1 s ticks is about
+# 8.5 MB and never grows. /history reads a time range and downsamples it
+# (LTTB or min/max on SoC) so a dashboard can chart a week in a few KB.
+
+SOURCE_CODES = {"none": 0, "solar": 1, "grid": 2, "battery": 3}
+SOURCE_NAMES = {code: name for name, code in SOURCE_CODES.items()}
+RELAY_BITS = {"solar": 1, "grid": 2, "battery": 4, "load": 8}
+
+WEEK_OF_SECONDS = 7 * 24 * 3600
+
+
+def relay_mask(relay_status):
+    mask = 0
+    for name, bit in RELAY_BITS.items():
+        if relay_status.get(name):
+            mask |= bit
+    return mask
+
+
+class TelemetryRing:
+    """Timestamp, SoC, source code and relay bitmask columns in a ring."""
+
+    def __init__(self, capacity=WEEK_OF_SECONDS):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.soc = array("f", bytes(4 * capacity))
+        self.source = array("B", bytes(capacity))
+        self.relays = array("B", bytes(capacity))
+        self.count = 0
+        self._head = 0  # next slot to write
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, soc, source, relays):
+        """Store one tick; `relays` is relay_mask() of the relay status."""
+        with self._lock:
+            i = self._head
+            self.timestamps[i] = timestamp
+            self.soc[i] = soc
+            self.source[i] = SOURCE_CODES.get(source, 0)
+            self.relays[i] = relays
+            self._head = i + 1 if i + 1 < self.capacity else 0
+            if self.count < self.capacity:
+                self.count += 1
+
+    def _slot(self, n):
+        """Physical index of the n-th oldest sample."""
+        return (self._head - self.count + n) % self.capacity
+
+    def _bisect(self, timestamp):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[self._slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        """Copy the samples with start <= timestamp <= end, oldest first.
+
+        Returns (timestamps, soc, source, relays) as arrays.
+        """
+        with self._lock:
+            first = self._bisect(start)
+            last = self._bisect(end)
+            while last < self.count and self.timestamps[self._slot(last)] == end:
+                last += 1
+            columns = []
+            for column in (self.timestamps, self.soc, self.source, self.relays):
+                a, b = self._slot(first), self._slot(last)
+                if last - first == 0:
+                    columns.append(column[0:0])
+                elif a < b:
+                    columns.append(column[a:b])
+                else:  # wraps around the end of the ring
+                    columns.append(column[a:] + column[:b])
+            return tuple(columns)
+
+
+# --- Downsampling ---
+
+
+def numpy():
+    """numpy, or None if it isn't installed.
+
+    Imported on the first /history request rather than at startup, where it
+    would be the slowest import of the app.
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as np
+        except ImportError:
+            # Downsampling falls back to pure Python (slower on long ranges)
+            np = None
+        _numpy = np
+    return _numpy
+
+
+def lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets: indices of `points` samples that keep the shape."""
+    n = len(x)
+    if points >= n or points < 3:
+        return list(range(n))
+    np = numpy()
+    if np is not None:
+        x = np.frombuffer(x, dtype=np.float64) if isinstance(x, array) else np.asarray(x)
+        y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (points - 2)
+    selected = [0]
+    a = 0
+    for i in range(points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        if np is not None:
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+            area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                          - (x[a] - x[start:end]) * (avg_y - y[a]))
+            a = start + int(area.argmax())
+        else:
+            span = next_end - next_start
+            avg_x = sum(x[next_start:next_end]) / span
+            avg_y = sum(y[next_start:next_end]) / span
+            xa, ya = x[a], y[a]
+            best, best_area = start, -1.0
+            for j in range(start, end):
+                area = abs((xa - avg_x) * (y[j] - ya) - (xa - x[j]) * (avg_y - ya))
+                if area > best_area:
+                    best, best_area = j, area
+            a = best
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+def minmax(y, points):
+    """Min and max of each bucket (points // 2 buckets), in time order."""
+    n = len(y)
+    buckets = max(1, points // 2)
+    if n <= points:
+        return list(range(n))
+    np = numpy()
+    selected = []
+    for i in range(buckets):
+        start = i * n // buckets
+        end = (i + 1) * n // buckets
+        if np is not None:
+            chunk = np.asarray(y[start:end])
+            lo, hi = start + int(chunk.argmin()), start + int(chunk.argmax())
+        else:
+            chunk = y[start:end]
+            lo = start + min(range(len(chunk)), key=chunk.__getitem__)
+            hi = start + max(range(len(chunk)), key=chunk.__getitem__)
+        selected.extend(sorted({lo, hi}))
+    return selected
+
+
+def history(ring, start, end, points=500, method="lttb"):
+    """Downsampled history as compact JSON-ready columns."""
+    timestamps, soc, source, relays = ring.range(start, end)
+    if method == "minmax":
+        selected = minmax(soc, points)
+    else:
+        selected = lttb(timestamps, soc, points)
+    return {
+        "from": start,
+        "to": end,
+        "samples": len(timestamps),
+        "t": [timestamps[i] for i in selected],
+        "soc": [round(soc[i], 2) for i in selected],
+        "source": [SOURCE_NAMES[source[i]] for i in selected],
+        "relays": [relays[i] for i in selected],
+        "relay_bits": RELAY_BITS,
+    }
+
+
+def parse_query(args, now):
+    """(start, end, points, method) from ?from=&to=&points=&method=.
+
+    `args` is any mapping with get(); times are Unix seconds and default to
+    the last 24 h; points must be 3 to 5000 (fewer would send the raw range).
+    Raises ValueError for malformed values.
+    """
+    end = float(args.get("to", now))
+    start = float(args.get("from", end - 86400))
+    if not (math.isfinite(start) and math.isfinite(end)):
+        raise ValueError("from and to must be finite Unix times")
+    points = int(args.get("points", 500))
+    if not 3 <= points <= 5000:
+        raise ValueError("points must be between 3 and 5000")
+    method = args.get("method", "lttb")
+    if method not in ("lttb", "minmax"):
+        raise ValueError(f"Unknown method {method!r}")
+    return start, end, points, method
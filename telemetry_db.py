@@ -0,0 +1,151 @@
+import json
+import sqlite3
+import threading
+import time
+
+from engine import SystemClock
+from telemetry import SOURCE_CODES
+
+# --- Durable telemetry log ---
+# Tick samples and control events survive a restart in a WAL-mode SQLite file.
+# Writes are batched in memory and committed every `batch_size` samples or
+# `flush_interval` seconds, whichever comes first, so the SD card sees one
+# sequential WAL append per batch instead of a page rewrite per tick. Reads go
+# through SQLite's memory-mapped I/O. Raw samples older than `retain_seconds`
+# are rolled into hourly aggregates. Events and retention go by `clock`, the
+# clock the samples are stamped with, so both line up in /history under a
+# ScaledClock or VirtualClock too.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    t REAL PRIMARY KEY,
+    soc REAL NOT NULL,
+    source INTEGER NOT NULL,
+    relays INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    t REAL NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_t ON events (t);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour INTEGER PRIMARY KEY,
+    samples INTEGER NOT NULL,
+    soc_min REAL,
+    soc_max REAL,
+    soc_avg REAL,
+    solar_samples INTEGER,
+    grid_samples INTEGER,
+    battery_samples INTEGER
+);
+"""
+
+
+class TelemetryLog:
+    """Batched, append-only sample and event log in SQLite (WAL mode)."""
+
+    def __init__(self, path, batch_size=60, flush_interval=30.0,
+                 retain_seconds=7 * 24 * 3600, mmap_bytes=64 * 1024 * 1024, clock=None):
+        self.path = path
+        self.clock = clock or SystemClock()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retain_seconds = retain_seconds
+        self.flushes = 0
+        self._samples = []
+        self._events = []
+        self._last_flush = time.monotonic()
+        self._last_compact = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # A power cut may lose the last batch but never corrupts the file
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        self._db.executescript(SCHEMA)
+
+    def record_sample(self, timestamp, soc, source, relays):
+        """Queue one tick; `relays` is telemetry.relay_mask() of the relay status."""
+        with self._lock:
+            self._samples.append((timestamp, soc, SOURCE_CODES.get(source, 0), relays))
+            if (len(self._samples) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def record_event(self, kind, data=None, timestamp=None):
+        with self._lock:
+            self._events.append((timestamp if timestamp is not None else self.clock.time(),
+                                 kind, json.dumps(data)))
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._samples and not self._events:
+            return
+        with self._db:  # one transaction per batch
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)",
+                                 self._samples)
+            self._db.executemany("INSERT INTO events VALUES (?, ?, ?)", self._events)
+        self._samples = []
+        self._events = []
+        self.flushes += 1
+        if self._last_flush - self._last_compact >= 3600:
+            self._compact(self.clock.time())
+
+    def samples(self, start, end):
+        """[(t, soc, source_code, relay_mask), ...] for start <= t <= end."""
+        self.flush()
+        return self._db.execute("SELECT t, soc, source, relays FROM samples "
+                                "WHERE t BETWEEN ? AND ? ORDER BY t", (start, end)).fetchall()
+
+    def events(self, start, end):
+        """[(t, kind, data), ...] for start <= t <= end."""
+        self.flush()
+        rows = self._db.execute("SELECT t, kind, data FROM events "
+                                "WHERE t BETWEEN ? AND ? ORDER BY t", (start, end)).fetchall()
+        return [(t, kind, json.loads(data)) for t, kind, data in rows]
+
+    def hourly(self, start, end):
+        return self._db.execute("SELECT * FROM hourly WHERE hour BETWEEN ? AND ? ORDER BY hour",
+                                (int(start // 3600), int(end // 3600))).fetchall()
+
+    def compact(self, now=None):
+        with self._lock:
+            self._flush()
+            self._compact(now if now is not None else self.clock.time())
+
+    def _compact(self, now):
+        """Roll complete hours older than the retention window into `hourly`."""
+        self._last_compact = time.monotonic()
+        cutoff = (now - self.retain_seconds) // 3600 * 3600
+        solar, grid, battery = (SOURCE_CODES[s] for s in ("solar", "grid", "battery"))
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(f"""
+                INSERT INTO hourly
+                SELECT CAST(t / 3600 AS INTEGER) AS h, COUNT(*), MIN(soc), MAX(soc), AVG(soc),
+                       SUM(source = {solar}), SUM(source = {grid}), SUM(source = {battery})
+                FROM samples WHERE t < ? GROUP BY h
+                ON CONFLICT (hour) DO UPDATE SET
+                    soc_avg = (soc_avg * samples + excluded.soc_avg * excluded.samples)
+                              / (samples + excluded.samples),
+                    samples = samples + excluded.samples,
+                    soc_min = MIN(soc_min, excluded.soc_min),
+                    soc_max = MAX(soc_max, excluded.soc_max),
+                    solar_samples = solar_samples + excluded.solar_samples,
+                    grid_samples = grid_samples + excluded.grid_samples,
+                    battery_samples = battery_samples + excluded.battery_samples
+            """, (cutoff,))
+            self._db.execute("DELETE FROM samples WHERE t < ?", (cutoff,))
+            self._db.execute("DELETE FROM events WHERE t < ?", (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.close()
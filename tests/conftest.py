@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Mock GPIO, no relay lock file and an in-memory telemetry log; the modules
+# live in the repository root
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+os.environ.setdefault("EMS_RELAY_LOCK", "")
+os.environ.setdefault("EMS_TELEMETRY_DB", ":memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TimedRelay:
+    """Relay stand-in that records (name, value, perf_counter time) for each write."""
+
+    def __init__(self, name, log, device=None):
+        self.name = name
+        self.log = log
+        self.device = device
+        self.value = bool(device.value) if device is not None else False
+
+    def on(self):
+        self._write(True)
+
+    def off(self):
+        self._write(False)
+
+    def _write(self, value):
+        if self.device is not None:
+            self.device.on() if value else self.device.off()
+        self.value = value
+        self.log.append((self.name, value, time.perf_counter()))
+
+
+@pytest.fixture
+def timed_relays():
+    """Wraps a RelayBank's devices in TimedRelays; returns the shared write log."""
+    def wrap(bank):
+        log = []
+        bank.relays = {name: TimedRelay(name, log, device) for name, device in bank.relays.items()}
+        return log
+    return wrap
+
+
+@pytest.fixture(autouse=True)
+def mock_pins():
+    """Release every mock pin after a test, so the next app can claim them."""
+    yield
+    from gpiozero import Device
+    if Device.pin_factory is not None:
+        Device.pin_factory.reset()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: wall-time budget; runs with EMS_BENCHMARKS=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip wall-time benchmarks unless EMS_BENCHMARKS is set (they depend on the machine)."""
+    if os.environ.get("EMS_BENCHMARKS"):
+        return
+    skip = pytest.mark.skip(reason="benchmark; set EMS_BENCHMARKS=1 to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
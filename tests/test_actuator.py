@@ -0,0 +1,107 @@
+import threading
+
+from actuator import AUTO, SAFETY, Actuator
+from conftest import TimedRelay
+from relays import RelayBank
+
+NAMES = ("solar", "grid", "battery", "load", "pump")
+
+
+class GatedRelay(TimedRelay):
+    """Blocks in on() until the gate opens, holding the actuator busy."""
+
+    def __init__(self, name, log, gate, busy):
+        super().__init__(name, log)
+        self.gate = gate
+        self.busy = busy
+
+    def on(self):
+        self.busy.set()
+        self.gate.wait(5)
+        super().on()
+
+
+def make_actuator():
+    log, gate, busy = [], threading.Event(), threading.Event()
+    devices = {name: TimedRelay(name, log) for name in NAMES}
+    devices["pump"] = GatedRelay("pump", log, gate, busy)
+    actuator = Actuator(RelayBank(devices))
+    actuator.start()
+    return actuator, log, gate, busy
+
+
+def test_urgent_transfer_jumps_a_queued_routine_command():
+    actuator, log, gate, busy = make_actuator()
+    actuator.submit({"pump": True})
+    assert busy.wait(5)  # the actuator is stuck in the pump's on()
+    routine = actuator.submit({"load": True}, AUTO)
+    urgent = actuator.submit({"grid": False, "battery": True}, SAFETY)
+    gate.set()
+    assert actuator.wait(routine, 5) and actuator.wait(urgent, 5)
+    actuator.stop()
+    order = [(name, value) for name, value, _ in log]
+    assert order == [("pump", True), ("battery", True), ("load", True)]  # grid was already off
+
+
+def test_urgent_transfer_is_one_break_before_make_transaction():
+    actuator, log, gate, busy = make_actuator()
+    actuator.submit({"grid": True})
+    actuator.submit({"pump": True})
+    assert busy.wait(5)
+    routine = actuator.submit({"load": True}, AUTO)
+    urgent = actuator.submit({"grid": False, "battery": True}, SAFETY)
+    gate.set()
+    assert actuator.wait(urgent, 5) and actuator.wait(routine, 5)
+    actuator.stop()
+    order = [(name, value) for name, value, _ in log]
+    assert order[-3:] == [("grid", False), ("battery", True), ("load", True)]
+
+
+def test_superseded_command_is_coalesced():
+    actuator, log, gate, busy = make_actuator()
+    actuator.submit({"pump": True})
+    assert busy.wait(5)
+    old = actuator.submit({"grid": True, "battery": False}, SAFETY)
+    new = actuator.submit({"grid": False, "battery": True}, AUTO)
+    assert actuator.depth == 1
+    gate.set()
+    assert actuator.wait(old, 5)  # answered by the command that superseded it
+    assert actuator.wait(new, 5)
+    actuator.stop()
+    assert actuator.coalesced == 1
+    assert [(name, value) for name, value, _ in log][1:] == [("battery", True)]
+
+
+def test_submit_before_start_applies_inline():
+    log = []
+    actuator = Actuator(RelayBank({name: TimedRelay(name, log) for name in NAMES}))
+    ticket = actuator.submit({"grid": True})
+    assert actuator.wait(ticket, 0)
+    assert actuator.relays.is_on("grid")
+
+
+def test_control_wait_returns_fresh_relay_status():
+    import app2
+    app = app2.create_app({"EMS_RELAY_LOCK": "", "EMS_CONDITIONING": None})
+    system = app.extensions["ems"]
+    client = app.test_client()
+    client.post("/control?wait=1", json={"solar_available": False})
+    for grid in (False, True) * 10:
+        reply = client.post("/control?wait=1", json={"grid_available": grid}).get_json()
+        version, state = system.state_store.get()
+        assert version >= reply["version"]
+        expected = "grid" if grid else "battery"
+        assert state["power_source"] == expected
+        assert state["relay_status"][expected] and state["relay_status"] == system.relays.status()
+    system.actuator.stop()
+    system.control_loop.stop()
+
+
+def test_control_wait_times_out_when_the_loop_is_stalled():
+    import app2
+    app = app2.create_app({"EMS_RELAY_LOCK": "", "EMS_LAZY_START": False})
+    app.extensions["ems"].open()  # the loop never runs
+    client = app.test_client()
+    assert client.post("/control", json={"grid_available": False}).status_code == 200  # queued
+    reply = client.post("/control?wait=1", json={"grid_available": True})
+    assert reply.status_code == 504 and not reply.get_json()["success"]
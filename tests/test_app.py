@@ -0,0 +1,37 @@
+import pytest
+
+import app
+
+
+def failing_gpio(pins, **options):
+    raise OSError("no GPIO here")
+
+
+def test_start_refuses_relays_held_by_another_process(tmp_path):
+    lock = str(tmp_path / "relays.lock")
+    first = app.create_app({"EMS_RELAY_LOCK": lock}).extensions["ems"].start()
+    second = app.create_app({"EMS_RELAY_LOCK": lock, "EMS_DUMMY_RELAYS": True}).extensions["ems"]
+    with pytest.raises(RuntimeError, match="in use"):
+        second.start()
+    assert not second.started and first.started
+
+
+def test_start_without_gpio_falls_back_to_dummy_relays(monkeypatch):
+    monkeypatch.setattr(app, "open_relays", failing_gpio)
+    system = app.create_app({"EMS_RELAY_LOCK": ""}).extensions["ems"]
+    assert system.start().started
+    assert isinstance(system.relays.relays["grid"], app.DummyDevice)
+
+
+def test_start_without_gpio_refuses_with_dummy_relays_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "open_relays", failing_gpio)
+    lock = str(tmp_path / "relays.lock")
+    system = app.create_app({"EMS_RELAY_LOCK": lock, "EMS_DUMMY_RELAYS": "0"}).extensions["ems"]
+    with pytest.raises(RuntimeError, match="EMS_DUMMY_RELAYS"):
+        system.start()
+    assert not system.started
+
+    # The failed start released the lock, so a simulated run can take it
+    system = app.create_app({"EMS_RELAY_LOCK": lock}).extensions["ems"]
+    assert system.start().started
+    assert isinstance(system.relays.relays["grid"], app.DummyDevice)
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import asgi
+import ems
+
+
+async def post_control(app, payload):
+    """(status, JSON body) of POST /control through the ASGI app."""
+    body = json.dumps(payload).encode()
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/control", "headers": [],
+             "query_string": b""}
+    await app(scope, receive, send)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def test_control_answers_like_the_flask_route():
+    flask_app = ems.create_app()
+    system = flask_app.extensions["ems"]
+    client = flask_app.test_client()
+
+    async def run():
+        app = asgi.EMSApp(flask_app)
+        try:
+            status, body = await post_control(app, {"mode": "manual", "relay": "grid",
+                                                    "state": True})
+            assert status == 200 and body["success"]
+            # Answered once applied: the version already has the relay on
+            assert body["version"] == system.state_store.version
+            assert system.state_store.snapshot["relay_status"]["grid"]
+            flask_body = client.post("/control", json={"relay": "grid", "state": False}).get_json()
+            assert set(flask_body) == set(body)
+
+            status, body = await post_control(app, {"relay": "pump", "state": True})
+            flask_status = client.post("/control", json={"relay": "pump", "state": True})
+            assert (status, set(body)) == (flask_status.status_code, set(flask_status.get_json()))
+        finally:
+            system.control_loop.stop()
+
+    asyncio.run(run())
+
+
+def test_control_times_out_instead_of_answering_a_stale_version():
+    flask_app = ems.create_app({"EMS_LAZY_START": False})
+    system = flask_app.extensions["ems"]
+    system.open()  # relays claimed, but the loop never runs
+    version = system.state_store.version
+    reply = flask_app.test_client().post("/control", json={"grid_available": False})
+    assert reply.status_code == 504 and not reply.get_json()["success"]
+    assert system.state_store.version == version
+
+    async def run():
+        app = asgi.EMSApp(flask_app)
+        await post_control(app, {"mode": "auto"})  # starts the system
+        system.control_loop.stop()  # ...and stalls it
+        status, body = await post_control(app, {"grid_available": True})
+        assert status == 504 and not body["success"]
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from conftest import TimedRelay
+from engine import ControlLoop
+from relays import RelayBank
+
+
+def make_loop(fail=None):
+    """A loop whose step applies `wanted` to a bank of TimedRelays."""
+    log, wanted = [], {}
+    bank = RelayBank({name: TimedRelay(name, log) for name in ("grid", "battery", "load")})
+
+    def step():
+        if fail and fail[0]:
+            fail[0] -= 1
+            raise OSError("GPIO write failed")
+        bank.apply(wanted)
+
+    # A long interval: only notify() wakes the loop
+    loop = ControlLoop(lambda: None, step, interval=60.0)
+    return loop, bank, log, wanted
+
+
+def test_control_to_relay_latency():
+    loop, bank, log, wanted = make_loop()
+    loop.start()
+    try:
+        time.sleep(0.05)  # the startup step has run
+        for n in range(20):
+            log.clear()
+            wanted["load"] = n % 2 == 0
+            sent = time.perf_counter()
+            assert loop.wait_applied(loop.notify(), timeout=1.0)
+            (name, value, written), = log
+            assert (name, value) == ("load", n % 2 == 0)
+            assert written - sent < 0.05  # woken at once, not at the next 60 s tick
+            assert loop.last_latency < 0.05
+    finally:
+        loop.stop()
+
+
+def test_failed_step_is_reported_to_waiters():
+    fail = [0]
+    loop, bank, log, wanted = make_loop(fail)
+    loop.start()
+    try:
+        time.sleep(0.05)
+        fail[0] = 1
+        wanted["grid"] = True
+        with pytest.raises(RuntimeError, match="GPIO write failed"):
+            loop.wait_applied(loop.notify(), timeout=1.0)
+        assert not bank.is_on("grid")
+        # The next step applies it, and later waiters see success
+        seq = loop.notify()
+        assert loop.wait_applied(seq, timeout=1.0)
+        assert bank.is_on("grid")
+    finally:
+        loop.stop()
+
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from conftest import TimedRelay
+from relays import DEAD_TIME, RelayBank, load_dead_time
+
+
+def make_bank(dead_time):
+    log = []
+    bank = RelayBank({name: TimedRelay(name, log) for name in ("solar", "grid", "battery")},
+                     dead_time=dead_time)
+    return bank, log
+
+
+def test_break_before_make_waits_the_dead_time():
+    bank, log = make_bank(0.02)
+    bank.select("grid")
+    log.clear()
+    bank.select("battery")
+    (broken, off, t_off), (made, on, t_on) = log
+    assert (broken, off, made, on) == ("grid", False, "battery", True)
+    assert t_on - t_off >= 0.02
+    assert bank.last_gap >= 0.02
+
+
+def test_dead_time_spans_transactions():
+    bank, log = make_bank({"grid": 0.03})
+    bank.set("grid", True)
+    log.clear()
+    bank.set("grid", False)
+    bank.set("battery", True)  # a separate request, right after the break
+    assert log[1][2] - log[0][2] >= 0.03
+    assert bank.dead_time["battery"] == DEAD_TIME  # relays left out get the default
+
+
+def test_load_dead_time():
+    assert load_dead_time("0.01") == 0.01
+    assert load_dead_time('{"grid": 0.015}') == {"grid": 0.015}
+    with pytest.raises(ValueError):
+        load_dead_time(-1)
+    with pytest.raises(ValueError):
+        make_bank({"pump": 0.01})
+
+
+def test_dead_time_is_real_time_under_a_scaled_clock(timed_relays):
+    import ems
+    app = ems.create_app({"EMS_RELAY_LOCK": "", "EMS_TIME_SCALE": 1000, "EMS_DEAD_TIME": 0.05})
+    system = app.extensions["ems"]
+    system.open()
+    log = timed_relays(system.relays)
+    system.relays.select("grid")
+    log.clear()
+    started = time.perf_counter()
+    system.relays.select("battery")
+    names = [(name, value) for name, value, _ in log]
+    assert names == [("grid", False), ("battery", True)]
+    assert log[1][2] - log[0][2] >= 0.05
+    assert time.perf_counter() - started >= 0.05
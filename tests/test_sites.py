@@ -0,0 +1,32 @@
+import sites
+
+
+def test_site_control_validates_like_the_other_apps():
+    app = sites.create_app({"EMS_SIMULATE_SITES": 1})
+    controller = app.extensions["ems"]
+    client = app.test_client()
+    try:
+        for bad in ({"mode": "turbo"}, {"relay": "grid", "state": "on"}, {"relay": "grid"},
+                    [{"mode": "manual"}, {"relay": "pump", "state": True}], {"colour": 1}):
+            reply = client.post("/sites/sim-0000/control", json=bad)
+            assert reply.status_code == 400, bad
+        reply = client.post("/sites/sim-0000/control",
+                            json={"commands": [{"mode": "manual"}, {"relay": "load", "state": True},
+                                               {"toggle": "grid_available"}]})
+        assert reply.status_code == 200
+        # Answered once applied, with the version that includes the batch
+        store = controller.scheduler.sites["sim-0000"].state_store
+        version, state = store.get()
+        body = reply.get_json()
+        assert body["success"] and 0 < body["version"] <= version  # a tick may have followed
+        assert state["mode"] == "manual" and state["relay_status"]["load"]
+    finally:
+        controller.scheduler.stop()
+
+
+def test_site_control_times_out_when_the_scheduler_is_stalled():
+    app = sites.create_app({"EMS_SIMULATE_SITES": 1})
+    controller = app.extensions["ems"].start()
+    controller.scheduler.stop()
+    reply = app.test_client().post("/sites/sim-0000/control", json={"mode": "manual"})
+    assert reply.status_code == 504 and not reply.get_json()["success"]
@@ -0,0 +1,28 @@
+import pytest
+
+from telemetry import parse_query
+
+NOW = 1_700_000_000.0
+
+
+def test_parse_query_defaults_to_the_last_day():
+    assert parse_query({}, NOW) == (NOW - 86400, NOW, 500, "lttb")
+
+
+@pytest.mark.parametrize("args", [
+    {"points": "0"}, {"points": "-1"}, {"points": "2"}, {"points": "5001"},
+    {"from": "nan"}, {"to": "inf"}, {"from": "-inf"}, {"method": "mean"},
+])
+def test_parse_query_rejects_what_would_send_the_raw_range(args):
+    with pytest.raises(ValueError):
+        parse_query(args, NOW)
+
+
+def test_history_answers_400_for_too_few_points():
+    import ems
+    app = ems.create_app({"EMS_RELAY_LOCK": ""})
+    client = app.test_client()
+    assert client.get("/history?points=0").status_code == 400
+    assert client.get("/history?from=nan").status_code == 400
+    assert client.get("/history?points=3").status_code == 200
+    app.extensions["ems"].control_loop.stop()
@@ -0,0 +1,22 @@
+from engine import VirtualClock
+
+
+def test_events_and_samples_share_the_system_clock():
+    import ems
+    system = ems.create_app({"EMS_RELAY_LOCK": ""}).extensions["ems"]
+    system.open()
+    clock = VirtualClock()
+    system.use_clock(clock)
+    system.control_loop.run_for(3600)  # an hour of samples, in well under a second
+    system.apply_control({"grid_available": False})
+    system.control_loop.run_for(10)
+
+    log = system.telemetry_log
+    timestamps = [t for t, _, _, _ in log.samples(0, float("inf"))]
+    events = log.events(0, float("inf"))
+    [(stamped, data)] = [(t, data) for t, kind, data in events if kind == "control"]
+    assert data == {"grid_available": False}
+    assert timestamps[0] + 3599 <= stamped <= timestamps[-1]
+    assert stamped == clock.time() - 10
+    # The transfer it caused, on the same timeline
+    assert [t for t, kind, _ in events if kind == "relays"][-1] == stamped